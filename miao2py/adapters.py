@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from . import transport as transports
+
+log = logging.getLogger(__name__)
+
+SYSFS_BLUETOOTH = "/sys/class/bluetooth"
+
+
+def enumerate_adapters(sysfs=SYSFS_BLUETOOTH):
+    """names of the HCI adapters the kernel knows about, hci0 first"""
+    try:
+        names = os.listdir(sysfs)
+    except FileNotFoundError:
+        return []
+    found = [name for name in names if re.match(r"^hci\d+$", name)]
+    return sorted(found, key=lambda name: int(name[3:]))
+
+
+class Adapter:
+    """one HCI controller and the readers assigned to it
+
+       `slots` bounds the concurrent connections made through it
+    """
+
+    def __init__(self, name, concurrency=1):
+        match = re.match(r"^hci(\d+)$", name)
+        if not match:
+            raise ValueError("not an HCI adapter name: {}".format(name))
+        self.name = name
+        self.index = int(match.group(1))
+        self.concurrency = concurrency
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.devices = set()
+        # readers whose reads failed here since its last successful read,
+        # and the count of all failed reads
+        self.failing = set()
+        self.errors = 0
+        self.disabled_until = 0.0
+
+    def __repr__(self):
+        return "<{} {} load={} errors={}>".format(
+            type(self).__name__, self.name, self.load, self.errors
+        )
+
+    @property
+    def load(self):
+        return len(self.devices)
+
+
+class AdapterScheduler:
+    """Spreads readers across HCI adapters
+
+       each reader is assigned to the healthy adapter with the lowest
+       score: its load (readers assigned) less rssi_weight times the
+       best RSSI that adapter has reported for the reader, so 10 dB of
+       signal is worth one reader of load at the default weight (RSSI
+       comes from observe(), e.g. by a device.MiaoMiaoScanner scanning
+       on each adapter).  When max_failures different readers fail on
+       an adapter with no successful read in between, it is left out
+       for `quarantine` seconds and its readers are reassigned; one
+       reader failing over and over (say out of range) only moves that
+       reader on.
+
+       bind(device) points a device's transport at its adapter; slot()
+       holds one of the adapter's connection slots while reading.
+
+       usage:
+
+       scheduler = AdapterScheduler()
+       btle.Scanner(1).withDelegate(MiaoMiaoScanner(adapters=scheduler, iface=1))
+       scheduler.read_all(devices, read)
+    """
+
+    # RSSI assumed for an adapter that never heard a reader
+    unknown_rssi = -100
+
+    def __init__(
+        self,
+        adapters=None,
+        *,
+        concurrency=1,
+        max_failures=3,
+        quarantine=60.0,
+        rssi_weight=0.1,
+        transport_factory=None,
+        clock=time.monotonic
+    ):
+        names = enumerate_adapters() if adapters is None else adapters
+        self.adapters = [
+            adapter if isinstance(adapter, Adapter) else Adapter(adapter, concurrency)
+            for adapter in names
+        ]
+        if not self.adapters:
+            raise ValueError("no bluetooth adapters")
+        self.max_failures = max_failures
+        self.quarantine = quarantine
+        self.rssi_weight = rssi_weight
+        self.transport_factory = transport_factory or (
+            lambda adapter: transports.create("bluepy", iface=adapter.index)
+        )
+        self.clock = clock
+        self.lock = threading.RLock()
+        # btaddr -> Adapter
+        self.assignments = {}
+        # (btaddr, adapter name) -> RSSI
+        self.rssi = {}
+        # btaddr -> (Adapter, transport) handed out by bind()
+        self.transports = {}
+        # btaddr -> Adapter its last read failed on
+        self.failed_on = {}
+
+    def __repr__(self):
+        return "<{} {}>".format(type(self).__name__, self.adapters)
+
+    def adapter(self, name):
+        for adapter in self.adapters:
+            if adapter.name == name:
+                return adapter
+        raise ValueError("unknown adapter: {}".format(name))
+
+    def observe(self, btaddr, adapter, rssi):
+        """an advertisement from btaddr was heard on adapter at rssi"""
+        with self.lock:
+            self.rssi[btaddr, adapter] = rssi
+
+    def healthy(self):
+        now = self.clock()
+        return [adapter for adapter in self.adapters if adapter.disabled_until <= now]
+
+    def _score(self, adapter, btaddr):
+        load = adapter.load - (btaddr in adapter.devices)
+        rssi = self.rssi.get((btaddr, adapter.name), self.unknown_rssi)
+        # prefer anywhere else after a failure
+        penalty = 1 if self.failed_on.get(btaddr) is adapter else 0
+        return load + penalty - self.rssi_weight * (rssi - self.unknown_rssi)
+
+    def assign(self, btaddr):
+        """the adapter btaddr should be read through"""
+        with self.lock:
+            candidates = self.healthy() or self.adapters
+            current = self.assignments.get(btaddr)
+            if current in candidates:
+                return current
+            best = min(candidates, key=lambda adapter: self._score(adapter, btaddr))
+            self._move(btaddr, best)
+            return best
+
+    def _move(self, btaddr, adapter):
+        current = self.assignments.pop(btaddr, None)
+        if current is not None:
+            current.devices.discard(btaddr)
+        if adapter is not None:
+            adapter.devices.add(btaddr)
+            self.assignments[btaddr] = adapter
+            log.debug("%s assigned to %s", btaddr, adapter.name)
+
+    def rebalance(self):
+        """reassign every reader from scratch, e.g. after new RSSI"""
+        with self.lock:
+            readers = sorted(set(self.assignments) | set(self.transports))
+            for btaddr in readers:
+                self._move(btaddr, None)
+            for btaddr in readers:
+                self.assign(btaddr)
+
+    def bind(self, device):
+        """give device a transport on its assigned adapter"""
+        adapter = self.assign(device.btaddr)
+        with self.lock:
+            bound = self.transports.get(device.btaddr)
+            if bound is None or bound[0] is not adapter:
+                bound = self.transports[device.btaddr] = (
+                    adapter,
+                    self.transport_factory(adapter),
+                )
+            device.transport = bound[1]
+        return adapter
+
+    @contextmanager
+    def slot(self, device):
+        """bind device and hold one of its adapter's slots"""
+        adapter = self.bind(device)
+        with adapter.slots:
+            yield adapter
+
+    def failed(self, btaddr):
+        """a read of btaddr failed on its adapter"""
+        with self.lock:
+            adapter = self.assignments.get(btaddr)
+            if adapter is None:
+                return
+            adapter.failing.add(btaddr)
+            adapter.errors += 1
+            # let the reader try elsewhere next time
+            self.failed_on[btaddr] = adapter
+            self._move(btaddr, None)
+            if len(adapter.failing) >= self.max_failures:
+                log.warning(
+                    "%s failed reads of %d readers in a row, resting it for %0.0fs",
+                    adapter.name,
+                    len(adapter.failing),
+                    self.quarantine,
+                )
+                adapter.disabled_until = self.clock() + self.quarantine
+                adapter.failing.clear()
+                for moved in sorted(adapter.devices):
+                    self._move(moved, None)
+
+    def succeeded(self, btaddr):
+        with self.lock:
+            self.failed_on.pop(btaddr, None)
+            adapter = self.assignments.get(btaddr)
+            if adapter is not None:
+                adapter.failing.clear()
+
+    def read_all(self, devices, read):
+        """run read(device) for every device, in parallel across adapters
+           and at most `concurrency` at a time per adapter; returns
+           {btaddr: result or exception}
+        """
+        def one(device):
+            try:
+                with self.slot(device):
+                    result = read(device)
+            except Exception as exc:
+                log.warning("%s: %s", device.btaddr, exc)
+                self.failed(device.btaddr)
+                return exc
+            self.succeeded(device.btaddr)
+            return result
+
+        devices = list(devices)
+        if not devices:
+            return {}
+        with ThreadPoolExecutor(max_workers=len(devices)) as pool:
+            results = pool.map(one, devices)
+            return {device.btaddr: result for device, result in zip(devices, results)}
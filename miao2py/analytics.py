@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+from collections import OrderedDict, deque
+
+from .delta import DeltaTracker
+
+log = logging.getLogger(__name__)
+
+ANALYTICS_SUFFIX = "/analytics"
+
+# (lowest slope in mg/dL per minute, arrow), steepest first
+arrows = (
+    (3.0, "DoubleUp"),
+    (2.0, "SingleUp"),
+    (1.0, "FortyFiveUp"),
+    (-1.0, "Flat"),
+    (-2.0, "FortyFiveDown"),
+    (-3.0, "SingleDown"),
+    (float("-inf"), "DoubleDown"),
+)
+
+
+def arrow(slope):
+    """trend arrow name for a slope in mg/dL per minute"""
+    if slope is None:
+        return "NotComputable"
+    for floor, name in arrows:
+        if slope >= floor:
+            return name
+
+
+class RollingRegression:
+    """least-squares line through the readings of the last `window`
+       minutes, kept as running sums so each reading is O(1)
+
+       minutes are taken relative to the first one seen, keeping the
+       sums small enough not to lose precision
+    """
+
+    __slots__ = ("window", "points", "origin", "n", "sx", "sy", "sxx", "sxy")
+
+    def __init__(self, window=15):
+        self.window = window
+        self.points = deque()
+        self.origin = None
+        self.n = 0
+        self.sx = self.sy = self.sxx = self.sxy = 0.0
+
+    def add(self, minute, value):
+        if self.origin is None:
+            self.origin = minute
+        x = minute - self.origin
+        self.points.append((x, value))
+        self.n += 1
+        self.sx += x
+        self.sy += value
+        self.sxx += x * x
+        self.sxy += x * value
+        while self.points and self.points[0][0] <= x - self.window:
+            old_x, old_value = self.points.popleft()
+            self.n -= 1
+            self.sx -= old_x
+            self.sy -= old_value
+            self.sxx -= old_x * old_x
+            self.sxy -= old_x * old_value
+
+    @property
+    def slope(self):
+        """per minute, or None with fewer than two distinct minutes"""
+        spread = self.n * self.sxx - self.sx * self.sx
+        if self.n < 2 or spread <= 0:
+            return None
+        return (self.n * self.sxy - self.sx * self.sy) / spread
+
+    def fitted(self, minute):
+        """the regression line's value at minute"""
+        slope = self.slope
+        if slope is None:
+            return self.points[-1][1] if self.points else None
+        intercept = (self.sy - slope * self.sx) / self.n
+        return intercept + slope * (minute - self.origin)
+
+
+class Holt:
+    """double exponential smoothing: a level and a per-minute trend"""
+
+    __slots__ = ("alpha", "beta", "level", "trend", "minute")
+
+    def __init__(self, alpha=0.5, beta=0.3):
+        self.alpha = alpha
+        self.beta = beta
+        self.level = self.trend = self.minute = None
+
+    def add(self, minute, value):
+        if self.level is None:
+            self.level, self.trend, self.minute = value, 0.0, minute
+            return
+        elapsed = max(1, minute - self.minute)
+        predicted = self.level + self.trend * elapsed
+        level = self.alpha * value + (1 - self.alpha) * predicted
+        self.trend = (
+            self.beta * (level - self.level) / elapsed + (1 - self.beta) * self.trend
+        )
+        self.level, self.minute = level, minute
+
+    def forecast(self, ahead):
+        if self.level is None:
+            return None
+        return self.level + self.trend * ahead
+
+
+class _SensorState:
+    __slots__ = ("regressions", "holt", "minute", "value")
+
+    def __init__(self, windows, alpha, beta):
+        self.regressions = [RollingRegression(window) for window in windows]
+        self.holt = Holt(alpha, beta)
+        self.minute = None
+        self.value = None
+
+
+class StreamAnalytics:
+    """Rate of change, trend arrow and short forecasts per sensor,
+       updated one reading at a time
+
+       feed it the new trend readings of a DeltaTracker (readings at or
+       before the last one seen are ignored).  Each window keeps a
+       rolling regression; the arrow comes from the first window's
+       slope; forecasts are given for each horizon both along that
+       regression line ("linear") and by Holt smoothing ("holt").
+
+       usage:
+
+       analytics = StreamAnalytics(windows=(5, 15), horizons=(10, 20, 30))
+       result = analytics.update_packet(packet)
+       print(result["arrow"], result["forecast"]["linear"][20])
+    """
+
+    def __init__(
+        self,
+        windows=(15,),
+        horizons=(10, 20, 30),
+        *,
+        alpha=0.5,
+        beta=0.3,
+        max_sensors=64,
+        tracker=None
+    ):
+        if not windows:
+            raise ValueError("at least one regression window is required")
+        self.windows = tuple(windows)
+        self.horizons = tuple(horizons)
+        self.alpha = alpha
+        self.beta = beta
+        self.max_sensors = max_sensors
+        self.tracker = tracker or DeltaTracker(max_sensors)
+        self.sensors = OrderedDict()
+
+    def __repr__(self):
+        return "<{} windows={} sensors={}>".format(
+            type(self).__name__, self.windows, len(self.sensors)
+        )
+
+    def _state(self, sensor):
+        state = self.sensors.get(sensor)
+        if state is None:
+            state = self.sensors[sensor] = _SensorState(self.windows, self.alpha, self.beta)
+            while len(self.sensors) > self.max_sensors:
+                self.sensors.popitem(last=False)
+        else:
+            self.sensors.move_to_end(sensor)
+        return state
+
+    def add(self, sensor, minute, value):
+        """one glucose reading at a sensor minute"""
+        state = self._state(sensor)
+        if state.minute is not None and minute <= state.minute:
+            return
+        for regression in state.regressions:
+            regression.add(minute, value)
+        state.holt.add(minute, value)
+        state.minute, state.value = minute, value
+
+    def update(self, readings):
+        """add the trend readings among DeltaTracker readings"""
+        for reading in readings:
+            if reading.kind == DeltaTracker.TREND:
+                self.add(reading.sensor, reading.minute, reading.values[0])
+
+    def result(self, sensor):
+        """the current analytics of a sensor, or None if unseen"""
+        state = self.sensors.get(sensor)
+        if state is None or state.minute is None:
+            return None
+        primary = state.regressions[0]
+        linear = {}
+        for ahead in self.horizons:
+            fitted = primary.fitted(state.minute + ahead)
+            linear[ahead] = None if primary.slope is None else round(fitted, 1)
+        return {
+            "minute": state.minute,
+            "value": round(state.value, 1),
+            "slope": {
+                regression.window: None if regression.slope is None else round(regression.slope, 3)
+                for regression in state.regressions
+            },
+            "arrow": arrow(primary.slope),
+            "forecast": {
+                "linear": linear,
+                "holt": {
+                    ahead: round(state.holt.forecast(ahead), 1) for ahead in self.horizons
+                },
+            },
+        }
+
+    def update_packet(self, packet, received=None, readings=None):
+        """feed a MiaoMiaoPacket's new readings and attach the result to
+           it as packet.analytics; pass readings if the caller already
+           ran them through its own DeltaTracker
+        """
+        if readings is None:
+            readings = self.tracker.update(packet, received)
+        self.update(readings)
+        packet.analytics = self.result(packet.sensor_id)
+        return packet.analytics
+
+    def forget(self, sensor):
+        self.sensors.pop(sensor, None)
+        self.tracker.forget(sensor)
+
+
+def analytics_topic(topic):
+    return topic + ANALYTICS_SUFFIX
+
+
+def encode(result):
+    """JSON payload of a result (horizon and window keys as strings)"""
+    return json.dumps(result, sort_keys=True).encode()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+import heapq
+import logging
+import mmap
+import os
+import struct
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+log = logging.getLogger(__name__)
+
+ArchivedFrame = namedtuple("ArchivedFrame", ["timestamp", "device", "serial", "frame"])
+
+
+def pack_address(btaddr):
+    """'ff:ff:ff:ff:ff:ff' -> 6 bytes"""
+    return bytes.fromhex(btaddr.replace(":", ""))
+
+
+def unpack_address(packed):
+    """6 bytes -> 'ff:ff:ff:ff:ff:ff'"""
+    return ":".join("{:02x}".format(octet) for octet in packed)
+
+
+class FrameArchive:
+    """Append-only archive of raw miaomiao frames
+
+       the data file is a 16 byte header followed by fixed-size records
+       of receive timestamp, device address, sensor serial (E3-12) and
+       the frame itself, so record n lives at a computable offset.  A
+       sidecar <path>.idx holds (device, timestamp, record) entries so
+       readers can find a device's time range without touching the data.
+
+       usage:
+
+       with FrameArchive("frames.m2pa") as archive:
+           archive.append("ff:ff:ff:ff:ff:ff", frame)
+    """
+
+    magic = b"M2PA"
+    version = 1
+    header = struct.Struct("<4sHHQ")
+    # timestamp, device, serial, frame length, frame, padding
+    record = struct.Struct("<d6s10sH363sxxx")
+    record_header = struct.Struct("<d6s10sH")
+    index_entry = struct.Struct("<6sdQ")
+    frame_size = 363
+    # where the frame starts within a record
+    frame_offset = record_header.size
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + ".idx"
+        self.file = open(path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(
+                self.header.pack(self.magic, self.version, self.record.size, 0)
+            )
+            self.file.flush()
+        else:
+            self.check_header(path)
+        self.count = (self.file.tell() - self.header.size) // self.record.size
+        self._repair()
+        self.index = open(self.index_path, "ab")
+
+    def _repair(self):
+        """drop a record torn by a crash mid-append, so later records
+           stay aligned, and bring the index level with the records
+        """
+        size = self.header.size + self.count * self.record.size
+        if self.file.tell() != size:
+            log.warning(
+                "%s: dropping %d bytes of a torn record", self.path, self.file.tell() - size
+            )
+            self.file.truncate(size)
+        entry = self.index_entry
+        try:
+            nentries = os.path.getsize(self.index_path) // entry.size
+        except FileNotFoundError:
+            nentries = 0
+        with open(self.index_path, "r+b" if nentries else "wb") as index:
+            index.truncate(min(nentries, self.count) * entry.size)
+            if nentries >= self.count:
+                return
+            log.info("%s: indexing records %d to %d", self.path, nentries, self.count - 1)
+            index.seek(0, os.SEEK_END)
+            with open(self.path, "rb") as archive:
+                for recno in range(nentries, self.count):
+                    archive.seek(self.header.size + recno * self.record.size)
+                    timestamp, device = struct.unpack("<d6s", archive.read(14))
+                    index.write(entry.pack(device, timestamp, recno))
+
+    @classmethod
+    def check_header(cls, path):
+        with open(path, "rb") as archive:
+            magic, version, record_size, _ = cls.header.unpack(
+                archive.read(cls.header.size)
+            )
+        if magic != cls.magic or record_size != cls.record.size:
+            raise ValueError("{} is not a frame archive".format(path))
+        if version != cls.version:
+            raise ValueError("unsupported archive version {}".format(version))
+
+    def __repr__(self):
+        return "<{} {} records={}>".format(type(self).__name__, self.path, self.count)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def append(self, btaddr, frame, timestamp=None):
+        """archive one raw frame as received from btaddr"""
+        if len(frame) > self.frame_size:
+            raise ValueError("frame too long to archive: {}".format(len(frame)))
+        timestamp = time.time() if timestamp is None else timestamp
+        device = pack_address(btaddr)
+        self.file.write(
+            self.record.pack(timestamp, device, bytes(frame[3:13]), len(frame), bytes(frame))
+        )
+        self.index.write(self.index_entry.pack(device, timestamp, self.count))
+        self.file.flush()
+        self.index.flush()
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+        self.index.close()
+
+
+class ArchiveReader:
+    """Memory-mapped reader for a FrameArchive
+
+       frames come back as memoryviews into the mapping, ready for
+       MiaoMiaoPacket.from_bytes without copying; release them before
+       close().  A missing or short index is rebuilt from the data.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        FrameArchive.check_header(path)
+        self.file = open(path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        self.count = (size - FrameArchive.header.size) // FrameArchive.record.size
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mmap)
+        self.devices = {}
+        self._load_index(path + ".idx")
+
+    def __repr__(self):
+        return "<{} {} records={}>".format(type(self).__name__, self.path, self.count)
+
+    def __len__(self):
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _index_entries(self, index_path):
+        entry = FrameArchive.index_entry
+        try:
+            with open(index_path, "rb") as index:
+                data = index.read()
+        except FileNotFoundError:
+            data = b""
+        nentries = min(len(data) // entry.size, self.count)
+        yield from entry.iter_unpack(data[: nentries * entry.size])
+        if nentries < self.count:
+            log.info("rebuilding index of %s from record %d", self.path, nentries)
+            for recno in range(nentries, self.count):
+                timestamp, device = struct.unpack_from("<d6s", self.view, self._offset(recno))
+                yield device, timestamp, recno
+
+    def _load_index(self, index_path):
+        for device, timestamp, recno in self._index_entries(index_path):
+            times, recnos = self.devices.setdefault(
+                unpack_address(device), (array("d"), array("Q"))
+            )
+            times.append(timestamp)
+            recnos.append(recno)
+        for btaddr, (times, recnos) in self.devices.items():
+            if any(times[i] > times[i + 1] for i in range(len(times) - 1)):
+                order = sorted(range(len(times)), key=times.__getitem__)
+                self.devices[btaddr] = (
+                    array("d", (times[i] for i in order)),
+                    array("Q", (recnos[i] for i in order)),
+                )
+
+    @staticmethod
+    def _offset(recno):
+        return FrameArchive.header.size + recno * FrameArchive.record.size
+
+    def read(self, recno):
+        """the ArchivedFrame at record number recno"""
+        offset = self._offset(recno)
+        timestamp, device, serial, length = FrameArchive.record_header.unpack_from(
+            self.view, offset
+        )
+        frame_offset = offset + FrameArchive.frame_offset
+        return ArchivedFrame(
+            timestamp,
+            unpack_address(device),
+            serial,
+            self.view[frame_offset : frame_offset + length],
+        )
+
+    def _range(self, btaddr, start, end):
+        times, recnos = self.devices.get(btaddr, ((), ()))
+        low = 0 if start is None else bisect_left(times, start)
+        high = len(times) if end is None else bisect_right(times, end)
+        return ((times[i], recnos[i]) for i in range(low, high))
+
+    def scan(self, btaddr=None, start=None, end=None):
+        """yield ArchivedFrames in time order, optionally for one device
+           and/or between start and end timestamps (inclusive)
+        """
+        if btaddr is not None:
+            ranges = [self._range(btaddr, start, end)]
+        else:
+            ranges = [self._range(device, start, end) for device in self.devices]
+        for _, recno in heapq.merge(*ranges):
+            yield self.read(recno)
+
+    def close(self):
+        self.view.release()
+        self.mmap.close()
+        self.file.close()
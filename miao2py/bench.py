@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+
+import logging
+import json
+import resource
+import subprocess
+import sys
+import time
+from collections import OrderedDict, namedtuple
+
+from .device import MiaoMiaoDevice
+from .framing import FrameReassembler
+from .packet import LibrePacket, MiaoMiaoPacket
+from .replay import ReplayTransport, fragment, synthetic_frame
+
+log = logging.getLogger(__name__)
+
+BenchResult = namedtuple(
+    "BenchResult", ["stage", "frames", "seconds", "fps", "p50", "p99", "peak_rss"]
+)
+
+
+def peak_rss():
+    """peak resident set size of this process, in bytes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports KiB, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(stage, latencies, seconds):
+    ordered = sorted(latencies)
+    return BenchResult(
+        stage=stage,
+        frames=len(latencies),
+        seconds=seconds,
+        fps=len(latencies) / seconds if seconds else 0.0,
+        p50=percentile(ordered, 0.50),
+        p99=percentile(ordered, 0.99),
+        peak_rss=peak_rss(),
+    )
+
+
+def timed(stage, items, func):
+    """run func over items, timing each call"""
+    perf = time.perf_counter
+    latencies = []
+    started = perf()
+    for item in items:
+        before = perf()
+        func(item)
+        latencies.append(perf() - before)
+    return summarize(stage, latencies, perf() - started)
+
+
+def bench_reassembly(frames, mtu=20):
+    reassembler = FrameReassembler()
+    pieces = [fragment(frame, mtu) for frame in frames]
+
+    def feed(fragments):
+        for piece in fragments:
+            reassembler.feed(piece)
+
+    return timed("reassembly", pieces, feed)
+
+
+def bench_decode(frames, mtu=20):
+    return timed("decode", frames, MiaoMiaoPacket.from_bytes)
+
+
+def bench_decode_lazy(frames, mtu=20):
+    return timed(
+        "decode-lazy",
+        frames,
+        lambda frame: MiaoMiaoPacket.from_bytes(frame, lazy=True).librepacket.trend(),
+    )
+
+
+def bench_crc(frames, mtu=20):
+    return timed("crc", [frame[18:362] for frame in frames], LibrePacket.verify)
+
+
+class _CountingDevice(MiaoMiaoDevice):
+    packets = 0
+
+    def handlePacket(self, data):
+        super().handlePacket(data)
+        MiaoMiaoPacket.from_bytes(data)
+        self.packets += 1
+
+
+def bench_device(frames, mtu=20):
+    """replayed notifications through MiaoMiaoDevice, read request to
+       decoded packet
+    """
+    device = _CountingDevice("00:00:00:00:00:00", transport=ReplayTransport(frames, mtu=mtu))
+    device.connect()
+    device.start_notify()
+    perf = time.perf_counter
+    latencies = []
+    started = perf()
+    for expected in range(1, len(frames) + 1):
+        before = perf()
+        if expected > 1:
+            device.start_data_notify()
+        while device.packets < expected and device.notify_wait(0.1):
+            pass
+        latencies.append(perf() - before)
+    seconds = perf() - started
+    device.disconnect()
+    return summarize("device", latencies, seconds)
+
+
+class _NullClient:
+    """MQTT client that acknowledges everything instantly"""
+
+    received = []
+
+    async def connect(self, url):
+        return 0
+
+    async def publish(self, topic, message, qos=None):
+        self.received.append(time.perf_counter())
+
+    async def disconnect(self):
+        pass
+
+
+def bench_publish(frames, mtu=20):
+    """submit to acknowledgement through a PublishQueue"""
+    from .mqpub import PublishQueue
+
+    _NullClient.received = []
+    queue = PublishQueue(
+        "mqtt://localhost", maxsize=len(frames), batch_size=16, client_factory=_NullClient
+    )
+    queue.start()
+    perf = time.perf_counter
+    submitted = []
+    started = perf()
+    for frame in frames:
+        submitted.append(perf())
+        queue.submit("bench", frame)
+    queue.stop()
+    seconds = perf() - started
+    latencies = [done - sent for sent, done in zip(submitted, _NullClient.received)]
+    return summarize("publish", latencies, seconds)
+
+
+# modules a cold start of the offline decoder must not load
+heavy_modules = ("bluepy", "hbmqtt", "asyncio", "click", "numpy", "http.server")
+
+_import_probe = """
+import json, sys, time
+started = time.perf_counter()
+import miao2py.offline, miao2py.packet
+took = time.perf_counter() - started
+print(json.dumps([took, [name for name in {heavy!r} if name in sys.modules]]))
+"""
+
+
+def bench_import(frames, mtu=20):
+    """cold imports of the offline decode path, each in a fresh
+       interpreter; fails if it loads a transport or other heavy module
+    """
+    probe = _import_probe.format(heavy=heavy_modules)
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(min(len(frames), 20)):
+        output = subprocess.check_output([sys.executable, "-c", probe])
+        took, loaded = json.loads(output.decode())
+        if loaded:
+            raise RuntimeError(
+                "offline decode imported {}".format(", ".join(loaded))
+            )
+        latencies.append(took)
+    return summarize("import", latencies, time.perf_counter() - started)
+
+
+stages = OrderedDict(
+    [
+        ("reassembly", bench_reassembly),
+        ("decode", bench_decode),
+        ("decode-lazy", bench_decode_lazy),
+        ("crc", bench_crc),
+        ("device", bench_device),
+        ("publish", bench_publish),
+        ("import", bench_import),
+    ]
+)
+
+
+def run(names=None, nframes=1000, mtu=20):
+    """run the named stages (default: all) over synthetic frames"""
+    frames = [
+        synthetic_frame(seed, minutes=1440 + seed, battery=seed % 101)
+        for seed in range(nframes)
+    ]
+    results = []
+    for name in names or stages:
+        try:
+            results.append(stages[name](frames, mtu))
+        except ImportError as exc:
+            log.warning("skipping %s: %s", name, exc)
+    return results
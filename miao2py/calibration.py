@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+
+import logging
+from collections import OrderedDict, namedtuple
+
+from .packet import LibrePacket, MiaoMiaoPacket
+
+log = logging.getLogger(__name__)
+
+# calibration info the sensor carries in its header (i1, i2) and footer
+# (i3 - i6), as laid out by the open Libre readers
+SensorParameters = namedtuple("SensorParameters", ["i1", "i2", "i3", "i4", "i5", "i6"])
+
+
+def read_bits(data, byte_offset, bit_offset, bit_count):
+    """bit_count bits starting bit_offset bits into data[byte_offset:],
+       least significant first
+    """
+    value = 0
+    for ibit in range(bit_count):
+        position = byte_offset * 8 + bit_offset + ibit
+        if (data[position // 8] >> (position % 8)) & 1:
+            value |= 1 << ibit
+    return value
+
+
+def sensor_parameters(payload):
+    """SensorParameters of a Libre payload (the 344 byte FRAM image)"""
+    i3 = read_bits(payload, 0x150, 0, 8)
+    if read_bits(payload, 0x150, 0x21, 1):
+        i3 = -i3
+    return SensorParameters(
+        i1=read_bits(payload, 2, 0, 3),
+        i2=read_bits(payload, 2, 3, 0xA),
+        i3=i3,
+        i4=read_bits(payload, 0x150, 8, 0xE),
+        i5=read_bits(payload, 0x150, 0x28, 0xC) << 2,
+        i6=read_bits(payload, 0x150, 0x34, 0xC) << 2,
+    )
+
+
+class LinearConverter:
+    """glucose = slope * raw + offset
+
+       raw is the first word of a ring entry under raw_mask; the
+       defaults reproduce LibrePacket's raw / 8.5
+
+       usage:
+
+       converter = LinearConverter(slope=1 / 9.0, offset=-4.0)
+       packet = LibrePacket.from_bytes(data, converter=converter)
+    """
+
+    def __init__(self, slope=1 / LibrePacket.glucose_divisor, offset=0.0, raw_mask=0xFFFF):
+        self.slope = slope
+        self.offset = offset
+        self.raw_mask = raw_mask
+
+    def __repr__(self):
+        return "<{} slope={:0.5f} offset={:0.2f}>".format(
+            type(self).__name__, self.slope, self.offset
+        )
+
+    def convert(self, raw, aux1=0, aux2=0):
+        return self.slope * (raw & self.raw_mask) + self.offset
+
+    def convert_ring(self, entries):
+        """[glucose, aux1, aux2] for each (raw, aux1, aux2) entry"""
+        convert = self.convert
+        return [[convert(*entry), entry[1], entry[2]] for entry in entries]
+
+    def convert_array(self, words):
+        """glucose for a numpy array of entries (..., 3) of uint16 words"""
+        raw = words[..., 0] & self.raw_mask
+        return self.slope * raw + self.offset
+
+
+class TemperatureConverter(LinearConverter):
+    """linear conversion corrected for the sensor temperature
+
+       temperature is one auxiliary word of the entry (temp_word 1 or
+       2) under temp_mask; the correction is temp_slope per unit away
+       from temp_reference:
+
+       glucose = slope * raw + offset + temp_slope * (temp - temp_reference)
+    """
+
+    def __init__(
+        self,
+        slope=1 / LibrePacket.glucose_divisor,
+        offset=0.0,
+        raw_mask=0x3FFF,
+        *,
+        temp_slope=0.0,
+        temp_reference=0,
+        temp_word=2,
+        temp_mask=0x3FFF
+    ):
+        super().__init__(slope, offset, raw_mask)
+        if temp_word not in (1, 2):
+            raise ValueError("temperature is auxiliary word 1 or 2, not {}".format(temp_word))
+        self.temp_slope = temp_slope
+        self.temp_reference = temp_reference
+        self.temp_word = temp_word
+        self.temp_mask = temp_mask
+
+    def convert(self, raw, aux1=0, aux2=0):
+        temp = (aux1 if self.temp_word == 1 else aux2) & self.temp_mask
+        return (
+            self.slope * (raw & self.raw_mask)
+            + self.offset
+            + self.temp_slope * (temp - self.temp_reference)
+        )
+
+    def convert_array(self, words):
+        temp = words[..., self.temp_word] & self.temp_mask
+        return super().convert_array(words) + self.temp_slope * (
+            temp.astype("f8") - self.temp_reference
+        )
+
+
+class CalibratedConverter(LinearConverter):
+    """another converter corrected by a least-squares line through user
+       calibration points (converted value, reference value)
+
+       one point only shifts; two or more fit gain and shift
+    """
+
+    def __init__(self, base=None, points=()):
+        super().__init__()
+        self.base = base or LinearConverter()
+        self.points = []
+        self.gain, self.shift = 1.0, 0.0
+        for entry, reference in points:
+            self.add_point(entry, reference)
+
+    def __repr__(self):
+        return "<{} {!r} points={} gain={:0.3f} shift={:0.2f}>".format(
+            type(self).__name__, self.base, len(self.points), self.gain, self.shift
+        )
+
+    def add_point(self, entry, reference):
+        """entry is the (raw, aux1, aux2) words read alongside a
+           reference (e.g. fingerstick) value
+        """
+        self.points.append((self.base.convert(*entry), reference))
+        self.fit()
+
+    def fit(self):
+        npoints = len(self.points)
+        if not npoints:
+            self.gain, self.shift = 1.0, 0.0
+            return
+        mean_x = sum(x for x, _ in self.points) / npoints
+        mean_y = sum(y for _, y in self.points) / npoints
+        spread = sum((x - mean_x) ** 2 for x, _ in self.points)
+        if npoints < 2 or not spread:
+            self.gain, self.shift = 1.0, mean_y - mean_x
+            return
+        self.gain = sum((x - mean_x) * (y - mean_y) for x, y in self.points) / spread
+        self.shift = mean_y - self.gain * mean_x
+        log.debug("calibration fit: %r", self)
+
+    def convert(self, raw, aux1=0, aux2=0):
+        return self.gain * self.base.convert(raw, aux1, aux2) + self.shift
+
+    def convert_array(self, words):
+        return self.gain * self.base.convert_array(words) + self.shift
+
+
+class ConversionEngine:
+    """Picks and caches a converter per sensor serial
+
+       the first packet of a sensor has its SensorParameters read from
+       the header and footer; `factory(parameters)` then builds the
+       sensor's converter (default: a LinearConverter, since the mapping
+       from parameters to slope and offset is not public).  Calibration
+       points wrap that converter in a CalibratedConverter.  At most
+       max_sensors are remembered, least recently used going first.
+
+       usage:
+
+       engine = ConversionEngine()
+       packet = engine.decode(frame)
+       engine.calibrate(packet.sensor_id, packet.payload, 104.0)
+       batch = engine.convert_batch(serials, payloads)
+    """
+
+    def __init__(self, factory=None, max_sensors=64):
+        self.factory = factory or (lambda parameters: LinearConverter())
+        self.max_sensors = max_sensors
+        self.sensors = OrderedDict()
+
+    def __repr__(self):
+        return "<{} sensors={}>".format(type(self).__name__, len(self.sensors))
+
+    def _sensor(self, serial, payload):
+        sensor = self.sensors.get(serial)
+        if sensor is None:
+            if payload is None:
+                raise ValueError("no parameters known for sensor {!r}".format(serial))
+            parameters = sensor_parameters(payload)
+            log.debug("%r: %s", serial, parameters)
+            sensor = self.sensors[serial] = [parameters, self.factory(parameters)]
+            while len(self.sensors) > self.max_sensors:
+                self.sensors.popitem(last=False)
+        else:
+            self.sensors.move_to_end(serial)
+        return sensor
+
+    def parameters(self, serial, payload=None):
+        return self._sensor(serial, payload)[0]
+
+    def converter(self, serial, payload=None):
+        return self._sensor(serial, payload)[1]
+
+    def calibrate(self, serial, payload, reference):
+        """calibrate a sensor's newest trend reading against reference"""
+        sensor = self._sensor(serial, payload)
+        if not isinstance(sensor[1], CalibratedConverter):
+            sensor[1] = CalibratedConverter(sensor[1])
+        index = payload[26]
+        newest = LibrePacket.ring_words(payload, LibrePacket.trend_ring, index)[0]
+        sensor[1].add_point(newest, reference)
+        return sensor[1]
+
+    def forget(self, serial):
+        self.sensors.pop(serial, None)
+
+    def decode(self, data, timestamp=None, **kwargs):
+        """MiaoMiaoPacket.from_bytes with the sensor's converter"""
+        serial = bytes(data[3:13])
+        converter = self.converter(serial, data[18:362])
+        return MiaoMiaoPacket.from_bytes(data, timestamp, converter=converter, **kwargs)
+
+    def convert_batch(self, serials, payloads):
+        """LibrePacket.decode_batch of payloads with each converted by its
+           own sensor's converter, one vectorized pass per sensor
+        """
+        import numpy
+
+        payloads = list(payloads)
+        batch = LibrePacket.decode_batch(payloads, raw=True)
+        trends = batch.trends.astype(numpy.float64)
+        history = batch.history.astype(numpy.float64)
+        serials = list(serials)
+        for serial in set(serials):
+            rows = [irow for irow, each in enumerate(serials) if each == serial]
+            converter = self.converter(serial, payloads[rows[0]])
+            trends[rows, :, 0] = converter.convert_array(batch.trends[rows])
+            history[rows, :, 0] = converter.convert_array(batch.history[rows])
+        return batch._replace(trends=trends, history=history)
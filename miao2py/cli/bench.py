@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+import click
+import json
+import logging
+import sys
+
+from miao2py import bench as benchmarks
+
+log = logging.getLogger(__name__)
+
+
+def parse_floors(floors):
+    parsed = {}
+    for floor in floors:
+        stage, _, fps = floor.partition("=")
+        if stage not in benchmarks.stages or not fps:
+            raise click.BadParameter("expected STAGE=FPS, got {}".format(floor))
+        parsed[stage] = float(fps)
+    return parsed
+
+
+@click.command()
+@click.option("--frames", type=int, default=1000, help="synthetic frames per stage")
+@click.option("--stage", "names", multiple=True, type=click.Choice(list(benchmarks.stages)), help="stage to run (default: all)")
+@click.option("--mtu", type=int, default=20, help="notification fragment size")
+@click.option("--min-fps", "floors", multiple=True, help="fail unless STAGE=FPS is reached")
+@click.option("--json/--text", "as_json", default=False, help="machine readable output")
+def bench(frames, names, mtu, floors, as_json):
+    logging.basicConfig(level=logging.WARNING)
+    floors = parse_floors(floors)
+    results = benchmarks.run(names, frames, mtu)
+    if as_json:
+        print(json.dumps([result._asdict() for result in results], indent=2))
+    else:
+        print("{:<12} {:>8} {:>12} {:>10} {:>10} {:>10}".format(
+            "stage", "frames", "frames/s", "p50 us", "p99 us", "rss MiB"))
+        for result in results:
+            print("{:<12} {:>8} {:>12.0f} {:>10.1f} {:>10.1f} {:>10.1f}".format(
+                result.stage, result.frames, result.fps,
+                result.p50 * 1e6, result.p99 * 1e6, result.peak_rss / 2 ** 20))
+    failed = [
+        result.stage for result in results
+        if result.stage in floors and result.fps < floors[result.stage]
+    ]
+    if failed:
+        print("below --min-fps: {}".format(", ".join(failed)), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    bench()
@@ -1,59 +1,167 @@
 #!/usr/bin/env python3
 
+import atexit
 import click
 import code
 import logging
+import sys
 import time
 
-logging.basicConfig(level=logging.NOTSET)
-
-log = logging.getLogger(__name__)
-
+from miao2py import metrics, offline, shmring, trace, transport as transports
 from miao2py.device import MiaoMiaoDevice
 from miao2py.packet import MiaoMiaoPacket
+from miao2py.schedule import ReadScheduler
+from miao2py.transport import HandleCache
+
+log = logging.getLogger(__name__)
 
 
 class MiaoMiaoDecoder(MiaoMiaoDevice):
+    """keeps the last packet read, and how long it took to arrive from
+       the connect (or, when kept alive, the read request) before it
+    """
+
+    packet = None
+    latency = None
+    started = None
+    received = None
+
+    def connect(self):
+        self.started = time.monotonic()
+        super().connect()
+
+    def start_data_notify(self):
+        self.started = time.monotonic()
+        super().start_data_notify()
+
     def handlePacket(self, data):
         self.packet = MiaoMiaoPacket.from_bytes(data)
+        self.received = time.time()
+        self.latency = time.monotonic() - self.started
         super().handlePacket(data)
 
 
+def read(miaomiao):
+    """wait out one read, returning the state it ended in"""
+    miaomiao.notify_wait()
+    while miaomiao.state == miaomiao.STATE_READING:
+        miaomiao.notify_wait()
+    log.debug("device ended in state: %s", miaomiao.state)
+    return miaomiao.state
+
+
+def report(btaddr, miaomiao):
+    if miaomiao.state == miaomiao.STATE_NO_SENSOR:
+        print("{}: device reports no sensor attached".format(btaddr))
+    elif miaomiao.state == miaomiao.STATE_NEW_SENSOR:
+        print("{}: device reports new sensor attached (not allowed)".format(btaddr))
+    elif miaomiao.state == miaomiao.STATE_SENSOR_READ:
+        print("{}: sensor was read in {:0.2f}s".format(btaddr, miaomiao.latency))
+    else:
+        print("{}: It's Complicated".format(btaddr))
+    print(miaomiao.packet)
+
+
+def pause(miaomiao, interval, scheduler):
+    """sleep until the next read, per the scheduler if there is one"""
+    if not scheduler:
+        time.sleep(interval)
+        return
+    if miaomiao.state == miaomiao.STATE_SENSOR_READ:
+        scheduler.observe(
+            miaomiao.packet.librepacket.minutes, miaomiao.received, miaomiao.latency
+        )
+    elif miaomiao.state in (miaomiao.STATE_NO_SENSOR, miaomiao.STATE_NEW_SENSOR):
+        scheduler.observe_idle()
+    miaomiao.notification_delay = scheduler.notification_delay
+    delay = scheduler.next_read()
+    log.debug("%r: next read in %0.1fs", scheduler, delay)
+    time.sleep(delay)
+
+
+def keep_alive(btaddr, transport, interval, btfatal, scheduler=None, ring=None):
+    """hold one connection open, re-requesting reads over it"""
+    while True:
+        with MiaoMiaoDecoder(btaddr, btle_excmask=btfatal, transport=transport, ring=ring) as miaomiao:
+            if scheduler:
+                miaomiao.notification_delay = scheduler.notification_delay
+            miaomiao.connect()
+            miaomiao.start_notify()
+            while True:
+                read(miaomiao)
+                report(btaddr, miaomiao)
+                pause(miaomiao, interval, scheduler)
+                miaomiao.packet = None
+                miaomiao.start_data_notify()
+        # cached handles stay: enable_notify forgets them if they fail
+        log.info("%s: connection lost, reconnecting", btaddr)
+
+
 @click.command()
 @click.option("--continuous/--once", default=True, help="continually read the device")
 @click.option("--interval", type=float, default=60.0, help="interval to pause between successful attempts (when continuous)")
 @click.option("--debug/--no-debug", default=False, help="debugging loglevel")
 @click.option("--btfatal/--no-btfatal", default=False, help="make bluetooth problems fatal")
-@click.argument("btaddr")
-def decode(continuous, interval, debug, btfatal, btaddr):
-    if debug:
-        logging.root.setLevel(logging.DEBUG)
-        log.setLevel(logging.DEBUG)
-    else:
-        logging.root.setLevel(logging.INFO)
-        log.setLevel(logging.INFO)
+@click.option("--input", "-i", "inputs", multiple=True, help="decode raw frames from a file, directory or - (stdin) instead of a device")
+@click.option("--input-format", type=click.Choice(offline.FORMATS), default="auto", help="hex lines, concatenated binary frames or a frame archive")
+@click.option("--output", type=click.Choice(sorted(offline.emitters)), default="ndjson", help="offline output format")
+@click.option("--jobs", type=int, default=None, help="offline decode processes (default: one per CPU)")
+@click.option("--chunk-size", type=int, default=256, help="frames per offline work unit")
+@click.option("--ordered/--unordered", default=True, help="keep offline output in input order")
+@click.option("--adaptive/--fixed", default=False, help="time reads to the sensor's minute boundaries (interval rounds to whole sensor minutes)")
+@click.option("--keepalive/--reconnect", default=False, help="hold the connection open between reads (when continuous)")
+@click.option("--handle-cache", type=click.Path(dir_okay=False), default=HandleCache.default_path(), help="where discovered GATT handles are kept")
+@click.option("--no-handle-cache", is_flag=True, help="always run full service discovery")
+@click.option("--metrics-port", type=int, default=None, help="serve Prometheus metrics on this local port")
+@click.option("--trace-sample", type=int, default=0, help="emit a span event for one frame in this many")
+@click.option("--trace-frames", type=int, default=0, help="keep this many recent raw frames for --trace-dump")
+@click.option("--trace-dump", type=click.Path(dir_okay=False), default=None, help="write the recent raw frames here on exit")
+@click.option("--ring", default=None, help="also write frames to a shared-memory ring of this name for local consumers")
+@click.option("--ring-slots", type=int, default=256, help="frames the --ring keeps")
+@click.argument("btaddr", required=False)
+def decode(continuous, interval, debug, btfatal, inputs, input_format, output, jobs, chunk_size, ordered, adaptive, keepalive, handle_cache, no_handle_cache, metrics_port, trace_sample, trace_frames, trace_dump, ring, ring_slots, btaddr):
+    logging.basicConfig(level=logging.DEBUG if debug else logging.INFO)
+    if metrics_port is not None:
+        metrics.serve(metrics_port)
+    tracer = trace.use(trace.Tracer(sample=trace_sample, frames=trace_frames))
+    if trace_dump:
+        atexit.register(tracer.dump, trace_dump)
+    if inputs:
+        emitter = offline.emitters[output](sys.stdout)
+        frames = offline.iter_frames(inputs, input_format)
+        for record in offline.decode_all(frames, jobs=jobs, chunk_size=chunk_size, ordered=ordered):
+            emitter.emit(record)
+        emitter.close()
+        return
+    if not btaddr:
+        raise click.UsageError("either BTADDR or --input is required")
+    transport = transports.create(
+        "bluepy", handle_cache=None if no_handle_cache else HandleCache(handle_cache)
+    )
+    scheduler = ReadScheduler(every=round(interval / ReadScheduler.period)) if adaptive else None
+    if ring:
+        try:
+            ring = shmring.FrameRing.create(ring, slots=ring_slots)
+        except ImportError:
+            raise click.UsageError("--ring needs python 3.8 or later")
+        except FileExistsError:
+            raise click.UsageError(
+                "ring {} already exists (remove /dev/shm/{} if stale)".format(ring, ring)
+            )
+        atexit.register(ring.unlink)
+    if continuous and keepalive:
+        keep_alive(btaddr, transport, interval, btfatal, scheduler, ring)
     while True:
-        with MiaoMiaoDecoder(btaddr, btle_excmask=btfatal) as miaomiao:
+        with MiaoMiaoDecoder(btaddr, btle_excmask=btfatal, transport=transport, ring=ring) as miaomiao:
+            if scheduler:
+                miaomiao.notification_delay = scheduler.notification_delay
             miaomiao.connect()
             miaomiao.start_notify()
-            miaomiao.notify_wait()
-
-            while miaomiao.state == miaomiao.STATE_READING:
-                miaomiao.notify_wait()
-
-            log.debug("device ended in state: %s", miaomiao.state)
-            if miaomiao.state == miaomiao.STATE_NO_SENSOR:
-                print("{}: device reports no sensor attached".format(btaddr))
-            elif miaomiao.state == miaomiao.STATE_NEW_SENSOR:
-                print("{}: device reports new sensor attached (not allowed)".format(btaddr))
-            elif miaomiao.state == miaomiao.STATE_SENSOR_READ:
-                print("{}: sensor was read".format(btaddr))
-            else:
-                print("{}: It's Complicated".format(btaddr))
-            print(miaomiao.packet)
+            read(miaomiao)
+            report(btaddr, miaomiao)
         if not continuous:
             break
-        time.sleep(interval)
+        pause(miaomiao, interval, scheduler)
 
 if __name__ == "__main__":
     decode()
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+
+import click
+import itertools
+import logging
+
+from miao2py import export as exporter
+
+log = logging.getLogger(__name__)
+
+
+@click.command()
+@click.argument("archives", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(sorted(exporter.writers)), default="csv", help="output format (arrow and parquet need pyarrow)")
+@click.option("--output", "-o", required=True, help="output file (npz: path prefix for the chunk files)")
+@click.option("--device", default=None, help="only export this reader")
+@click.option("--chunk-rows", type=int, default=65536, help="rows held in memory per chunk")
+@click.option("--dedupe/--all", default=True, help="export each reading once, or every ring entry of every frame")
+@click.option("--debug/--no-debug", default=False, help="debugging loglevel")
+def export(archives, fmt, output, device, chunk_rows, dedupe, debug):
+    logging.basicConfig(level=logging.DEBUG if debug else logging.INFO)
+    # one stream of packets, so readings rotated archives share go out once
+    packets = itertools.chain.from_iterable(
+        exporter.packets_from_archive(archive, device) for archive in archives
+    )
+    rows = exporter.rows_from_packets(packets, dedupe=dedupe)
+    try:
+        writer = exporter.writers[fmt](output)
+    except ImportError as exc:
+        raise click.UsageError("--format {} is unavailable: {}".format(fmt, exc))
+    count = exporter.export(rows, writer, chunk_rows)
+    log.info("exported %d readings to %s", count, output)
+
+
+if __name__ == "__main__":
+    export()
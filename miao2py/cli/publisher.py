@@ -3,10 +3,9 @@
 import click
 import logging
 
-from miao2py.mqpub import MiaoMiaoMQPublisher
-from bluepy.btle import BTLEException
+from miao2py import metrics
+from miao2py.mqpub import MiaoMiaoMQPublisher, PublishQueue
 
-logging.basicConfig(level=logging.DEBUG)
 log = logging.getLogger(__name__)
 
 
@@ -15,13 +14,37 @@ log = logging.getLogger(__name__)
 @click.argument("mqurl")
 @click.argument("mqtopic")
 @click.option("--btfatal/--no-btfatal", default=False, help="make bluetooth problems fatal")
-def publish(btaddr, mqurl, mqtopic, btfatal):
-    while True:
-        with MiaoMiaoMQPublisher(btaddr, mqurl, mqtopic, btle_excmask=btfatal) as miaomiao:
-            miaomiao.connect()
-            miaomiao.start_notify()
-            miaomiao.notify_forever()
-        log.debug("new iteration")
+@click.option("--qos", type=click.IntRange(0, 2), default=0, help="MQTT QoS level")
+@click.option("--queue-size", type=int, default=256, help="frames to hold while the broker is slow")
+@click.option("--policy", type=click.Choice(PublishQueue.policies), default=PublishQueue.DROP_OLDEST, help="what to do when the queue is full")
+@click.option("--batch-size", type=int, default=1, help="frames to publish together")
+@click.option("--batch-ms", type=float, default=0, help="time to wait for a batch to fill")
+@click.option("--format", "formats", multiple=True, type=click.Choice(MiaoMiaoMQPublisher.formats), default=["raw"], help="publish raw envelopes and/or compact records (repeatable)")
+@click.option("--delta/--full", default=False, help="compact records carry only new readings")
+@click.option("--analytics/--no-analytics", default=False, help="also publish rate of change, trend arrow and forecasts")
+@click.option("--metrics-port", type=int, default=None, help="serve Prometheus metrics on this local port")
+@click.option("--debug/--no-debug", default=False, help="debugging loglevel")
+def publish(btaddr, mqurl, mqtopic, btfatal, qos, queue_size, policy, batch_size, batch_ms, formats, delta, analytics, metrics_port, debug):
+    logging.basicConfig(level=logging.DEBUG if debug else logging.INFO)
+    if metrics_port is not None:
+        metrics.serve(metrics_port)
+    queue = PublishQueue(
+        mqurl,
+        maxsize=queue_size,
+        batch_size=batch_size,
+        batch_ms=batch_ms,
+        qos=qos,
+        policy=policy,
+    )
+    try:
+        while True:
+            with MiaoMiaoMQPublisher(btaddr, mqurl, mqtopic, queue=queue, formats=formats, delta=delta, analytics=analytics, btle_excmask=btfatal) as miaomiao:
+                miaomiao.connect()
+                miaomiao.start_notify()
+                miaomiao.notify_forever()
+            log.debug("new iteration: %s", queue.stats())
+    finally:
+        queue.stop()
 
 if __name__ == "__main__":
     publish()
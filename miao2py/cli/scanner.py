@@ -3,18 +3,38 @@
 import click
 
 from miao2py.device import MiaoMiaoScanner
+from miao2py.scanning import DeviceRegistry
 from bluepy import btle
 
 
+def show(registry):
+    click.clear()
+    print("{:<20} {:>8} {:>8} {:>8}".format("address", "dBm", "adv/s", "age s"))
+    for addr, rssi, rate, age in registry.snapshot():
+        print("{:<20} {:>8.1f} {:>8.2f} {:>8.1f}".format(addr, rssi, rate, age))
+
+
 @click.command()
 @click.option(
     "--iface", type=int, default=0, help="BT interface index to use (e.g. hci0 -> 0)"
 )
 @click.option("--interval", type=int, default=1, help="BT scanning interval")
 @click.option("--continuous", is_flag=True, help="Scan continuously")
-def scan(iface, interval, continuous):
-    delegate = MiaoMiaoScanner()
+@click.option("--watch", is_flag=True, help="scan passively and keep a table of readers (implies --continuous)")
+@click.option("--expiry", type=float, default=300.0, help="forget readers unheard for this long (with --watch)")
+def scan(iface, interval, continuous, watch, expiry):
+    registry = DeviceRegistry(expiry=expiry) if watch else None
+    delegate = MiaoMiaoScanner(registry=registry, quiet=watch)
     scanner = btle.Scanner(iface).withDelegate(delegate)
+    if watch:
+        scanner.start(passive=True)
+        try:
+            while True:
+                scanner.process(interval)
+                registry.expire()
+                show(registry)
+        finally:
+            scanner.stop()
     while True:
         device = scanner.scan(interval)
         if not continuous:
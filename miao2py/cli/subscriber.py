@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+
+import asyncio
+import click
+import logging
+
+from miao2py.mqsub import MiaoMiaoMQSubscriber
+
+log = logging.getLogger(__name__)
+
+
+@click.command()
+@click.argument("mqurl")
+@click.argument("mqtopic")
+@click.option("--qos", type=click.IntRange(0, 2), default=0, help="MQTT QoS level")
+@click.option("--workers", type=int, default=None, help="decode workers (default: one per CPU)")
+@click.option("--processes/--threads", default=False, help="decode in worker processes")
+@click.option("--debug/--no-debug", default=False, help="debugging loglevel")
+def subscribe(mqurl, mqtopic, qos, workers, processes, debug):
+    logging.basicConfig(level=logging.DEBUG if debug else logging.INFO)
+    subscriber = MiaoMiaoMQSubscriber(
+        mqurl, mqtopic, qos=qos, workers=workers, processes=processes
+    )
+    loop = asyncio.get_event_loop()
+    try:
+        loop.run_until_complete(subscriber.run())
+    except KeyboardInterrupt:
+        log.info("decoded %d frames, %d errors", subscriber.decoded, subscriber.errors)
+
+
+if __name__ == "__main__":
+    subscribe()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+import datetime
+import logging
+from collections import OrderedDict, namedtuple
+
+from .session import SessionCache
+
+log = logging.getLogger(__name__)
+
+# kind is "trend" or "history"; minute is the sensor's own minute
+# counter; values are the three words of the entry as decoded; index
+# is the entry's place in its ring in this packet, newest first
+Reading = namedtuple("Reading", ["sensor", "kind", "minute", "timestamp", "values", "index"])
+
+
+class _Cursor:
+    __slots__ = (
+        "start",
+        "minutes",
+        "index_trend",
+        "index_history",
+        "trend_minute",
+        "history_minute",
+    )
+
+    def __init__(self, start, minutes):
+        self.start = start
+        self.minutes = minutes
+        self.index_trend = None
+        self.index_history = None
+        self.trend_minute = -1
+        self.history_minute = -1
+
+
+class DeltaTracker:
+    """Turns successive packets into only the readings not seen before
+
+       each Libre packet repeats the whole 16 minute trend ring and 8 hour
+       history ring, so consecutive reads overlap almost entirely.  The
+       tracker remembers, per sensor, the ring indices of the last packet
+       and the newest trend and history minute it has emitted: how far
+       index_trend / index_history moved says how many entries are new,
+       and they take the minutes following the last ones emitted.  Only
+       on first sight (or after a gap longer than a ring) are minutes
+       derived from the sensor's minute counter, the newest history
+       entry being the last quarter hour at least 3 minutes old.
+
+       timestamps count from the sensor start of the packet's
+       session.SensorSession, so every reading gets the same absolute
+       timestamp on every read, and the same one everywhere else a
+       session's start is used.  Packets a SessionCache has not seen
+       (no packet.session) are run through `sessions` first.
+
+       usage:
+
+       tracker = DeltaTracker()
+       for reading in tracker.update(packet):
+           store(reading)
+    """
+
+    TREND = "trend"
+    HISTORY = "history"
+    # history entries are written every 15 sensor minutes, each 3 minutes
+    # after its quarter hour
+    history_period = 15
+    history_delay = 3
+
+    def __init__(self, max_sensors=64, sessions=None):
+        self.max_sensors = max_sensors
+        self.sessions = SessionCache(max_sensors) if sessions is None else sessions
+        self.sensors = OrderedDict()
+
+    def __repr__(self):
+        return "<{} sensors={}>".format(type(self).__name__, len(self.sensors))
+
+    def _cursor(self, sensor, minutes, start):
+        cursor = self.sensors.get(sensor)
+        if cursor is None or minutes < cursor.minutes:
+            if cursor is not None:
+                log.debug("%s: minutes went backwards, new sensor session", sensor)
+            cursor = _Cursor(start, minutes)
+            self.sensors[sensor] = cursor
+            while len(self.sensors) > self.max_sensors:
+                self.sensors.popitem(last=False)
+        else:
+            self.sensors.move_to_end(sensor)
+            cursor.start = start
+        return cursor
+
+    def update(self, packet, received=None, sensor=None):
+        """readings of a MiaoMiaoPacket (or a LibrePacket with an explicit
+           sensor key, dated from its own sensor_start) that are new to
+           this tracker, oldest first
+        """
+        librepacket = getattr(packet, "librepacket", packet)
+        if sensor is None:
+            sensor = packet.sensor_id
+        if librepacket is not packet and getattr(packet, "session", None) is None:
+            self.sessions.update(packet, received)
+        minutes = librepacket.minutes
+        cursor = self._cursor(sensor, minutes, librepacket.sensor_start)
+        readings = []
+
+        readings.extend(
+            self._new_entries(
+                sensor,
+                self.HISTORY,
+                cursor,
+                librepacket.history,
+                librepacket.index_history,
+                self.newest_history_minute(minutes),
+                self.history_period,
+            )
+        )
+        readings.extend(
+            self._new_entries(
+                sensor,
+                self.TREND,
+                cursor,
+                librepacket.trends,
+                librepacket.index_trend,
+                minutes,
+                1,
+            )
+        )
+        cursor.minutes = minutes
+
+        readings.sort(key=lambda reading: reading.minute)
+        return readings
+
+    @classmethod
+    def newest_history_minute(cls, minutes):
+        """sensor minute of the newest history entry, by the minute counter"""
+        return (minutes - cls.history_delay) // cls.history_period * cls.history_period
+
+    def _new_entries(self, sensor, kind, cursor, ring, index, newest, period):
+        if kind == self.TREND:
+            last_index, last_minute = cursor.index_trend, cursor.trend_minute
+        else:
+            last_index, last_minute = cursor.index_history, cursor.history_minute
+        size = len(ring)
+        # first sight, or every entry in the ring is newer than the last
+        if last_index is None or newest - last_minute >= size * period:
+            count = size
+        else:
+            count = (index - last_index) % size
+            newest = last_minute + count * period
+        readings = []
+        for imem in range(count):
+            minute = newest - imem * period
+            if minute <= last_minute or minute < 0:
+                break
+            readings.append(
+                Reading(
+                    sensor,
+                    kind,
+                    minute,
+                    cursor.start + datetime.timedelta(minutes=minute),
+                    ring[imem],
+                    imem,
+                )
+            )
+        if kind == self.TREND:
+            cursor.index_trend = index
+            cursor.trend_minute = max(last_minute, newest) if count else last_minute
+        else:
+            cursor.index_history = index
+            cursor.history_minute = max(last_minute, newest) if count else last_minute
+        return readings
+
+    def forget(self, sensor):
+        self.sensors.pop(sensor, None)
@@ -1,16 +1,30 @@
 #!/usr/bin/env python3
 
-from bluepy import btle
 import logging
+import time
+
+from . import metrics, trace, transport as transports
+from .framing import FrameReassembler
 
 log = logging.getLogger(__name__)
 
 
-class MiaoMiaoScanner(btle.DefaultDelegate):
-    def __init__(self, sensitivity=False):
-        super().__init__()
+class MiaoMiaoScanner:
+    """bluepy scan delegate collecting miaomiao advertisements
+
+       with a scanning.DeviceRegistry every advertisement is fed to it;
+       with an adapters.AdapterScheduler each one's RSSI is reported
+       against the adapter scanning, hci<iface>; quiet=True stops
+       printing each one
+    """
+
+    def __init__(self, sensitivity=False, registry=None, quiet=False, adapters=None, iface=0):
         self.miaomiaos = {}
         self.sensitivity = sensitivity
+        self.registry = registry
+        self.quiet = quiet
+        self.adapters = adapters
+        self.iface = iface
 
     def handleDiscovery(self, scanentry, is_new, is_new_data):
         if self.sensitivity and scanentry.rssi < self.sensitivity:
@@ -23,14 +37,19 @@ class MiaoMiaoScanner(btle.DefaultDelegate):
         else:
             ...
             self.miaomiaos[scanentry.addr] = scanentry
-        print("{} {} dBm".format(scanentry.addr, scanentry.rssi))
+        if self.registry is not None:
+            self.registry.seen(scanentry.addr, scanentry.rssi)
+        if self.adapters is not None:
+            self.adapters.observe(scanentry.addr, "hci{}".format(self.iface), scanentry.rssi)
+        if not self.quiet:
+            print("{} {} dBm".format(scanentry.addr, scanentry.rssi))
 
     @staticmethod
     def is_miaomiao(scanentry):
         return scanentry.getValueText(9) == "miaomiao"
 
 
-class MiaoMiaoDevice(btle.DefaultDelegate):
+class MiaoMiaoDevice:
     """Interacts with a miaomiao reader over Bluetooth, yielding
        raw packets usually containing a Libre payload
 
@@ -47,6 +66,10 @@ class MiaoMiaoDevice(btle.DefaultDelegate):
            miaomiao.notify_forever()
         except btle.BTLEException:
            print('such is the nature of things')
+
+       the device is its transport's notification delegate; bluepy only
+       needs handleNotification, so nothing here imports bluepy until a
+       BluepyTransport is created
     """
 
     # ain't even tried to talk to it yet
@@ -68,10 +91,6 @@ class MiaoMiaoDevice(btle.DefaultDelegate):
 
     notification_delay = 2.0
 
-    client_chars = btle.UUID("00002902-0000-1000-8000-00805f9b34fb")
-    nrf_data = btle.UUID("6E400001-B5A3-F393-E0A9-E50E24DCCA9E")
-    nrf_recv = btle.UUID("6E400002-B5A3-F393-E0A9-E50E24DCCA9E")
-    nrf_xmit = btle.UUID("6E400003-B5A3-F393-E0A9-E50E24DCCA9E")
     device_name = "miaomiao"
 
     new_sensor = 0x32
@@ -83,6 +102,8 @@ class MiaoMiaoDevice(btle.DefaultDelegate):
     def discover(cls, scanner=None, interval=10):
         found_devices = []
         if not scanner:
+            from bluepy import btle
+
             scanner = btle.Scanner()
         devices = scanner.scan(interval)
         for device in devices:
@@ -91,35 +112,55 @@ class MiaoMiaoDevice(btle.DefaultDelegate):
                 found_devices.append(cls(device.addr))
         return found_devices
 
-    def __init__(self, btaddr, *, btle_excmask=True):
-        super().__init__()
+    def __init__(self, btaddr, *, btle_excmask=True, transport=None, archive=None, ring=None):
         self.btaddr = btaddr
-        self.pkt_acc = []
+        # created on first use, so callers that install their own (e.g.
+        # adapters.AdapterScheduler.bind) never need bluepy
+        self._transport = transport
+        # a FrameArchive every received frame is appended to
+        self.archive = archive
+        # a shmring.FrameRing every received frame is written to
+        self.ring = ring
+        self.reassembler = FrameReassembler()
         self.btle_excmask = btle_excmask
         self.state = self.STATE_DISCONNECTED
+        # perf_counter of the last read request, until its first notification
+        self.requested = None
+        # trace Span of the frame being reassembled, when sampled
+        self.span = None
 
     def __repr__(self):
         return "<{} @ {}>".format(type(self).__name__, self.btaddr)
 
+    @property
+    def transport(self):
+        if self._transport is None:
+            self._transport = transports.create("bluepy")
+        return self._transport
+
+    @transport.setter
+    def transport(self, transport):
+        self._transport = transport
+
     def connect(self):
         log.debug("connecting to %s", self.btaddr)
-        self.device = btle.Peripheral(self.btaddr, "random")
-        self.gatt = self.device.getServiceByUUID(self.nrf_data)
-        self.xmit = self.gatt.getCharacteristics(self.nrf_xmit)[0]
-        self.recv = self.gatt.getCharacteristics(self.nrf_recv)[0]
-        self.xmit_desc = self.xmit.getDescriptors(self.client_chars)[0]
+        with metrics.stage("connect"):
+            self.transport.connect(self.btaddr)
         self.handleConnect()
 
     def handleConnect(self):
         log.debug("connected")
+        self.reassembler.reset()
+        self.span = None
         self._state_transition(self.STATE_CONNECTED)
 
     def disconnect(self):
-        self.device.disconnect()
+        self.transport.disconnect()
         self.handleDisconnect()
 
     def handleDisconnect(self):
         log.debug("disconnected")
+        self.reassembler.reset()
         self._state_transition(self.STATE_DISCONNECTED)
 
     def __enter__(self):
@@ -127,31 +168,39 @@ class MiaoMiaoDevice(btle.DefaultDelegate):
 
     def __exit__(self, exc_type, exc_value, traceback):
         self.disconnect()
-        if exc_type is btle.BTLEException:
+        if exc_type and issubclass(exc_type, self.transport.errors):
+            metrics.registry.counter(
+                "miao2py_errors_total", "errors by device and kind"
+            ).inc(device=self.btaddr, kind="transport")
             log.exception("Bluetooth exception encountered")
             return self.btle_excmask
 
 
     def sensor_allow(self):
         log.debug("-> allow sensor")
-        self.recv.write(bytes([0xd3, 0x01]))
+        self.transport.write(bytes([0xd3, 0x01]))
 
     def start_data_notify(self):
         log.debug("-> begin reading")
-        self.recv.write(bytes([0xf0]))
+        self._mark_request()
+        self.transport.write(bytes([0xf0]))
 
     def start_notify(self):
         log.debug("requesting notification from device")
-        self.xmit_desc.write(bytes([0x01, 0x00]), False)
-        self.device.setDelegate(self)
-        self.recv.write(bytes([0xf0]))
+        self.transport.enable_notify(self)
+        self._mark_request()
+        self.transport.write(bytes([0xf0]))
         self._state_transition(self.STATE_NOTIFY_REQ)
 
+    def _mark_request(self):
+        if metrics.registry.enabled:
+            self.requested = time.perf_counter()
+
     def notify_wait(self, delay=None):
         delay = delay or self.notification_delay
         log.debug("waiting %0.2f for a notification", delay)
         self._state_transition(self.STATE_NOTIFY_WAIT)
-        self.device.waitForNotifications(delay)
+        return self.transport.wait(delay)
 
     def notify_forever(self):
         while True:
@@ -160,6 +209,19 @@ class MiaoMiaoDevice(btle.DefaultDelegate):
 
     def handlePacket(self, data):
         """Override this for application data handling"""
+        if self.archive is not None:
+            self.archive.append(self.btaddr, data)
+        if self.ring is not None:
+            self.ring.write(data, self.btaddr)
+        if metrics.registry.enabled:
+            registry = metrics.registry
+            registry.counter("miao2py_frames_total", "frames received").inc(
+                device=self.btaddr
+            )
+            # E13: battery percentage, without decoding the frame
+            registry.gauge("miao2py_battery_percent", "reader battery").set(
+                data[13], device=self.btaddr
+            )
         self._state_transition(self.STATE_SENSOR_READ)
 
     def handleNewSensor(self, allow=False):
@@ -181,29 +243,75 @@ class MiaoMiaoDevice(btle.DefaultDelegate):
     def _state_transition(self, newstate):
         log.debug("%s -> %s", self.state, newstate)
         self.state = newstate
+        if metrics.registry.enabled:
+            metrics.registry.counter(
+                "miao2py_state_transitions_total", "device state transitions"
+            ).inc(device=self.btaddr, state=newstate)
 
     def handleNotification(self, cHandle, data):
         self._state_transition(self.STATE_READING)
         if not data:
             log.debug("no-data notification")
             return
+        if metrics.registry.enabled:
+            self._count_notification()
 
-        if not self.pkt_acc:
-            if data[0] == self.new_sensor:
-                self.handleNewSensor(allow=True)
-            elif data[0] == self.no_sensor:
-                self.handleNoSensor()
+        if not self.reassembler.in_frame and data[0] == self.new_sensor:
+            self.handleNewSensor(allow=True)
+        elif not self.reassembler.in_frame and data[0] == self.no_sensor:
+            self.handleNoSensor()
+        else:
+            if self.reassembler.in_frame:
+                log.debug("data continuation")
             elif data[0] == self.start_pkt:
                 log.debug("data packet start")
-                self._state_transition(self.STATE_READING)
-                self.pkt_acc.append(data)
+                if trace.tracer.enabled:
+                    self.span = trace.tracer.start("frame", device=self.btaddr)
             else:
                 log.debug("existing_sensor?")
-        else:
-            log.debug("data continuation")
-            self.pkt_acc.append(data)
-            if data[-1] == self.end_pkt:
+            if metrics.registry.enabled or self.span is not None:
+                started = time.perf_counter()
+                packets = self.reassembler.feed(data)
+                took = time.perf_counter() - started
+                if self.span is not None:
+                    self.span.add("reassembly", took)
+                metrics.registry.histogram(
+                    "miao2py_stage_seconds", "time spent per pipeline stage"
+                ).observe(took, stage="reassembly")
+            else:
+                packets = self.reassembler.feed(data)
+            for packet in packets:
                 log.debug("end packet")
-                packet = b"".join(self.pkt_acc)
-                self.handlePacket(packet)
+                if trace.tracer.enabled:
+                    self._handle_traced(packet)
+                else:
+                    self.handlePacket(packet)
         log.debug("leaving handleNotification in state %s", self.state)
+
+    def _handle_traced(self, packet):
+        tracer = trace.tracer
+        tracer.record(self.btaddr, packet)
+        span, self.span = self.span, None
+        if span is None:
+            self.handlePacket(packet)
+            return
+        # decoding in handlePacket reports into the active span
+        tracer.activate(span)
+        try:
+            started = time.perf_counter()
+            self.handlePacket(packet)
+            span.add("handle", time.perf_counter() - started)
+        finally:
+            tracer.activate(None)
+            tracer.finish(span)
+
+    def _count_notification(self):
+        registry = metrics.registry
+        registry.counter("miao2py_fragments_total", "notifications received").inc(
+            device=self.btaddr
+        )
+        if self.requested is not None:
+            registry.histogram(
+                "miao2py_stage_seconds", "time spent per pipeline stage"
+            ).observe(time.perf_counter() - self.requested, stage="first_notification")
+            self.requested = None
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+
+import csv
+import datetime
+import logging
+
+from .archive import ArchiveReader
+from .delta import DeltaTracker
+from .packet import LibrePacket, MiaoMiaoPacket
+from .session import decode_serial
+
+log = logging.getLogger(__name__)
+
+COLUMNS = ("device", "serial", "timestamp", "kind", "value", "aux1", "aux2")
+
+
+def rows_from_packets(items, *, dedupe=True, converter=None, tracker=None):
+    """yield export rows (in COLUMNS order) from (device, received,
+       MiaoMiaoPacket) items, received being epoch seconds
+
+       each reading is timestamped from the sensor's minutes counter
+       anchored at its first read; with dedupe only readings not
+       exported before are yielded (the rings overlap read to read).
+       Pass one DeltaTracker to successive calls to dedupe across them.
+       value is glucose (raw / 8.5, or per converter), aux1 and aux2
+       the entry's raw auxiliary words
+    """
+    tracker = tracker or DeltaTracker()
+    serials = {}
+    for device, received, packet in items:
+        sensor_id = bytes(packet.sensor_id)
+        serial = serials.get(sensor_id)
+        if serial is None:
+            serial = serials[sensor_id] = decode_serial(sensor_id)
+        librepacket = packet.librepacket
+        data = librepacket.data
+        # readings carry the packet's decoded values; re-read the raw words
+        words = {
+            DeltaTracker.TREND: LibrePacket.ring_words(
+                data, LibrePacket.trend_ring, librepacket.index_trend
+            ),
+            DeltaTracker.HISTORY: LibrePacket.ring_words(
+                data, LibrePacket.history_ring, librepacket.index_history
+            ),
+        }
+        received = datetime.datetime.fromtimestamp(received)
+        readings = tracker.update(packet, received, sensor=(device, sensor_id))
+        if not dedupe:
+            tracker.forget((device, sensor_id))
+        for reading in readings:
+            raw, aux1, aux2 = words[reading.kind][reading.index]
+            if converter is None:
+                value = raw / LibrePacket.glucose_divisor
+            else:
+                value = converter.convert(raw, aux1, aux2)
+            yield (
+                device,
+                serial,
+                reading.timestamp.timestamp(),
+                reading.kind,
+                value,
+                aux1,
+                aux2,
+            )
+
+
+def packets_from_archive(path, btaddr=None, start=None, end=None):
+    """yield (device, received, MiaoMiaoPacket) of a FrameArchive's
+       frames, skipping undecodable ones
+    """
+    with ArchiveReader(path) as reader:
+        for archived in reader.scan(btaddr, start, end):
+            frame = bytes(archived.frame)
+            archived.frame.release()
+            try:
+                packet = MiaoMiaoPacket.from_bytes(frame)
+            except (ValueError, IndexError) as exc:
+                log.warning("%s @ %s: %s", archived.device, archived.timestamp, exc)
+                continue
+            yield archived.device, archived.timestamp, packet
+
+
+def rows_from_archive(path, btaddr=None, start=None, end=None, **kwargs):
+    """export rows of a FrameArchive's frames; kwargs as rows_from_packets
+
+       for several (e.g. rotated) archives chain their
+       packets_from_archive into one rows_from_packets, so readings
+       they share are exported once
+    """
+    yield from rows_from_packets(packets_from_archive(path, btaddr, start, end), **kwargs)
+
+
+class CSVWriter:
+    """one CSV file, header first"""
+
+    def __init__(self, path):
+        self.out = open(path, "w", newline="")
+        self.writer = csv.writer(self.out)
+        self.writer.writerow(COLUMNS)
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.out.close()
+
+
+class NumpyWriter:
+    """one .npz per chunk, named path.00000.npz, path.00001.npz ...
+       each holding one array per column; compressed unless told not to
+    """
+
+    def __init__(self, path, compressed=True):
+        import numpy
+
+        self.numpy = numpy
+        self.path = path[:-4] if path.endswith(".npz") else path
+        self.save = numpy.savez_compressed if compressed else numpy.savez
+        self.chunks = 0
+
+    def write(self, rows):
+        numpy = self.numpy
+        device, serial, timestamp, kind, value, aux1, aux2 = zip(*rows)
+        self.save(
+            "{}.{:05d}.npz".format(self.path, self.chunks),
+            device=numpy.array(device, dtype="U17"),
+            serial=numpy.array(serial, dtype="U11"),
+            timestamp=numpy.array(timestamp, dtype=numpy.float64),
+            kind=numpy.array(kind, dtype="U7"),
+            value=numpy.array(value, dtype=numpy.float64),
+            aux1=numpy.array(aux1, dtype=numpy.uint16),
+            aux2=numpy.array(aux2, dtype=numpy.uint16),
+        )
+        self.chunks += 1
+
+    def close(self):
+        pass
+
+
+class ArrowWriter:
+    """Arrow IPC file (or Parquet with parquet=True), one record batch
+       (row group) per chunk; needs pyarrow
+    """
+
+    def __init__(self, path, parquet=False):
+        import pyarrow
+
+        self.pyarrow = pyarrow
+        self.schema = pyarrow.schema(
+            [
+                ("device", pyarrow.string()),
+                ("serial", pyarrow.string()),
+                ("timestamp", pyarrow.float64()),
+                ("kind", pyarrow.dictionary(pyarrow.int8(), pyarrow.string())),
+                ("value", pyarrow.float64()),
+                ("aux1", pyarrow.uint16()),
+                ("aux2", pyarrow.uint16()),
+            ]
+        )
+        self.parquet = parquet
+        if parquet:
+            import pyarrow.parquet
+
+            self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+        else:
+            import pyarrow.ipc
+
+            self.writer = pyarrow.ipc.new_file(path, self.schema)
+
+    def write(self, rows):
+        pyarrow = self.pyarrow
+        batch = pyarrow.RecordBatch.from_arrays(
+            [
+                pyarrow.array(column, type=field.type)
+                for field, column in zip(self.schema, zip(*rows))
+            ],
+            schema=self.schema,
+        )
+        if self.parquet:
+            self.writer.write_table(pyarrow.Table.from_batches([batch]))
+        else:
+            self.writer.write_batch(batch)
+
+    def close(self):
+        self.writer.close()
+
+
+writers = {
+    "csv": CSVWriter,
+    "npz": NumpyWriter,
+    "arrow": ArrowWriter,
+    "parquet": lambda path: ArrowWriter(path, parquet=True),
+}
+
+
+def export(rows, writer, chunk_rows=65536):
+    """write rows through writer chunk_rows at a time, so memory stays
+       bounded whatever the input size; returns the row count
+    """
+    count = 0
+    chunk = []
+    try:
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_rows:
+                writer.write(chunk)
+                count += len(chunk)
+                chunk = []
+        if chunk:
+            writer.write(chunk)
+            count += len(chunk)
+    finally:
+        writer.close()
+    return count
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+import logging
+from collections import deque
+
+log = logging.getLogger(__name__)
+
+
+class FrameReassembler:
+    """Rebuilds miaomiao envelope frames from BLE notification fragments
+
+       a frame starts with start_pkt, followed by its own big-endian
+       length in bytes 1-2, and ends with end_pkt at exactly that length.
+       Fragments are copied into one preallocated buffer; anything that
+       does not look like a frame is dropped until the next start byte.
+
+       usage:
+
+       reassembler = FrameReassembler()
+       for frame in reassembler.feed(fragment):
+           handle(frame)
+    """
+
+    start_pkt = 0x28
+    end_pkt = 0x29
+    # start byte, two length bytes
+    header_length = 3
+    # 18 byte envelope header plus the end byte
+    min_length = 19
+
+    def __init__(self, max_length=1024):
+        self.max_length = max_length
+        self.buffer = bytearray(max_length)
+        self.view = memoryview(self.buffer)
+        self.filled = 0
+        self.expected = None
+        # complete frames emitted
+        self.frames = 0
+        # notifications fed
+        self.fragments = 0
+        # bytes skipped while hunting for a start byte
+        self.dropped_bytes = 0
+        # started frames thrown away for a bad length or end byte
+        self.dropped_frames = 0
+        # frames abandoned half-way by reset()
+        self.partial_frames = 0
+
+    def __repr__(self):
+        return "<{} frames={} fragments={} dropped={}/{} partial={}>".format(
+            type(self).__name__,
+            self.frames,
+            self.fragments,
+            self.dropped_frames,
+            self.dropped_bytes,
+            self.partial_frames,
+        )
+
+    @property
+    def in_frame(self):
+        """a frame has been started but not completed"""
+        return self.filled > 0
+
+    def reset(self):
+        """abandon any frame in progress, e.g. on disconnect"""
+        if self.filled:
+            log.debug("abandoning partial frame of %d bytes", self.filled)
+            self.partial_frames += 1
+        self.filled = 0
+        self.expected = None
+
+    def feed(self, data):
+        """consume one notification, returning the frames it completed"""
+        self.fragments += 1
+        frames = []
+        pending = deque([bytes(data)])
+        while pending:
+            chunk = pending.popleft()
+            pos = 0
+            while pos < len(chunk):
+                if not self.filled:
+                    start = chunk.find(self.start_pkt, pos)
+                    if start < 0:
+                        self.dropped_bytes += len(chunk) - pos
+                        break
+                    self.dropped_bytes += start - pos
+                    pos = start
+                need = (self.expected or self.header_length) - self.filled
+                ncopy = min(need, len(chunk) - pos)
+                self.view[self.filled : self.filled + ncopy] = chunk[pos : pos + ncopy]
+                self.filled += ncopy
+                pos += ncopy
+
+                if self.expected is None:
+                    if self.filled < self.header_length:
+                        continue
+                    length = int.from_bytes(self.buffer[1:3], "big")
+                    if self.min_length <= length <= self.max_length:
+                        self.expected = length
+                        continue
+                    log.debug("implausible frame length %d, resyncing", length)
+                elif self.filled < self.expected:
+                    continue
+                elif self.buffer[self.filled - 1] == self.end_pkt:
+                    frames.append(bytes(self.view[: self.filled]))
+                    self.frames += 1
+                    self.filled = 0
+                    self.expected = None
+                    continue
+                else:
+                    log.debug("frame of %d bytes lacks end byte, resyncing", self.filled)
+
+                # false start: rescan everything after the start byte
+                self.dropped_frames += 1
+                self.dropped_bytes += 1
+                pending.appendleft(chunk[pos:])
+                pending.appendleft(bytes(self.view[1 : self.filled]))
+                self.filled = 0
+                self.expected = None
+                break
+        return frames
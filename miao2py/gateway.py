@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from .device import MiaoMiaoDevice
+from .packet import MiaoMiaoPacket
+from .session import SessionCache
+
+log = logging.getLogger(__name__)
+
+
+class GatewayDevice(MiaoMiaoDevice):
+    """A MiaoMiaoDevice driven by a MiaoMiaoGateway"""
+
+    def __init__(self, btaddr, gateway, **kwargs):
+        super().__init__(btaddr, **kwargs)
+        self.gateway = gateway
+        self.reads = 0
+        self.errors = 0
+
+    def handlePacket(self, data):
+        super().handlePacket(data)
+        try:
+            packet = MiaoMiaoPacket.from_bytes(data)
+        except ValueError:
+            log.exception("%s: undecodable frame", self.btaddr)
+            self.errors += 1
+            return
+        self.reads += 1
+        self.gateway.sessions.update(packet, device=self.btaddr)
+        self.gateway.deliver(self, packet)
+
+
+class MiaoMiaoGateway:
+    """Drives many miaomiaos from one asyncio event loop
+
+       each device runs its own connect / notify / disconnect cycle as a
+       task; the blocking transport calls run on a thread pool so one
+       slow device never holds up the others.  Decoded packets go to
+       sink(device, packet), called on the event loop; if it returns a
+       coroutine that is scheduled as a task.  Packets are enriched
+       from `sessions` first (serial, stable start, sensor swaps).
+
+       with an AdapterScheduler, each read goes through the device's
+       assigned HCI adapter, holding one of that adapter's slots, and
+       failures move the device (or a failing adapter's devices) on.
+
+       with a scanning.DeviceRegistry fed by a scanner, the registry
+       decides what is read when: one dispatcher pops the strongest,
+       most overdue in-range device and reads it (up to max_reads at
+       once), and read_interval / retry_interval of the registry take
+       the place of interval and backoff.  When nothing is due it is
+       asked again every out_of_range_interval.
+
+       usage:
+
+       gateway = MiaoMiaoGateway(lambda device, packet: print(packet))
+       gateway.add_device(btaddr1)
+       gateway.add_device(btaddr2)
+       loop.run_until_complete(gateway.run())
+    """
+
+    device_class = GatewayDevice
+
+    def __init__(
+        self,
+        sink,
+        *,
+        interval=60.0,
+        idle_interval=None,
+        max_backoff=300.0,
+        adapters=None,
+        registry=None,
+        out_of_range_interval=5.0,
+        max_reads=4
+    ):
+        self.sink = sink
+        # pause after a successful read
+        self.interval = interval
+        # pause after a read that found no (allowed) sensor
+        self.idle_interval = interval if idle_interval is None else idle_interval
+        self.max_backoff = max_backoff
+        self.adapters = adapters
+        self.registry = registry
+        self.out_of_range_interval = out_of_range_interval
+        # concurrent reads handed out by the registry dispatcher
+        self.max_reads = max_reads
+        self.sessions = SessionCache()
+        self.devices = []
+        self.loop = None
+        self.executor = None
+        self.tasks = {}
+        # btaddr -> read task, of reads handed out by the registry
+        self.reading = {}
+
+    def __repr__(self):
+        return "<{} devices={}>".format(type(self).__name__, len(self.devices))
+
+    def add_device(self, btaddr, **kwargs):
+        """add a device by address; kwargs go to the device class"""
+        device = self.device_class(btaddr, self, **kwargs)
+        self.devices.append(device)
+        if self.loop:
+            self._spawn(device)
+        return device
+
+    def deliver(self, device, packet):
+        """hand a decoded packet to the sink, from any thread"""
+        self.loop.call_soon_threadsafe(self._sink_call, device, packet)
+
+    def _sink_call(self, device, packet):
+        result = self.sink(device, packet)
+        if asyncio.iscoroutine(result):
+            asyncio.ensure_future(result)
+
+    def _call(self, func, *args):
+        return self.loop.run_in_executor(self.executor, func, *args)
+
+    async def read_once(self, device):
+        """one connect / read / disconnect cycle, returning the end state"""
+        adapter = None
+        if self.adapters:
+            adapter = self.adapters.bind(device)
+            await self._call(adapter.slots.acquire)
+        try:
+            await self._call(device.connect)
+            await self._call(device.start_notify)
+            await self._call(device.notify_wait)
+            while device.state == device.STATE_READING:
+                await self._call(device.notify_wait)
+        finally:
+            try:
+                await self._call(device.disconnect)
+            except device.transport.errors:
+                log.debug("%s: error while disconnecting", device.btaddr)
+            if adapter:
+                adapter.slots.release()
+        log.debug("%s: read ended in state %s", device.btaddr, device.state)
+        return device.state
+
+    async def attempt(self, device):
+        """read_once, reporting the outcome to the adapters and registry;
+           the end state, or the transport error
+        """
+        try:
+            state = await self.read_once(device)
+        except device.transport.errors as exc:
+            device.errors += 1
+            if self.adapters:
+                self.adapters.failed(device.btaddr)
+            if self.registry is not None:
+                self.registry.read_done(device.btaddr, ok=False)
+            return exc
+        if self.adapters:
+            self.adapters.succeeded(device.btaddr)
+        if self.registry is not None:
+            self.registry.read_done(device.btaddr)
+        return state
+
+    async def _run_device(self, device):
+        backoff = 0
+        while True:
+            result = await self.attempt(device)
+            if isinstance(result, Exception):
+                backoff = min(self.max_backoff, backoff * 2 or 1.0)
+                log.warning("%s: %s, retrying in %0.1fs", device.btaddr, result, backoff)
+                await asyncio.sleep(backoff)
+                continue
+            backoff = 0
+            if result == device.STATE_SENSOR_READ:
+                await asyncio.sleep(self.interval)
+            else:
+                await asyncio.sleep(self.idle_interval)
+
+    async def _run_registry(self):
+        reading = self.reading
+        while True:
+            if len(reading) >= self.max_reads:
+                await asyncio.wait(list(reading.values()), return_when=asyncio.FIRST_COMPLETED)
+                continue
+            btaddr = self.registry.pop()
+            if btaddr is None:
+                await asyncio.sleep(self.out_of_range_interval)
+                continue
+            device = self.device(btaddr)
+            # heard, but not ours; or still being read
+            if device is None or btaddr in reading:
+                continue
+            task = reading[btaddr] = asyncio.ensure_future(self._read_registered(device))
+            task.add_done_callback(lambda task, btaddr=btaddr: reading.pop(btaddr, None))
+
+    async def _read_registered(self, device):
+        result = await self.attempt(device)
+        if isinstance(result, Exception):
+            log.warning("%s: %s", device.btaddr, result)
+
+    def device(self, btaddr):
+        for device in self.devices:
+            if device.btaddr == btaddr:
+                return device
+        return None
+
+    def _spawn(self, device):
+        # with a registry its dispatcher picks devices up by address
+        if self.registry is None:
+            self.tasks[device.btaddr] = asyncio.ensure_future(self._run_device(device))
+
+    async def run(self):
+        """run every device until stop() is called"""
+        self.loop = asyncio.get_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=max(4, len(self.devices)))
+        if self.registry is not None:
+            self.tasks["registry"] = asyncio.ensure_future(self._run_registry())
+        for device in self.devices:
+            self._spawn(device)
+        try:
+            while self.tasks:
+                tasks = list(self.tasks.values())
+                await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for btaddr, task in list(self.tasks.items()):
+                    if task.done():
+                        del self.tasks[btaddr]
+                        if not task.cancelled() and task.exception():
+                            log.error("%s: %r", btaddr, task.exception())
+        finally:
+            self.executor.shutdown(wait=False)
+            self.loop = None
+
+    def stop(self):
+        for task in list(self.tasks.values()) + list(self.reading.values()):
+            task.cancel()
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+
+import bisect
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# seconds; covers a CRC (tens of microseconds) up to a slow connect
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labeltext(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, _escape(v)) for k, v in labels) + "}"
+
+
+class Metric:
+    """a named family of samples, one per distinct set of label values"""
+
+    kind = "untyped"
+
+    def __init__(self, name, help="", lock=None):
+        self.name = name
+        self.help = help
+        self.lock = lock or threading.Lock()
+        self.children = {}
+
+    def _key(self, labels):
+        return tuple(sorted(labels.items()))
+
+    def render(self):
+        yield "# HELP {} {}".format(self.name, self.help)
+        yield "# TYPE {} {}".format(self.name, self.kind)
+        with self.lock:
+            children = list(self.children.items())
+        for key, value in children:
+            yield from self._samples(key, value)
+
+    def _samples(self, key, value):
+        yield "{}{} {}".format(self.name, _labeltext(key), value)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.children[key] = self.children.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.children[key] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help="", lock=None, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, lock)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        ibucket = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            child = self.children.get(key)
+            if child is None:
+                # per-bucket counts (last is +Inf), sum
+                child = self.children[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            child[0][ibucket] += 1
+            child[1] += value
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def _samples(self, key, value):
+        counts, total = value
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), counts):
+            cumulative += count
+            yield "{}_bucket{} {}".format(
+                self.name, _labeltext(key + (("le", bound),)), cumulative
+            )
+        yield "{}_sum{} {}".format(self.name, _labeltext(key), total)
+        yield "{}_count{} {}".format(self.name, _labeltext(key), cumulative)
+
+
+class _Timer:
+    """context manager observing its duration into a histogram"""
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+class Registry:
+    """Holds metrics by name, creating them on first use
+
+       usage:
+
+       registry = metrics.use(metrics.Registry())
+       registry.counter("miao2py_frames_total").inc(device=btaddr)
+       with registry.histogram("miao2py_stage_seconds").time(stage="decode"):
+           ...
+       print(registry.render())
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def _get(self, cls, name, help, **kwargs):
+        metric = self.metrics.get(name)
+        if metric is None:
+            with self.lock:
+                metric = self.metrics.get(name)
+                if metric is None:
+                    metric = self.metrics[name] = cls(name, help, **kwargs)
+        elif not isinstance(metric, cls):
+            raise ValueError("{} is already a {}".format(name, metric.kind))
+        return metric
+
+    def counter(self, name, help=""):
+        return self._get(Counter, name, help)
+
+    def gauge(self, name, help=""):
+        return self._get(Gauge, name, help)
+
+    def histogram(self, name, help="", buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help, buckets=buckets)
+
+    def render(self):
+        """Prometheus text exposition format"""
+        with self.lock:
+            metrics = sorted(self.metrics.items())
+        lines = [line for _, metric in metrics for line in metric.render()]
+        return "\n".join(lines) + "\n"
+
+
+class _NullMetric:
+    def inc(self, amount=1, **labels):
+        pass
+
+    def set(self, value, **labels):
+        pass
+
+    def observe(self, value, **labels):
+        pass
+
+    def time(self, **labels):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+class NullRegistry:
+    """the default: every metric is a shared no-op.  Hot paths check
+       `enabled` before even reading the clock.
+    """
+
+    enabled = False
+    _metric = _NullMetric()
+
+    def counter(self, name, help=""):
+        return self._metric
+
+    def gauge(self, name, help=""):
+        return self._metric
+
+    def histogram(self, name, help="", buckets=DEFAULT_BUCKETS):
+        return self._metric
+
+    def render(self):
+        return ""
+
+
+registry = NullRegistry()
+
+
+def use(new_registry):
+    """make new_registry the one the package reports into"""
+    global registry
+    registry = new_registry
+    return new_registry
+
+
+def stage(name):
+    """time a pipeline stage into miao2py_stage_seconds"""
+    return registry.histogram(
+        "miao2py_stage_seconds", "time spent per pipeline stage"
+    ).time(stage=name)
+
+
+class MetricsServer:
+    """Serves a registry's text exposition on /metrics from a daemon thread
+
+       usage:
+
+       server = MetricsServer(registry, port=9464)
+       server.start()
+    """
+
+    def __init__(self, registry, port=9464, addr="127.0.0.1"):
+        self.registry = registry
+        self.addr = addr
+        self.port = port
+        self.httpd = None
+        self.thread = None
+
+    def start(self):
+        # http.server is only worth importing when metrics are served
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+        from socketserver import ThreadingMixIn
+
+        class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        metrics_registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics_registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                log.debug("%s " + format, self.address_string(), *args)
+
+        self.httpd = ThreadingHTTPServer((self.addr, self.port), Handler)
+        # port=0 picks a free one
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(
+            target=self.httpd.serve_forever, name="metrics-http", daemon=True
+        )
+        self.thread.start()
+        log.info("serving metrics on http://%s:%d/metrics", self.addr, self.port)
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+
+
+def serve(port, addr="127.0.0.1"):
+    """start reporting into a fresh Registry served on port"""
+    server = MetricsServer(use(Registry()), port, addr)
+    server.start()
+    return server
@@ -2,42 +2,360 @@
 
 import asyncio
 import logging
+import threading
+import time
 
-from hbmqtt.client import MQTTClient, ConnectException
-
+from . import analytics as stream_analytics, metrics, wire
+from .delta import DeltaTracker
 from .device import MiaoMiaoDevice
+from .packet import MiaoMiaoPacket
 
 log = logging.getLogger(__name__)
 
+_STOP = object()
 
-class MiaoMiaoMQPublisher(MiaoMiaoDevice):
-    def __init__(self, btaddr, mqurl, mqtopic, *, aioloop=None):
-        super().__init__(btaddr)
-        self.aioloop = aioloop
+
+def mqtt_client():
+    """a new hbmqtt client; hbmqtt is only imported when one is needed"""
+    from hbmqtt.client import MQTTClient
+
+    return MQTTClient()
+
+
+def connect_errors():
+    """exceptions a failed broker connect raises"""
+    try:
+        from hbmqtt.client import ConnectException
+    except ImportError:
+        return (OSError,)
+    return (ConnectException, OSError)
+
+
+class PublishQueue:
+    """Bounded queue of MQTT messages drained by a background sender
+
+       the sender runs its own event loop in a daemon thread, so submit()
+       returns immediately to the BLE notification callback.  Messages
+       are published in batches of up to batch_size, waiting at most
+       batch_ms for a batch to fill.  When the queue is full, policy
+       "drop-oldest" discards the oldest message and "block" makes
+       submit() wait for room.  A failed publish reconnects with
+       exponential backoff and retries the batch.
+
+       usage:
+
+       queue = PublishQueue("mqtt://broker", batch_size=8, batch_ms=250)
+       queue.start()
+       queue.submit("miaomiao/ff:ff", frame)
+       queue.stop()
+    """
+
+    DROP_OLDEST = "drop-oldest"
+    BLOCK = "block"
+    policies = (DROP_OLDEST, BLOCK)
+
+    def __init__(
+        self,
+        mqurl,
+        *,
+        maxsize=256,
+        batch_size=1,
+        batch_ms=0,
+        qos=0,
+        policy=DROP_OLDEST,
+        backoff_initial=0.5,
+        backoff_max=30.0,
+        client_factory=mqtt_client
+    ):
+        if policy not in self.policies:
+            raise ValueError("unknown backpressure policy: {}".format(policy))
         self.mqurl = mqurl
-        self.mqtopic = mqtopic
-        self.mqclient = MQTTClient()
+        self.maxsize = maxsize
+        self.batch_size = max(1, batch_size)
+        self.batch_ms = batch_ms
+        self.qos = qos
+        self.policy = policy
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.client_factory = client_factory
+        self.client = None
+        self.aioloop = None
+        self.queue = None
+        self.thread = None
+        self.sender = None
+        self._started = threading.Event()
+        # messages handed to the broker
+        self.published = 0
+        # messages discarded by drop-oldest
+        self.dropped = 0
+        # failed publish or connect attempts
+        self.failures = 0
+        # seconds from submit() to broker acknowledgement
+        self.latency = 0.0
+        self.max_latency = 0.0
+
+    def __repr__(self):
+        return "<{} {} depth={} published={} dropped={}>".format(
+            type(self).__name__, self.mqurl, self.depth, self.published, self.dropped
+        )
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    @property
+    def depth(self):
+        """messages waiting to be sent"""
+        return self.queue.qsize() if self.queue else 0
+
+    def stats(self):
+        return {
+            "depth": self.depth,
+            "published": self.published,
+            "dropped": self.dropped,
+            "failures": self.failures,
+            "latency": self.latency,
+            "max_latency": self.max_latency,
+        }
+
+    def start(self):
+        """start the sender thread, if it is not already running"""
+        if self.running:
+            return
+        self._started.clear()
+        self.thread = threading.Thread(
+            target=self._thread_main, name="mqpub-sender", daemon=True
+        )
+        self.thread.start()
+        self._started.wait()
 
-    def _ensure_aioloop(self):
-        """get the event loop here.  we may have been initialized
-           in a different thread, hopefully we were called in the
-           right one and the default event loop is fine
+    def stop(self, timeout=10.0):
+        """send what is queued, disconnect and stop the sender thread"""
+        if not self.running:
+            return
+        self.aioloop.call_soon_threadsafe(
+            lambda: asyncio.ensure_future(self.queue.put(_STOP))
+        )
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            log.warning("sender did not drain within %0.1fs, cancelling it", timeout)
+            self.aioloop.call_soon_threadsafe(self.sender.cancel)
+            self.thread.join(timeout)
+
+    def submit(self, topic, payload):
+        """queue a message for publishing; safe to call from any thread"""
+        item = (topic, bytes(payload), time.monotonic())
+        if self.policy == self.BLOCK:
+            asyncio.run_coroutine_threadsafe(self.queue.put(item), self.aioloop).result()
+        else:
+            self.aioloop.call_soon_threadsafe(self._put_drop_oldest, item)
+
+    def _put_drop_oldest(self, item):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+            metrics.registry.counter(
+                "miao2py_publish_dropped_total", "messages dropped by a full queue"
+            ).inc(broker=self.mqurl)
+            log.debug("queue full, dropped oldest message")
+        self.queue.put_nowait(item)
+        self._report_depth()
+
+    def _report_depth(self):
+        metrics.registry.gauge(
+            "miao2py_publish_queue_depth", "messages waiting to be published"
+        ).set(self.queue.qsize(), broker=self.mqurl)
+
+    def _thread_main(self):
+        self.aioloop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.aioloop)
+        self.queue = asyncio.Queue(self.maxsize)
+        self.sender = self.aioloop.create_task(self._sender())
+        self._started.set()
+        try:
+            self.aioloop.run_until_complete(self.sender)
+        except asyncio.CancelledError:
+            log.info("sender cancelled with %d messages queued", self.queue.qsize())
+        finally:
+            self.aioloop.close()
+
+    async def _connect(self):
+        delay = self.backoff_initial
+        errors = connect_errors()
+        while True:
+            self.client = self.client_factory()
+            try:
+                await self.client.connect(self.mqurl)
+                return
+            except errors as exc:
+                self.failures += 1
+                metrics.registry.counter(
+                    "miao2py_errors_total", "errors by device and kind"
+                ).inc(device=self.mqurl, kind="mqtt_connect")
+                log.warning("MQTT connect failed (%s), retrying in %0.1fs", exc, delay)
+            await asyncio.sleep(delay)
+            delay = min(self.backoff_max, delay * 2)
+
+    async def _next_batch(self):
+        batch = [await self.queue.get()]
+        deadline = self.aioloop.time() + self.batch_ms / 1000.0
+        while len(batch) < self.batch_size and batch[-1] is not _STOP:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - self.aioloop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _publish(self, batch):
+        """publish a batch, retrying (after a reconnect) only the messages
+           that failed, so ones the broker acknowledged are not repeated
         """
-        if not self.aioloop:
-            self.aioloop = asyncio.get_event_loop()
+        delay = self.backoff_initial
+        started = time.perf_counter()
+        pending = batch
+        while True:
+            results = await asyncio.gather(
+                *[
+                    self.client.publish(topic, payload, qos=self.qos)
+                    for topic, payload, _ in pending
+                ],
+                return_exceptions=True
+            )
+            for result in results:
+                # cancelled, not failed: shutting down, so stop retrying
+                if isinstance(result, asyncio.CancelledError):
+                    raise result
+            failed = [
+                (item, result)
+                for item, result in zip(pending, results)
+                if isinstance(result, BaseException)
+            ]
+            if not failed:
+                break
+            self.failures += 1
+            metrics.registry.counter(
+                "miao2py_errors_total", "errors by device and kind"
+            ).inc(device=self.mqurl, kind="mqtt_publish")
+            log.warning(
+                "%d of %d MQTT publishes failed (%s), reconnecting in %0.1fs",
+                len(failed),
+                len(pending),
+                failed[0][1],
+                delay,
+            )
+            pending = [item for item, _ in failed]
+            await asyncio.sleep(delay)
+            delay = min(self.backoff_max, delay * 2)
+            await self._connect()
+        registry = metrics.registry
+        if registry.enabled:
+            registry.histogram(
+                "miao2py_stage_seconds", "time spent per pipeline stage"
+            ).observe(time.perf_counter() - started, stage="publish")
+            registry.counter("miao2py_published_total", "messages published").inc(
+                len(batch), broker=self.mqurl
+            )
+            self._report_depth()
+        now = time.monotonic()
+        for _, _, submitted in batch:
+            latency = now - submitted
+            self.latency = 0.9 * self.latency + 0.1 * latency if self.published else latency
+            self.max_latency = max(self.max_latency, latency)
+            self.published += 1
+
+    async def _sender(self):
+        await self._connect()
+        stopping = False
+        while not stopping:
+            batch = await self._next_batch()
+            if batch[-1] is _STOP:
+                stopping = True
+                batch.pop()
+                while not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+            if batch:
+                await self._publish(batch)
+        await self.client.disconnect()
+
+
+class MiaoMiaoMQPublisher(MiaoMiaoDevice):
+    """Publishes every raw frame from the device to an MQTT topic
+
+       frames are handed to a PublishQueue so that broker round trips
+       never stall Bluetooth servicing; pass a shared queue to keep one
+       MQTT connection across device reconnects
+
+       formats picks "raw" envelopes on mqtopic and/or "compact" records
+       on mqtopic + wire.COMPACT_SUFFIX; with delta=True compact records
+       only carry readings not published before
+
+       with analytics=True the rate of change, trend arrow and forecasts
+       of each sensor are published as JSON on mqtopic +
+       analytics.ANALYTICS_SUFFIX after every frame
+    """
+
+    formats = ("raw", "compact")
+
+    def __init__(
+        self,
+        btaddr,
+        mqurl,
+        mqtopic,
+        *,
+        queue=None,
+        formats=("raw",),
+        delta=False,
+        analytics=False,
+        **kwargs
+    ):
+        super().__init__(btaddr, **kwargs)
+        for fmt in formats:
+            if fmt not in self.formats:
+                raise ValueError("unknown publish format: {}".format(fmt))
+        self.mqurl = mqurl
+        self.mqtopic = mqtopic
+        self.owns_queue = queue is None
+        self.queue = queue or PublishQueue(mqurl)
+        self.publish_formats = formats
+        self.tracker = DeltaTracker() if delta else None
+        self.analytics = stream_analytics.StreamAnalytics() if analytics else None
 
     def handleConnect(self):
-        """connect to MQTT when we connect to the actual device"""
+        """make sure the sender runs when we connect to the actual device"""
         super().handleConnect()
-        self._ensure_aioloop()
-        self.aioloop.run_until_complete(self.mqclient.connect(self.mqurl))
+        self.queue.start()
 
     def handleDisconnect(self):
-        """disconnect from MQTT when we disconnect from the actual device"""
+        """drain and stop our own sender when we disconnect from the device"""
         super().handleDisconnect()
-        self._ensure_aioloop()
-        self.aioloop.run_until_complete(self.mqclient.disconnect())
+        if self.owns_queue:
+            self.queue.stop()
 
     def handlePacket(self, data):
-        self._ensure_aioloop()
-        self.aioloop.run_until_complete(self.mqclient.publish(self.mqtopic, data))
+        super().handlePacket(data)
+        if "raw" in self.publish_formats:
+            self.queue.submit(self.mqtopic, data)
+        compact = "compact" in self.publish_formats
+        if not compact and self.analytics is None:
+            return
+        try:
+            packet = MiaoMiaoPacket.from_bytes(data)
+        except ValueError:
+            log.exception("not publishing undecodable frame")
+            return
+        readings = self.tracker.update(packet) if self.tracker else None
+        if compact:
+            self.queue.submit(wire.compact_topic(self.mqtopic), wire.encode(packet, readings))
+        if self.analytics is not None:
+            result = self.analytics.update_packet(packet, readings=readings)
+            if result is not None:
+                self.queue.submit(
+                    stream_analytics.analytics_topic(self.mqtopic),
+                    stream_analytics.encode(result),
+                )
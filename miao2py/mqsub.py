@@ -1,29 +1,126 @@
 #!/usr/bin/env python3
 
 import asyncio
+import json
 import logging
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-from hbmqtt.client import MQTTClient, ConnectException
+from . import wire
+from .analytics import ANALYTICS_SUFFIX
+from .mqpub import mqtt_client
 
 log = logging.getLogger(__name__)
 
 
+def decode_frame(topic, data):
+    """worker-side decode of one raw frame, compact record or analytics
+       result
+    """
+    if topic.endswith(ANALYTICS_SUFFIX):
+        return json.loads(bytes(data).decode())
+    return wire.decode(topic, data)
+
+
 class MiaoMiaoMQSubscriber:
-    def __init__(self, mqurl, mqtopic, *, aioloop=None):
-        super().__init__(btaddr)
+    """Consumes raw frames from an MQTT topic (wildcards welcome) and
+       decodes them on a pool of workers
+
+       messages on topics ending in wire.COMPACT_SUFFIX are decoded as
+       compact records, those ending in analytics.ANALYTICS_SUFFIX as
+       JSON, everything else as raw envelopes
+
+       topics are sharded across single-worker executors, so frames from
+       one publisher are decoded and handled in the order they arrived
+       while different publishers decode in parallel.  Override
+       handleMessage for application handling.
+    """
+
+    def __init__(
+        self,
+        mqurl,
+        mqtopic,
+        *,
+        aioloop=None,
+        qos=0,
+        workers=None,
+        processes=False,
+        max_inflight=1024,
+        client_factory=mqtt_client
+    ):
         self.aioloop = aioloop
         self.mqurl = mqurl
         self.mqtopic = mqtopic
-        self.mqclient = MQTTClient()
+        self.qos = qos
+        self.mqclient = client_factory()
+        self.workers = workers or os.cpu_count() or 1
+        self.processes = processes
+        self.max_inflight = max_inflight
+        self.shards = []
+        self.pending = {}
+        self.inflight = None
+        self.decoded = 0
+        self.errors = 0
 
     async def subscriber(self):
         await self.mqclient.connect(self.mqurl)
-        await self.mqclient.subscribe([self.mqtopic])
-        async for message in self.mqclient.deliver_message():
+        await self.mqclient.subscribe([(self.mqtopic, self.qos)])
+        while True:
+            message = await self.mqclient.deliver_message()
             yield message
 
     async def disconnect(self):
         await self.mqclient.disconnect()
 
-    def handleMessage(self, message):
-        print("message:", message)
+    def _start_workers(self):
+        executor = ProcessPoolExecutor if self.processes else ThreadPoolExecutor
+        self.shards = [executor(max_workers=1) for _ in range(self.workers)]
+
+    def _stop_workers(self):
+        for shard in self.shards:
+            shard.shutdown(wait=True)
+        self.shards = []
+
+    def submit(self, topic, data):
+        """decode a frame on the topic's shard; returns its future"""
+        shard = self.shards[hash(topic) % len(self.shards)]
+        future = self.aioloop.run_in_executor(shard, decode_frame, topic, data)
+        self.pending.setdefault(topic, deque()).append(future)
+        future.add_done_callback(lambda _: self._drain(topic))
+        return future
+
+    def _drain(self, topic):
+        """hand over finished frames of a topic, oldest first"""
+        pending = self.pending.get(topic)
+        while pending and pending[0].done():
+            future = pending.popleft()
+            self.inflight.release()
+            if future.exception():
+                self.errors += 1
+                log.warning("%s: undecodable frame: %s", topic, future.exception())
+                continue
+            self.decoded += 1
+            self.handleMessage(topic, future.result())
+        if not pending:
+            self.pending.pop(topic, None)
+
+    async def run(self):
+        """consume and decode until cancelled"""
+        if not self.aioloop:
+            self.aioloop = asyncio.get_event_loop()
+        self.inflight = asyncio.Semaphore(self.max_inflight)
+        self._start_workers()
+        try:
+            async for message in self.subscriber():
+                await self.inflight.acquire()
+                self.submit(message.topic, message.data)
+        finally:
+            pending = [f for futures in self.pending.values() for f in futures]
+            if pending:
+                await asyncio.wait(pending)
+            self._stop_workers()
+            await self.disconnect()
+
+    def handleMessage(self, topic, packet):
+        print("{}: {}".format(topic, packet))
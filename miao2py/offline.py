@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+
+import binascii
+import csv
+import itertools
+import json
+import logging
+import os
+import struct
+import sys
+
+from .archive import ArchiveReader, FrameArchive
+from .framing import FrameReassembler
+from .packet import MiaoMiaoPacket
+from .session import decode_serial
+
+log = logging.getLogger(__name__)
+
+FORMATS = ("auto", "hex", "binary", "archive")
+
+
+def _sniff(head):
+    if head.startswith(FrameArchive.magic):
+        return "archive"
+    if head[:1] == bytes([FrameReassembler.start_pkt]):
+        return "binary"
+    return "hex"
+
+
+def _frames_from_stream(stream, fmt):
+    if fmt == "hex":
+        for lineno, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line or line.startswith(b"#"):
+                continue
+            try:
+                yield binascii.unhexlify(b"".join(line.split()))
+            except binascii.Error as exc:
+                log.warning("skipping line %d: %s", lineno, exc)
+        return
+    reassembler = FrameReassembler()
+    while True:
+        chunk = stream.read(65536)
+        if not chunk:
+            break
+        yield from reassembler.feed(chunk)
+    reassembler.reset()
+    if reassembler.dropped_frames or reassembler.partial_frames:
+        log.warning("skipped damaged data: %r", reassembler)
+
+
+def _frames_from_file(path, fmt):
+    with open(path, "rb") as stream:
+        if fmt == "auto":
+            fmt = _sniff(stream.read(4))
+            stream.seek(0)
+        if fmt != "archive":
+            yield from _frames_from_stream(stream, fmt)
+            return
+    with ArchiveReader(path) as reader:
+        for archived in reader.scan():
+            frame = bytes(archived.frame)
+            # let the mapping close even if we are abandoned mid-scan
+            archived.frame.release()
+            yield frame
+
+
+def iter_frames(sources, fmt="auto"):
+    """yield (source, index, frame) for every raw frame in the given
+       files, directories (walked in name order, skipping archive
+       .idx sidecars) or "-" for stdin; frames are hex lines,
+       concatenated binary or a FrameArchive
+    """
+    for source in sources:
+        if source == "-":
+            stream = sys.stdin.buffer
+            stdin_fmt = _sniff(stream.peek(4)[:4]) if fmt == "auto" else fmt
+            if stdin_fmt == "archive":
+                raise ValueError("archives cannot be read from stdin")
+            paths = [(source, _frames_from_stream(stream, stdin_fmt))]
+        elif os.path.isdir(source):
+            paths = [
+                (path, _frames_from_file(path, fmt))
+                for root, dirs, files in sorted(os.walk(source))
+                for path in (
+                    os.path.join(root, name) for name in sorted(files)
+                    # a FrameArchive's index, read along with the archive
+                    if not (name.endswith(".idx") and name[:-4] in files)
+                )
+            ]
+        else:
+            paths = [(source, _frames_from_file(source, fmt))]
+        for path, frames in paths:
+            for index, frame in enumerate(frames):
+                yield path, index, frame
+
+
+def decode_record(source, index, frame):
+    """plain dict of one decoded frame, or of the error decoding it"""
+    try:
+        packet = MiaoMiaoPacket.from_bytes(frame)
+    except (ValueError, IndexError, struct.error) as exc:
+        # a short or damaged frame must not take the whole run down
+        log.debug("%s #%d: %s", source, index, exc)
+        return {"source": source, "index": index, "error": str(exc)}
+    librepacket = packet.librepacket
+    return {
+        "source": source,
+        "index": index,
+        "sensor_id": binascii.hexlify(packet.sensor_id).decode(),
+        "serial": decode_serial(packet.sensor_id),
+        "battery": packet.battery,
+        "fw_version": packet.fw_version,
+        "hw_version": packet.hw_version,
+        "minutes": librepacket.minutes,
+        "index_trend": librepacket.index_trend,
+        "index_history": librepacket.index_history,
+        "trends": [entry[0] for entry in librepacket.trends],
+        "history": [entry[0] for entry in librepacket.history],
+    }
+
+
+def decode_chunk(chunk):
+    """worker-side decode of a list of (source, index, frame)"""
+    return [decode_record(*item) for item in chunk]
+
+
+def _chunks(items, size):
+    items = iter(items)
+    while True:
+        chunk = list(itertools.islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def decode_all(frames, *, jobs=None, chunk_size=256, ordered=True):
+    """decode (source, index, frame) items across a process pool in
+       chunks, yielding records in input order or as they finish
+    """
+    # multiprocessing is most of this module's import time
+    from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+    workers = jobs or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        chunks = _chunks(frames, chunk_size)
+        if ordered:
+            # executor.map would submit every chunk up front
+            pending = []
+            for chunk in chunks:
+                pending.append(pool.submit(decode_chunk, chunk))
+                if len(pending) >= workers * 2:
+                    yield from pending.pop(0).result()
+            for future in pending:
+                yield from future.result()
+            return
+        pending = set()
+        for chunk in chunks:
+            pending.add(pool.submit(decode_chunk, chunk))
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from future.result()
+        for future in pending:
+            yield from future.result()
+
+
+class NDJSONEmitter:
+    """one JSON object per line, errors included"""
+
+    def __init__(self, out):
+        self.out = out
+
+    def emit(self, record):
+        self.out.write(json.dumps(record))
+        self.out.write("\n")
+
+    def close(self):
+        self.out.flush()
+
+
+class CSVEmitter:
+    """one row per frame with the glucose of each ring entry in its own
+       column; undecodable frames are logged and skipped
+    """
+
+    header = (
+        ["source", "index", "sensor_id", "battery", "fw_version", "hw_version"]
+        + ["minutes", "index_trend", "index_history"]
+        + ["trend_{}".format(imem) for imem in range(16)]
+        + ["history_{}".format(imem) for imem in range(32)]
+    )
+
+    def __init__(self, out):
+        self.out = out
+        self.writer = csv.writer(out)
+        self.writer.writerow(self.header)
+
+    def emit(self, record):
+        if "error" in record:
+            log.warning("%s #%d: %s", record["source"], record["index"], record["error"])
+            return
+        self.writer.writerow(
+            [record[column] for column in self.header[:9]]
+            + record["trends"]
+            + record["history"]
+        )
+
+    def close(self):
+        self.out.flush()
+
+
+emitters = {"ndjson": NDJSONEmitter, "csv": CSVEmitter}
+
+
+def main(argv=None):
+    """stdlib-only entry point: python3 -m miao2py.offline FILE..."""
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="python3 -m miao2py.offline", description="decode captured raw frames"
+    )
+    parser.add_argument("inputs", nargs="+", help="files, directories or - (stdin)")
+    parser.add_argument("--input-format", choices=FORMATS, default="auto")
+    parser.add_argument("--output", choices=sorted(emitters), default="ndjson")
+    parser.add_argument("--jobs", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=256)
+    parser.add_argument("--unordered", dest="ordered", action="store_false")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    emitter = emitters[args.output](sys.stdout)
+    frames = iter_frames(args.inputs, args.input_format)
+    records = decode_all(
+        frames, jobs=args.jobs, chunk_size=args.chunk_size, ordered=args.ordered
+    )
+    for record in records:
+        emitter.emit(record)
+    emitter.close()
+
+
+if __name__ == "__main__":
+    main()
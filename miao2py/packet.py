@@ -3,11 +3,23 @@
 import struct
 import logging
 import datetime
+import time
 from binascii import hexlify
+from collections import namedtuple
+
+from . import metrics, trace
 
 log = logging.getLogger(__name__)
 
 
+def _slice_tables(table, n):
+    tables = [table]
+    for _ in range(n - 1):
+        prev = tables[-1]
+        tables.append([(entry >> 8) ^ table[entry & 0xFF] for entry in prev])
+    return tables
+
+
 class crc16:
     table = [
         0,
@@ -268,14 +280,37 @@ class crc16:
         3960,
     ]
 
+    # slicing-by-8: tables[k][i] is table[i] pushed through k more zero bytes
+    tables = _slice_tables(table, 8)
+    # byte bit-reversal, for the reflected result
+    reverse = [int("{:08b}".format(i)[::-1], 2) for i in range(256)]
+
+    # (start, end) of the three CRC'd regions of a Libre packet, each
+    # region beginning with its own little-endian CRC
+    libre_regions = ((0, 24), (24, 320), (320, 344))
+
     @classmethod
     def of(cls, block):
         """calculate crc of a block using the maths"""
+        t7, t6, t5, t4, t3, t2, t1, t0 = cls.tables[::-1]
         crc = 0xFFFF
-        for char in block:
-            crc = (crc >> 8) ^ cls.table[(crc ^ char) & 0xFF]
-        # flippin bitz
-        return crc ^ 0xFFFF
+        nwide = len(block) - len(block) % 8
+        octets = iter(block[:nwide])
+        for b0, b1, b2, b3, b4, b5, b6, b7 in zip(*[octets] * 8):
+            crc = (
+                t7[(crc ^ b0) & 0xFF]
+                ^ t6[(crc >> 8) ^ b1]
+                ^ t5[b2]
+                ^ t4[b3]
+                ^ t3[b4]
+                ^ t2[b5]
+                ^ t1[b6]
+                ^ t0[b7]
+            )
+        for char in block[nwide:]:
+            crc = (crc >> 8) ^ t0[(crc ^ char) & 0xFF]
+        # flippin bitz: the Libre stores the CRC bit-reversed
+        return (cls.reverse[crc & 0xFF] << 8) | cls.reverse[crc >> 8]
 
     @classmethod
     def at(cls, block):
@@ -290,68 +325,207 @@ class crc16:
         ecrc, crc = cls.at(block)
         return crc == ecrc
 
+    @classmethod
+    def check_many(cls, data, regions=None, stride=None, offset=0):
+        """check the CRC'd regions of many blocks at once
+
+           data is a list of blocks or one contiguous buffer of blocks
+           `stride` bytes apart; regions are relative to `offset` within
+           each block and default to the three Libre regions.  Returns a
+           list holding a tuple of booleans (one per region) per block.
+           Uses numpy to check all blocks in lockstep when available.
+        """
+        regions = regions or cls.libre_regions
+        if isinstance(data, (list, tuple)):
+            blocks = [memoryview(block)[offset:] for block in data]
+        else:
+            if not stride:
+                raise ValueError("stride is required for a contiguous buffer")
+            view = memoryview(data)
+            blocks = [
+                view[low + offset : low + stride]
+                for low in range(0, len(view) - stride + 1, stride)
+            ]
+        try:
+            import numpy
+        except ImportError:
+            return [
+                tuple(cls.check(block[start:end]) for start, end in regions)
+                for block in blocks
+            ]
+
+        if not blocks:
+            return []
+        span = max(end for _, end in regions)
+        frames = numpy.frombuffer(
+            b"".join(bytes(block[:span]) for block in blocks), dtype=numpy.uint8
+        ).reshape(len(blocks), span)
+        table = numpy.array(cls.table, dtype=numpy.uint32)
+        reverse = numpy.array(cls.reverse, dtype=numpy.uint32)
+        results = []
+        for start, end in regions:
+            ecrc = frames[:, start].astype(numpy.uint32) | (
+                frames[:, start + 1].astype(numpy.uint32) << 8
+            )
+            crc = numpy.full(len(blocks), 0xFFFF, dtype=numpy.uint32)
+            for column in frames[:, start + 2 : end].T:
+                crc = (crc >> 8) ^ table[(crc ^ column) & 0xFF]
+            crc = (reverse[crc & 0xFF] << 8) | reverse[crc >> 8]
+            results.append(crc == ecrc)
+        return list(zip(*(result.tolist() for result in results)))
+
+
+_entry = struct.Struct("<HHH")
+_int16le = struct.Struct("<h")
+_int16be = struct.Struct(">h")
+
+LibreBatch = namedtuple(
+    "LibreBatch", ["trends", "history", "index_trend", "index_history", "minutes"]
+)
+
 
 class LibrePacket:
     """Represents a data packet directly as read from a Freestyle Libre sensor"""
+
+    # size of the Libre FRAM image carried by the envelope
+    length = 344
+    # ring buffer layout: (offset, entries) of 6-byte entries
+    trend_ring = (46, 16)
+    history_ring = (142, 32)
+    glucose_divisor = 8.5
+
     @classmethod
-    def from_bytes(cls, data, timestamp=None):
+    def from_bytes(cls, data, timestamp=None, *, verify=False, converter=None):
+        """parse a Libre packet; with verify=True a CRC mismatch in any
+           region raises ValueError
+
+           by default every word of each ring entry is divided by
+           glucose_divisor; with a calibration converter each entry is
+           [glucose, aux1, aux2] with the auxiliary words left raw
+        """
         # NOTE: Libre sensors are little-endian, regardless of the endianness
         # of the encapsulating device
         packet = cls()
         packet.data = data
 
-        # L0-1: CRC of 2-23 [TODO: does not work]
-        ecrc1, crc1 = crc16.at(packet.data[0:24])
-        log.debug("crc1: %x %x %s", ecrc1, crc1, ecrc1 == crc1)
-
+        # L0-1: CRC of 2-23
         # Second arena: Sensor data
-        # L24-25: CRC of 26-319  [TODO: does not work]
-        ecrc2, crc2 = crc16.at(packet.data[24:320])
-        log.debug("crc2: %x %x %s", ecrc2, crc2, ecrc2 == crc2)
+        # L24-25: CRC of 26-319
+        # L320-321: CRC16 of 322-343
+        debug = log.isEnabledFor(logging.DEBUG)
+        if verify or debug:
+            cls.verify(data, strict=verify)
 
         packet.index_trend = packet.data[26]
         packet.index_history = packet.data[27]
 
-        # L320-321: CRC16 of 322-343  [TODO: does not work]
-        ecrc3, crc3 = crc16.at(packet.data[320:344])
-        log.debug("crc3: %x %x %s", ecrc3, crc3, ecrc3 == crc3)
-
         packet.minutes = struct.unpack("<h", data[335:337])[0]
-        packet.sensor_start = datetime.datetime.now() - datetime.timedelta(
-            minutes=packet.minutes
-        )
+        received = timestamp or datetime.datetime.now()
+        packet.sensor_start = received - datetime.timedelta(minutes=packet.minutes)
 
-        packet.history = []
-
-        nhistory = 32
-        packet.history = []
-        for imem in range(nhistory):
-            ird = (packet.index_history - imem - 1) % nhistory
-            bias = 142
-            low, high = bias + ird * 6, bias + (ird + 1) * 6
-
-            entrydata = data[low:high]
-            entryle = struct.unpack("<HHH", entrydata)
-            entry = [dtry / 8.5 for dtry in entryle]
-            packet.history.append(entry)
-            if imem == 0:
-                log.debug("H%d@%d %s" % (imem, ird, entry))
-
-        packet.trends = []
-        ntrends = 16
-        for imem in range(ntrends):
-            ird = (packet.index_trend - imem - 1) % ntrends
-            bias = 46
-            low, high = bias + ird * 6, bias + (ird + 1) * 6
-            entrydata = data[low:high]
-            entryle = struct.unpack("<HHH", entrydata)
-            entry = [dtry / 8.5 for dtry in entryle]
-            packet.trends.append(entry)
-            if imem == 0:
-                log.debug("T%d@%d %s" % (imem, ird, entry))
+        history = cls.ring_words(data, cls.history_ring, packet.index_history)
+        trends = cls.ring_words(data, cls.trend_ring, packet.index_trend)
+        if converter is None:
+            divisor = cls.glucose_divisor
+            packet.history = [[word / divisor for word in entry] for entry in history]
+            packet.trends = [[word / divisor for word in entry] for entry in trends]
+        else:
+            packet.history = converter.convert_ring(history)
+            packet.trends = converter.convert_ring(trends)
+        if debug:
+            log.debug("H0@%d %s", (packet.index_history - 1) % 32, packet.history[0])
+            log.debug("T0@%d %s", (packet.index_trend - 1) % 16, packet.trends[0])
 
         return packet
 
+    @staticmethod
+    def ring_words(data, ring, index):
+        """the raw (word, word, word) entries of a ring, newest first"""
+        offset, nentries = ring
+        return [
+            _entry.unpack_from(data, offset + (index - imem - 1) % nentries * 6)
+            for imem in range(nentries)
+        ]
+
+    @staticmethod
+    def verify(data, strict=True):
+        """check the three CRC'd regions, raising ValueError on a mismatch
+           when strict
+        """
+        with metrics.stage("crc"):
+            crcs = [crc16.at(data[start:end]) for start, end in crc16.libre_regions]
+        regions = zip(crc16.libre_regions, crcs)
+        for iregion, ((start, end), (ecrc, crc)) in enumerate(regions, 1):
+            log.debug("crc%d: %x %x %s", iregion, ecrc, crc, ecrc == crc)
+            if strict and ecrc != crc:
+                raise ValueError(
+                    "Libre packet CRC mismatch in {}-{}: {:04x} != {:04x}".format(
+                        start, end, ecrc, crc
+                    )
+                )
+
+    @classmethod
+    def decode_batch(cls, data, stride=None, *, converter=None, raw=False):
+        """decode many payloads at once into numpy arrays
+
+           data is either one contiguous buffer of N payloads, each
+           `stride` bytes apart (default: cls.length), or a list of
+           payloads.  Returns a LibreBatch of:
+
+             trends         N x 16 x 3, newest first
+             history        N x 32 x 3, newest first
+             index_trend    N
+             index_history  N
+             minutes        N
+
+           ring entries are divided by glucose_divisor, converted like
+           from_bytes when a converter is given, or left as uint16 words
+           with raw=True
+        """
+        import numpy
+
+        if isinstance(data, (list, tuple)):
+            stride = cls.length
+            data = b"".join(bytes(payload[: cls.length]) for payload in data)
+        stride = stride or cls.length
+        if stride < cls.length:
+            raise ValueError("stride shorter than a Libre packet: {}".format(stride))
+        buf = numpy.frombuffer(data, dtype=numpy.uint8)
+        if buf.size % stride:
+            raise ValueError(
+                "buffer of {} bytes is not a multiple of {}".format(buf.size, stride)
+            )
+        frames = buf.reshape(-1, stride)[:, : cls.length]
+        nframes = frames.shape[0]
+
+        index_trend = frames[:, 26].astype(numpy.intp)
+        index_history = frames[:, 27].astype(numpy.intp)
+        minutes = numpy.ascontiguousarray(frames[:, 335:337]).view("<i2")[:, 0]
+
+        rows = numpy.arange(nframes)[:, None]
+
+        def ring(offset, nentries, index):
+            words = numpy.ascontiguousarray(frames[:, offset : offset + nentries * 6])
+            entries = words.view("<u2").reshape(nframes, nentries, 3)
+            # newest entry sits just behind the ring index
+            order = (index[:, None] - numpy.arange(1, nentries + 1)) % nentries
+            words = entries[rows, order]
+            if raw:
+                return words
+            if converter is None:
+                return words / cls.glucose_divisor
+            converted = words.astype(numpy.float64)
+            converted[..., 0] = converter.convert_array(words)
+            return converted
+
+        return LibreBatch(
+            trends=ring(*cls.trend_ring, index_trend),
+            history=ring(*cls.history_ring, index_history),
+            index_trend=index_trend,
+            index_history=index_history,
+            minutes=minutes,
+        )
+
     def __repr__(self):
         return "<%s ih=%d it=%d minutes=%d start='%s'>" % (type(self).__name__, self.index_history, self.index_trend, self.minutes, self.sensor_start)
 
@@ -364,7 +538,38 @@ class MiaoMiaoPacket:
     decoder_ring = "0123456789ACDEFGHJKLMNPQRTUVWXYZ"
 
     @classmethod
-    def from_bytes(cls, data, timestamp=None):
+    def from_bytes(cls, data, timestamp=None, *, lazy=False, verify=False, converter=None):
+        """parse an envelope packet
+
+           with lazy=True a MiaoMiaoPacketView is returned instead,
+           which wraps data without copying and decodes the Libre rings
+           only when they are asked for.  verify=True rejects frames
+           whose Libre CRCs do not match; converter is handed to
+           LibrePacket.from_bytes (or the view)
+        """
+        if lazy:
+            return MiaoMiaoPacketView(
+                data, timestamp, verify=verify, converter=converter
+            )
+        if trace.tracer.enabled and trace.tracer.current is not None:
+            span = trace.tracer.current
+            return cls._parse_traced(data, timestamp, verify, converter, span)
+        if metrics.registry.enabled:
+            with metrics.stage("decode"):
+                return cls._parse(data, timestamp, verify, converter)
+        return cls._parse(data, timestamp, verify, converter)
+
+    @classmethod
+    def _parse_traced(cls, data, timestamp, verify, converter, span):
+        with metrics.stage("decode"):
+            started = time.perf_counter()
+            packet = cls._parse(data, timestamp, verify, converter)
+            span.add("decode", time.perf_counter() - started)
+        span.attrs["sensor"] = hexlify(packet.sensor_id).decode()
+        return packet
+
+    @classmethod
+    def _parse(cls, data, timestamp, verify, converter=None):
         # NOTE: the miaomiao is a big-endian device, but it hosts
         # data from the sensor, which is little-endian
         packet = cls()
@@ -383,7 +588,9 @@ class MiaoMiaoPacket:
         # determine sensor serial number
         # SN 0M00031VE4H
         # 0m0003A74MR
-        log.debug("E3-12: %s", hexlify(packet.rawpacket[3:13]))
+        packet.sensor_id = bytes(packet.rawpacket[3:13])
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("E3-12: %s", hexlify(packet.sensor_id))
         # E13: the battery level percentage
         packet.battery = packet.rawpacket[13]
         # E14-15: firmware revision
@@ -392,7 +599,9 @@ class MiaoMiaoPacket:
         packet.hw_version = struct.unpack(">h", packet.rawpacket[16:18])[0]
         # E18-361: the buffered Libre packet (L)
         packet.payload = packet.rawpacket[18:363]
-        packet.librepacket = LibrePacket.from_bytes(packet.payload, timestamp)
+        packet.librepacket = LibrePacket.from_bytes(
+            packet.payload, timestamp, verify=verify, converter=converter
+        )
         # E362: an end packet character )
         if packet.rawpacket[packet.length - 1] != cls.end_pkt:
             raise ValueError("envelope packet does not contain end byte")
@@ -400,3 +609,129 @@ class MiaoMiaoPacket:
 
     def __repr__(self):
         return "<%s battery=%d fw=%x hw=%x librepacket=%s>" % (type(self).__name__, self.battery, self.fw_version, self.hw_version, self.librepacket)
+
+
+class LibrePacketView:
+    """LibrePacket decoded lazily from a memoryview
+
+       header fields are decoded on construction; trends, history and
+       the CRCs are decoded on first access and then cached.  Ring
+       entries are converted as LibrePacket.from_bytes would, by
+       converter when one is given
+    """
+
+    __slots__ = (
+        "data",
+        "index_trend",
+        "index_history",
+        "minutes",
+        "sensor_start",
+        "_trends",
+        "_history",
+        "_crcs",
+        "_converter",
+    )
+
+    def __init__(self, data, timestamp=None, *, verify=False, converter=None):
+        self.data = data = memoryview(data)
+        if len(data) < LibrePacket.length:
+            raise ValueError("Libre packet too short: {}".format(len(data)))
+        if verify:
+            LibrePacket.verify(data)
+        self.index_trend = data[26]
+        self.index_history = data[27]
+        self.minutes = _int16le.unpack_from(data, 335)[0]
+        self.sensor_start = (timestamp or datetime.datetime.now()) - datetime.timedelta(
+            minutes=self.minutes
+        )
+        self._trends = None
+        self._history = None
+        self._crcs = None
+        self._converter = converter
+
+    def _entry(self, ring, index, imem):
+        offset, nentries = ring
+        ird = (index - imem - 1) % nentries
+        words = _entry.unpack_from(self.data, offset + ird * 6)
+        if self._converter is not None:
+            return [self._converter.convert(*words), words[1], words[2]]
+        return [word / LibrePacket.glucose_divisor for word in words]
+
+    def _ring(self, ring, index):
+        return [self._entry(ring, index, imem) for imem in range(ring[1])]
+
+    def trend(self, imem=0):
+        """a single trend entry, 0 being the newest"""
+        if self._trends is not None:
+            return self._trends[imem]
+        return self._entry(LibrePacket.trend_ring, self.index_trend, imem)
+
+    @property
+    def trends(self):
+        if self._trends is None:
+            self._trends = self._ring(LibrePacket.trend_ring, self.index_trend)
+        return self._trends
+
+    @property
+    def history(self):
+        if self._history is None:
+            self._history = self._ring(LibrePacket.history_ring, self.index_history)
+        return self._history
+
+    @property
+    def crcs(self):
+        """(embedded, computed) for each of the three CRC'd regions"""
+        if self._crcs is None:
+            self._crcs = tuple(
+                crc16.at(self.data[start:end]) for start, end in crc16.libre_regions
+            )
+        return self._crcs
+
+    __repr__ = LibrePacket.__repr__
+
+
+class MiaoMiaoPacketView:
+    """MiaoMiaoPacket over a memoryview of the reassembled frame
+
+       the envelope header is decoded on construction, the payload is
+       a zero-copy slice handed to a LibrePacketView
+    """
+
+    __slots__ = (
+        "rawpacket",
+        "length",
+        "sensor_id",
+        "battery",
+        "fw_version",
+        "hw_version",
+        "payload",
+        "librepacket",
+        # set by session.SessionCache
+        "serial",
+        "session",
+        "sensor_swapped",
+        # set by analytics.StreamAnalytics
+        "analytics",
+    )
+
+    def __init__(self, data, timestamp=None, *, verify=False, converter=None):
+        self.rawpacket = raw = memoryview(data)
+        if raw[0] != MiaoMiaoPacket.start_pkt:
+            raise ValueError("envelope packet does not contain start byte")
+        self.length = _int16be.unpack_from(raw, 1)[0]
+        if len(raw) != self.length:
+            raise ValueError(
+                "envelope packet not of embedded length: {}".format(self.length)
+            )
+        if raw[self.length - 1] != MiaoMiaoPacket.end_pkt:
+            raise ValueError("envelope packet does not contain end byte")
+        self.sensor_id = bytes(raw[3:13])
+        self.battery = raw[13]
+        self.fw_version = _int16be.unpack_from(raw, 14)[0]
+        self.hw_version = _int16be.unpack_from(raw, 16)[0]
+        self.payload = raw[18:363]
+        self.librepacket = LibrePacketView(
+            self.payload, timestamp, verify=verify, converter=converter
+        )
+
+    __repr__ = MiaoMiaoPacket.__repr__
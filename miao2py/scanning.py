@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class _Entry:
+    __slots__ = ("addr", "rssi", "first_seen", "last_seen", "adverts", "rate", "due", "failures")
+
+    def __init__(self, addr, rssi, now):
+        self.addr = addr
+        self.rssi = float(rssi)
+        self.first_seen = self.last_seen = now
+        self.adverts = 1
+        # advertisements per second
+        self.rate = 0.0
+        self.due = now
+        self.failures = 0
+
+    def __repr__(self):
+        return "<{} {:0.1f} dBm {:0.2f}/s>".format(self.addr, self.rssi, self.rate)
+
+
+class DeviceRegistry:
+    """What passive scanning has heard, and which reader to read next
+
+       every advertisement updates the reader's exponentially smoothed
+       RSSI, last-seen time and advertisement rate; readers unheard for
+       `expiry` seconds are dropped.  Readers are due read_interval
+       after their last read (or retry_interval after a failed one) and
+       kept in a heap by due time; pop() hands out the due reader that
+       is in range (heard in the last in_range seconds, at min_rssi or
+       better) with the best mix of signal and lateness, so connects
+       are not wasted on readers that are out of range.
+
+       usage:
+
+       registry = DeviceRegistry(read_interval=60)
+       scanner = btle.Scanner().withDelegate(MiaoMiaoScanner(registry=registry, quiet=True))
+       ...
+       btaddr = registry.pop()
+       if btaddr:
+           registry.read_done(btaddr, ok=read(btaddr))
+    """
+
+    def __init__(
+        self,
+        *,
+        alpha=0.3,
+        expiry=300.0,
+        in_range=30.0,
+        min_rssi=None,
+        read_interval=60.0,
+        retry_interval=15.0,
+        rssi_scale=20.0,
+        clock=time.monotonic
+    ):
+        self.alpha = alpha
+        self.expiry = expiry
+        self.in_range_seconds = in_range
+        self.min_rssi = min_rssi
+        self.read_interval = read_interval
+        self.retry_interval = retry_interval
+        # dB worth one read_interval of lateness when ranking
+        self.rssi_scale = rssi_scale
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.heap = []
+        self._seq = itertools.count()
+
+    def __repr__(self):
+        return "<{} devices={}>".format(type(self).__name__, len(self.entries))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, addr):
+        return addr in self.entries
+
+    def get(self, addr):
+        return self.entries.get(addr)
+
+    def _schedule(self, entry, due):
+        entry.due = due
+        heapq.heappush(self.heap, (due, next(self._seq), entry.addr))
+
+    def seen(self, addr, rssi, now=None):
+        """an advertisement from addr at rssi"""
+        now = self.clock() if now is None else now
+        with self.lock:
+            entry = self.entries.get(addr)
+            if entry is None:
+                entry = self.entries[addr] = _Entry(addr, rssi, now)
+                self._schedule(entry, now)
+                log.debug("new device %s at %d dBm", addr, rssi)
+                return entry
+            entry.rssi += self.alpha * (rssi - entry.rssi)
+            gap = now - entry.last_seen
+            if gap > 0:
+                entry.rate += self.alpha * (1.0 / gap - entry.rate)
+            entry.last_seen = now
+            entry.adverts += 1
+            return entry
+
+    def reachable(self, entry, now):
+        if now - entry.last_seen > self.in_range_seconds:
+            return False
+        return self.min_rssi is None or entry.rssi >= self.min_rssi
+
+    def in_range(self, addr, now=None):
+        now = self.clock() if now is None else now
+        entry = self.entries.get(addr)
+        return entry is not None and self.reachable(entry, now)
+
+    def expire(self, now=None):
+        """drop readers not heard for `expiry` seconds, returning them"""
+        now = self.clock() if now is None else now
+        with self.lock:
+            stale = [
+                addr for addr, entry in self.entries.items()
+                if now - entry.last_seen > self.expiry
+            ]
+            for addr in stale:
+                del self.entries[addr]
+        if stale:
+            log.debug("expired %s", ", ".join(stale))
+        return stale
+
+    def _score(self, entry, now):
+        lateness = (now - entry.due) / self.read_interval if self.read_interval else 0.0
+        return lateness + entry.rssi / self.rssi_scale
+
+    def due(self, now=None):
+        """in-range readers due for a read, best first"""
+        now = self.clock() if now is None else now
+        with self.lock:
+            ready = [
+                entry for entry in self.entries.values()
+                if entry.due <= now and self.reachable(entry, now)
+            ]
+        ready.sort(key=lambda entry: self._score(entry, now), reverse=True)
+        return [entry.addr for entry in ready]
+
+    def pop(self, now=None):
+        """the best due, in-range reader, or None; it is not handed out
+           again until read_done() or retry_interval passes
+        """
+        now = self.clock() if now is None else now
+        with self.lock:
+            waiting, ready = [], []
+            while self.heap and self.heap[0][0] <= now:
+                item = heapq.heappop(self.heap)
+                entry = self.entries.get(item[2])
+                # expired, or rescheduled since this item was pushed
+                if entry is None or entry.due != item[0]:
+                    continue
+                (ready if self.reachable(entry, now) else waiting).append(item)
+            for item in waiting:
+                heapq.heappush(self.heap, item)
+            if not ready:
+                return None
+            ready.sort(key=lambda item: self._score(self.entries[item[2]], now))
+            best = ready.pop()
+            for item in ready:
+                heapq.heappush(self.heap, item)
+            self._schedule(self.entries[best[2]], now + self.retry_interval)
+            return best[2]
+
+    def read_done(self, addr, ok=True, now=None):
+        """a read of addr finished; schedule its next one"""
+        now = self.clock() if now is None else now
+        with self.lock:
+            entry = self.entries.get(addr)
+            if entry is None:
+                return
+            if ok:
+                entry.failures = 0
+                self._schedule(entry, now + self.read_interval)
+            else:
+                entry.failures += 1
+                self._schedule(entry, now + self.retry_interval * min(entry.failures, 8))
+
+    def snapshot(self, now=None):
+        """(addr, rssi, rate, seconds since seen) per reader, strongest first"""
+        now = self.clock() if now is None else now
+        with self.lock:
+            entries = list(self.entries.values())
+        entries.sort(key=lambda entry: entry.rssi, reverse=True)
+        return [
+            (entry.addr, entry.rssi, entry.rate, now - entry.last_seen) for entry in entries
+        ]
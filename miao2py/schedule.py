@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+
+class ReadScheduler:
+    """Times reads to just after a sensor writes new data
+
+       a Libre bumps its minutes counter once a minute.  Every read that
+       shows minute m at time t narrows down when minute 0 began to
+       (t - (m + 1) * 60, t - m * 60].  While that window is wide, reads
+       aim at its middle (a bisection: a stale read raises the lower
+       bound and the next one splits what is left, rather than being
+       repeated); once narrow, the next read is requested `guard`
+       seconds after the boundary rather than on a fixed clock.  Reads
+       that find no sensor, or a new one, back off exponentially.
+
+       the notification wait is sized from how long reads have taken to
+       complete (mean plus four deviations, clamped).
+
+       usage:
+
+       scheduler = ReadScheduler(every=5)
+       scheduler.observe(packet.librepacket.minutes, received, took)
+       time.sleep(scheduler.next_read())
+    """
+
+    # seconds per sensor minute
+    period = 60.0
+
+    def __init__(
+        self,
+        *,
+        every=1,
+        guard=2.0,
+        fallback=60.0,
+        min_wait=0.5,
+        max_wait=10.0,
+        backoff_initial=60.0,
+        backoff_max=900.0
+    ):
+        # read every this many sensor minutes
+        self.every = max(1, every)
+        self.guard = guard
+        # interval to use until the first successful read
+        self.fallback = fallback
+        self.min_wait = min_wait
+        self.max_wait = max_wait
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.backoff = 0.0
+        # bounds on the epoch time sensor minute 0 began
+        self.low = None
+        self.high = None
+        self.minutes = None
+        self.completion = None
+        self.completion_dev = 0.0
+
+    def __repr__(self):
+        return "<{} minutes={} uncertainty={} wait={:0.2f}>".format(
+            type(self).__name__,
+            self.minutes,
+            None if self.low is None else round(self.high - self.low, 1),
+            self.notification_delay,
+        )
+
+    def observe(self, minutes, received=None, completion=None):
+        """a read showed `minutes` at epoch `received`, having taken
+           `completion` seconds from request to frame
+        """
+        received = time.time() if received is None else received
+        low = received - (minutes + 1) * self.period
+        high = received - minutes * self.period
+        if self.low is None or low > self.high or high < self.low:
+            if self.low is not None:
+                log.debug("sensor clock moved (new sensor or drift), relearning")
+            self.low, self.high = low, high
+        else:
+            self.low, self.high = max(self.low, low), min(self.high, high)
+        self.minutes = minutes
+        self.backoff = 0.0
+        if completion is not None:
+            if self.completion is None:
+                self.completion = completion
+            else:
+                error = completion - self.completion
+                self.completion += 0.125 * error
+                self.completion_dev += 0.25 * (abs(error) - self.completion_dev)
+
+    def observe_idle(self):
+        """a read found no sensor (or a new, unstarted one)"""
+        self.backoff = min(self.backoff_max, self.backoff * 2 or self.backoff_initial)
+        self.low = self.high = self.minutes = None
+
+    @property
+    def notification_delay(self):
+        if self.completion is None:
+            return self.max_wait
+        wait = self.completion + 4 * self.completion_dev
+        return min(self.max_wait, max(self.min_wait, wait))
+
+    def next_read(self, now=None):
+        """seconds to wait before requesting the next read
+
+           that is `every` sensor minutes past the last boundary seen,
+           plus guard, moved on by whole periods if already missed.
+           Before any read this is fallback, after an idle one the
+           current backoff.
+        """
+        now = time.time() if now is None else now
+        if self.backoff:
+            return self.backoff
+        if self.minutes is None:
+            return self.fallback
+        start = self.high
+        if self.high - self.low > self.guard:
+            start = (self.low + self.high) / 2
+        target = start + (self.minutes + self.every) * self.period + self.guard
+        if target < now:
+            missed = (now - target) // (self.every * self.period) + 1
+            target += missed * self.every * self.period
+        return target - now
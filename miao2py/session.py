@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+import datetime
+import logging
+import threading
+from collections import OrderedDict
+
+from .packet import MiaoMiaoPacket
+
+log = logging.getLogger(__name__)
+
+# two serial characters for every 10-bit value
+_serial_pairs = [
+    MiaoMiaoPacket.decoder_ring[value >> 5] + MiaoMiaoPacket.decoder_ring[value & 0x1F]
+    for value in range(1024)
+]
+
+
+def decode_serial(sensor_id):
+    """the printed Libre serial (e.g. 0M00031VE4H) of the envelope's
+       E3-12 bytes
+
+       bytes 3-8 are read in reverse as one big-endian number whose top
+       50 bits are ten 5-bit characters of MiaoMiaoPacket.decoder_ring,
+       looked up two at a time
+    """
+    number = int.from_bytes(bytes(sensor_id[8:2:-1]), "big") << 16
+    return "0" + "".join(
+        _serial_pairs[(number >> shift) & 0x3FF] for shift in (54, 44, 34, 24, 14)
+    )
+
+
+class SensorSession:
+    """What is known about one sensor across reads"""
+
+    __slots__ = (
+        "sensor_id",
+        "serial",
+        "start",
+        "minutes",
+        "index_trend",
+        "index_history",
+        "calibration",
+        "device",
+        "reads",
+        "last_seen",
+    )
+
+    def __init__(self, sensor_id, start, device=None):
+        self.sensor_id = sensor_id
+        self.serial = decode_serial(sensor_id)
+        self.start = start
+        self.minutes = None
+        self.index_trend = None
+        self.index_history = None
+        # the sensor's converter, when a calibration.ConversionEngine is used
+        self.calibration = None
+        self.device = device
+        self.reads = 0
+        self.last_seen = None
+
+    def __repr__(self):
+        return "<{} {} start={} minutes={} reads={}>".format(
+            type(self).__name__, self.serial, self.start, self.minutes, self.reads
+        )
+
+
+class SessionCache:
+    """Per-sensor sessions, least recently used dropped beyond max_sessions
+
+       update() finds a packet's session by its raw E3-12 bytes (so the
+       serial is decoded once per sensor, not per read), anchors the
+       sensor start time on first sight (re-anchoring only if reads
+       drift by more than max_drift, or the minutes counter goes back),
+       and enriches the packet:
+
+         packet.serial, packet.session, packet.sensor_swapped
+         packet.librepacket.sensor_start = session.start
+
+       sensor_swapped is True when the device's previous packet came
+       from a different sensor.  Safe to share between the threads of
+       several devices.
+
+       usage:
+
+       sessions = SessionCache(engine=ConversionEngine())
+       session = sessions.update(packet, device=btaddr)
+       if packet.sensor_swapped:
+           print("new sensor", session.serial)
+    """
+
+    max_drift = datetime.timedelta(minutes=2)
+
+    def __init__(self, max_sessions=64, *, engine=None):
+        self.max_sessions = max_sessions
+        self.engine = engine
+        self.lock = threading.Lock()
+        self.sessions = OrderedDict()
+        # device -> sensor_id of its last packet, for sessions still held
+        self.devices = {}
+
+    def __repr__(self):
+        return "<{} sessions={}>".format(type(self).__name__, len(self.sessions))
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def get(self, sensor_id):
+        with self.lock:
+            return self.sessions.get(bytes(sensor_id))
+
+    def _session(self, sensor_id, start, minutes, device):
+        session = self.sessions.get(sensor_id)
+        if session is None:
+            session = self.sessions[sensor_id] = SensorSession(sensor_id, start, device)
+            log.debug("new sensor session %s", session.serial)
+            while len(self.sessions) > self.max_sessions:
+                self._drop(self.sessions.popitem(last=False)[0])
+            return session
+        self.sessions.move_to_end(sensor_id)
+        if minutes < session.minutes:
+            log.info("%s: minutes went backwards, sensor restarted", session.serial)
+            session.start = start
+        elif abs(start - session.start) > self.max_drift:
+            log.debug("%s: re-anchoring sensor start", session.serial)
+            session.start = start
+        return session
+
+    def update(self, packet, received=None, device=None):
+        """the SensorSession of a MiaoMiaoPacket, enriching the packet"""
+        with self.lock:
+            return self._update(packet, received, device)
+
+    def _update(self, packet, received, device):
+        librepacket = packet.librepacket
+        sensor_id = bytes(packet.sensor_id)
+        received = received or datetime.datetime.now()
+        minutes = librepacket.minutes
+        start = received - datetime.timedelta(minutes=minutes)
+        session = self._session(sensor_id, start, minutes, device)
+        session.minutes = minutes
+        session.index_trend = librepacket.index_trend
+        session.index_history = librepacket.index_history
+        session.reads += 1
+        session.last_seen = received
+        if device is not None:
+            session.device = device
+        if self.engine is not None and session.calibration is None:
+            session.calibration = self.engine.converter(sensor_id, packet.payload)
+
+        swapped = False
+        if device is not None:
+            previous = self.devices.get(device)
+            swapped = previous is not None and previous != sensor_id
+            if swapped:
+                log.info("%s: sensor swapped for %s", device, session.serial)
+            self.devices[device] = sensor_id
+
+        packet.serial = session.serial
+        packet.session = session
+        packet.sensor_swapped = swapped
+        librepacket.sensor_start = session.start
+        return session
+
+    def _drop(self, sensor_id):
+        """forget the devices whose last packet came from sensor_id"""
+        for device in [d for d, last in self.devices.items() if last == sensor_id]:
+            del self.devices[device]
+
+    def forget(self, sensor_id):
+        with self.lock:
+            sensor_id = bytes(sensor_id)
+            self.sessions.pop(sensor_id, None)
+            self._drop(sensor_id)
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+
+import logging
+import struct
+import time
+from collections import namedtuple
+
+from .archive import pack_address, unpack_address
+
+log = logging.getLogger(__name__)
+
+RingFrame = namedtuple("RingFrame", ["seq", "device", "frame"])
+
+# magic, version, slot count, slot size, frames written
+_header = struct.Struct("<4sHxxIIQ")
+HEADER_SIZE = 64
+_word = struct.Struct("<Q")
+_written_offset = 16
+# slot state, frame length, device address
+_slot = struct.Struct("<QH6s")
+
+
+class RingOverrun(Exception):
+    """a consumer fell more than a ring behind and frames were lost"""
+
+    def __init__(self, lost):
+        super().__init__("{} frames lost".format(lost))
+        self.lost = lost
+
+
+def _shared_memory(name, create=False, size=0):
+    # python 3.8+; only needed once a ring is actually used
+    from multiprocessing import shared_memory
+
+    if create:
+        return shared_memory.SharedMemory(name=name, create=True, size=size)
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+    # before 3.13 attaching registers the segment with the resource
+    # tracker, which would unlink it under the producer at exit (and a
+    # tracker shared with the producer would then forget the producer's
+    # own registration), so keep it from being registered at all
+    from multiprocessing import resource_tracker
+
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+class FrameRing:
+    """Shared-memory ring of raw frames, one producer, any number of
+       local consumers
+
+       a header (magic, version, slot count, slot size, frames written)
+       is followed by fixed-size slots, each a state word, frame length,
+       device address and the frame.  Frame n goes in slot n % slots;
+       its state is 2n+1 while being written and 2n+2 once complete, so
+       a consumer can tell a finished frame from one being overwritten
+       without any lock.  The producer never waits for consumers: a
+       consumer that falls a whole ring behind loses frames (see
+       RingConsumer).
+
+       usage:
+
+       ring = FrameRing.create("miao2py")
+       miaomiao = MiaoMiaoDevice(btaddr, ring=ring)
+       ...
+       ring.close()
+       ring.unlink()
+    """
+
+    magic = b"M2PR"
+    version = 1
+    # a 363 byte miaomiao frame, rounded up
+    default_slot_size = 368
+
+    def __init__(self, shm, owner=False):
+        self.shm = shm
+        self.owner = owner
+        self.buf = shm.buf
+        magic, version, self.slots, self.slot_size, _ = _header.unpack_from(self.buf, 0)
+        if magic != self.magic or version != self.version:
+            self.buf = None
+            shm.close()
+            raise ValueError("{} is not a frame ring".format(shm.name))
+        self.stride = _slot.size + self.slot_size
+
+    def __repr__(self):
+        return "<{} {} slots={} written={}>".format(
+            type(self).__name__, self.name, self.slots, self.written
+        )
+
+    @classmethod
+    def create(cls, name=None, slots=256, slot_size=None):
+        """a new ring; name=None picks a random one (see .name)"""
+        slot_size = slot_size or cls.default_slot_size
+        if slots < 1 or not 0 < slot_size <= 0xFFFF:
+            raise ValueError("bad ring geometry: {} x {}".format(slots, slot_size))
+        size = HEADER_SIZE + slots * (_slot.size + slot_size)
+        shm = _shared_memory(name, create=True, size=size)
+        # fresh segments are zeroed: every slot is empty, nothing written
+        _header.pack_into(shm.buf, 0, cls.magic, cls.version, slots, slot_size, 0)
+        log.debug("created ring %s: %d x %d bytes", shm.name, slots, slot_size)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """an existing ring, e.g. for a consumer"""
+        return cls(_shared_memory(name))
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def written(self):
+        """frames written so far, i.e. the sequence number of the next"""
+        return _word.unpack_from(self.buf, _written_offset)[0]
+
+    def write(self, frame, device=None):
+        """append a frame (bytes-like), from device ('ff:ff:...')"""
+        length = len(frame)
+        if length > self.slot_size:
+            raise ValueError(
+                "frame of {} bytes exceeds the {} byte slot".format(length, self.slot_size)
+            )
+        buf = self.buf
+        seq = self.written
+        offset = HEADER_SIZE + (seq % self.slots) * self.stride
+        address = pack_address(device) if device else bytes(6)
+        _slot.pack_into(buf, offset, 2 * seq + 1, length, address)
+        start = offset + _slot.size
+        buf[start:start + length] = frame
+        _word.pack_into(buf, offset, 2 * seq + 2)
+        _word.pack_into(buf, _written_offset, seq + 1)
+        return seq
+
+    def consumer(self, **kwargs):
+        return RingConsumer(self, **kwargs)
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+
+    def unlink(self):
+        """remove the segment (the producer, once everyone is done)"""
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        if self.owner:
+            self.unlink()
+
+
+class RingConsumer:
+    """One reader's cursor into a FrameRing
+
+       read() returns the next RingFrame or None when caught up.  Its
+       frame is a memoryview straight into the shared slot (bytes with
+       copy=True), valid until the producer comes round to that slot
+       again; valid(item) checks that it still is, after use.  Views
+       must be released (or dropped) before the ring is closed.
+       A consumer more than a ring behind skips to the
+       oldest frame still there, counting what it missed in .lost, or
+       raises RingOverrun when made with strict=True.
+
+       usage:
+
+       with FrameRing.attach("miao2py") as ring:
+           consumer = ring.consumer()
+           for item in consumer.follow():
+               packet = MiaoMiaoPacket.from_bytes(item.frame)
+               if consumer.valid(item):
+                   print(item.device, packet)
+    """
+
+    def __init__(self, ring, *, start="latest", strict=False, copy=False):
+        if isinstance(ring, str):
+            ring = FrameRing.attach(ring)
+        self.ring = ring
+        self.strict = strict
+        self.copy = copy
+        if start == "latest":
+            self.cursor = ring.written
+        elif start == "oldest":
+            self.cursor = max(0, ring.written - ring.slots)
+        else:
+            self.cursor = int(start)
+        self.lost = 0
+
+    def __repr__(self):
+        return "<{} {} at {} lost={}>".format(
+            type(self).__name__, self.ring.name, self.cursor, self.lost
+        )
+
+    @property
+    def pending(self):
+        """frames written and not yet read (may exceed the ring)"""
+        return self.ring.written - self.cursor
+
+    def _skip(self, to):
+        lost = to - self.cursor
+        self.lost += lost
+        self.cursor = to
+        log.debug("%r: overrun, %d frames lost", self, lost)
+        if self.strict:
+            raise RingOverrun(lost)
+
+    def _state(self, seq):
+        offset = HEADER_SIZE + (seq % self.ring.slots) * self.ring.stride
+        return offset, _word.unpack_from(self.ring.buf, offset)[0]
+
+    def read(self):
+        ring = self.ring
+        while True:
+            written = ring.written
+            if self.cursor >= written:
+                return None
+            if written - self.cursor > ring.slots:
+                self._skip(written - ring.slots)
+            seq = self.cursor
+            offset, state = self._state(seq)
+            if state != 2 * seq + 2:
+                # lapped since written was read: go round again
+                self._skip(seq + 1)
+                continue
+            _, length, address = _slot.unpack_from(ring.buf, offset)
+            start = offset + _slot.size
+            frame = ring.buf[start:start + length]
+            if self.copy:
+                frame = bytes(frame)
+                if self._state(seq)[1] != state:
+                    self._skip(seq + 1)
+                    continue
+            self.cursor = seq + 1
+            device = unpack_address(address) if any(address) else None
+            return RingFrame(seq, device, frame)
+
+    def valid(self, item):
+        """item's slot has not been overwritten since it was read"""
+        return self._state(item.seq)[1] == 2 * item.seq + 2
+
+    def follow(self, poll=0.001, timeout=None):
+        """yield frames as they are written; polls every `poll` seconds
+           when caught up, stopping after `timeout` seconds without one
+        """
+        idle = None
+        while True:
+            item = self.read()
+            if item is not None:
+                idle = None
+                yield item
+                continue
+            now = time.monotonic()
+            if idle is None:
+                idle = now
+            elif timeout is not None and now - idle >= timeout:
+                return
+            time.sleep(poll)
+
+
+def main(argv=None):
+    """print the packets written to a ring: python -m miao2py.shmring NAME"""
+    import argparse
+
+    from .packet import MiaoMiaoPacket
+
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("name", help="shared memory name of the ring")
+    parser.add_argument("--oldest", action="store_true", help="start from the oldest frame kept")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    with FrameRing.attach(args.name) as ring:
+        consumer = ring.consumer(start="oldest" if args.oldest else "latest", copy=True)
+        try:
+            for item in consumer.follow(poll=0.05):
+                try:
+                    packet = MiaoMiaoPacket.from_bytes(item.frame)
+                except (ValueError, IndexError) as exc:
+                    log.warning("%s #%d: %s", item.device, item.seq, exc)
+                    continue
+                print(item.device, packet)
+        except KeyboardInterrupt:
+            pass
+        if consumer.lost:
+            log.warning("%d frames lost to overruns", consumer.lost)
+
+
+if __name__ == "__main__":
+    main()
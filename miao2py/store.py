@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+
+import datetime
+import logging
+from array import array
+from bisect import bisect_left, bisect_right
+
+from .delta import DeltaTracker
+
+log = logging.getLogger(__name__)
+
+
+def _epoch(timestamp):
+    if isinstance(timestamp, datetime.datetime):
+        return timestamp.timestamp()
+    return float(timestamp)
+
+
+class _Bucket:
+    __slots__ = ("times", "values", "_summary")
+
+    # array headers and the bucket itself, roughly
+    overhead = 256
+
+    def __init__(self):
+        self.times = array("d")
+        self.values = array("f")
+        self._summary = None
+
+    def summary(self):
+        """(min, sum, max, count) of the bucket, cached until it changes"""
+        if self._summary is None:
+            values = self.values
+            self._summary = (min(values), sum(values), max(values), len(values))
+        return self._summary
+
+    def add(self, when, value):
+        """insert in time order, ignoring a time already present"""
+        times = self.times
+        self._summary = None
+        if not times or when > times[-1]:
+            times.append(when)
+            self.values.append(value)
+            return True
+        ipos = bisect_left(times, when)
+        if times[ipos] == when:
+            return False
+        times.insert(ipos, when)
+        self.values.insert(ipos, value)
+        return True
+
+    @property
+    def nbytes(self):
+        return (
+            self.overhead
+            + len(self.times) * self.times.itemsize
+            + len(self.values) * self.values.itemsize
+        )
+
+
+class _Series:
+    __slots__ = ("keys", "buckets")
+
+    def __init__(self):
+        # bucket start keys, sorted
+        self.keys = []
+        self.buckets = {}
+
+
+class GlucoseStore:
+    """In-memory per-sensor glucose time series
+
+       readings are kept in columnar array('d') timestamp / array('f')
+       value buffers split into fixed-width time buckets, so range
+       queries only touch the buckets they overlap.  Readings repeated
+       by overlapping trend / history rings are stored once.  When the
+       store grows past memory_budget bytes the oldest buckets (of any
+       sensor) are evicted.
+
+       timestamps are epoch seconds or datetimes; queries return epoch
+       seconds
+
+       usage:
+
+       store = GlucoseStore()
+       store.add_packet(packet)
+       times, values = store.range(packet.sensor_id, now - 8 * 3600, now)
+    """
+
+    def __init__(self, bucket_seconds=3600, memory_budget=64 * 2 ** 20):
+        self.bucket_seconds = bucket_seconds
+        self.memory_budget = memory_budget
+        self.series = {}
+        self.nbytes = 0
+        self.tracker = DeltaTracker()
+
+    def __repr__(self):
+        return "<{} sensors={} bytes={}>".format(
+            type(self).__name__, len(self.series), self.nbytes
+        )
+
+    def __len__(self):
+        return sum(
+            len(bucket.times)
+            for series in self.series.values()
+            for bucket in series.buckets.values()
+        )
+
+    def sensors(self):
+        return list(self.series)
+
+    def add(self, sensor, timestamp, value):
+        """store one reading, returning False for a duplicate"""
+        when = _epoch(timestamp)
+        key = when - when % self.bucket_seconds
+        series = self.series.get(sensor)
+        if series is None:
+            series = self.series[sensor] = _Series()
+        bucket = series.buckets.get(key)
+        if bucket is None:
+            bucket = series.buckets[key] = _Bucket()
+            series.keys.insert(bisect_left(series.keys, key), key)
+            self.nbytes += bucket.overhead
+        if not bucket.add(when, value):
+            return False
+        self.nbytes += bucket.times.itemsize + bucket.values.itemsize
+        if self.nbytes > self.memory_budget:
+            self.evict()
+        return True
+
+    def add_reading(self, reading):
+        """store a delta.Reading's glucose value"""
+        return self.add(reading.sensor, reading.timestamp, reading.values[0])
+
+    def add_packet(self, packet, received=None):
+        """store whatever a decoded packet holds that is new"""
+        added = 0
+        for reading in self.tracker.update(packet, received):
+            added += self.add_reading(reading)
+        return added
+
+    def evict(self):
+        """drop the oldest buckets until within the memory budget"""
+        while self.nbytes > self.memory_budget and self.series:
+            sensor = min(self.series, key=lambda sensor: self.series[sensor].keys[0])
+            series = self.series[sensor]
+            key = series.keys.pop(0)
+            self.nbytes -= series.buckets.pop(key).nbytes
+            log.debug("evicted %s bucket %d", sensor, key)
+            if not series.keys:
+                del self.series[sensor]
+
+    def _buckets(self, sensor, start, end):
+        series = self.series.get(sensor)
+        if series is None:
+            return []
+        low = 0
+        if start is not None:
+            low = bisect_right(series.keys, start - start % self.bucket_seconds) - 1
+        high = len(series.keys) if end is None else bisect_right(series.keys, end)
+        return [series.buckets[key] for key in series.keys[max(0, low) : high]]
+
+    def range(self, sensor, start=None, end=None):
+        """(times, values) arrays of a sensor between start and end, inclusive"""
+        start = None if start is None else _epoch(start)
+        end = None if end is None else _epoch(end)
+        times, values = array("d"), array("f")
+        for bucket in self._buckets(sensor, start, end):
+            low = 0 if start is None else bisect_left(bucket.times, start)
+            high = len(bucket.times) if end is None else bisect_right(bucket.times, end)
+            times.extend(bucket.times[low:high])
+            values.extend(bucket.values[low:high])
+        return times, values
+
+    def latest(self, sensor, count=1):
+        """(times, values) of the newest count readings, oldest first"""
+        series = self.series.get(sensor)
+        times, values = array("d"), array("f")
+        if series is None:
+            return times, values
+        chunks = []
+        remaining = count
+        for key in reversed(series.keys):
+            bucket = series.buckets[key]
+            take = min(remaining, len(bucket.times))
+            chunks.append(bucket)
+            remaining -= take
+            if not remaining:
+                break
+        for bucket in reversed(chunks):
+            times.extend(bucket.times)
+            values.extend(bucket.values)
+        skip = max(0, len(times) - count)
+        return times[skip:], values[skip:]
+
+    def downsample(self, sensor, start, end, width):
+        """(window start, min, mean, max, count) per width seconds window
+
+           when width is a multiple of the bucket width, buckets lying
+           wholly inside the range are folded in from their cached
+           summaries rather than point by point
+        """
+        start, end = _epoch(start), _epoch(end)
+        whole = width % self.bucket_seconds == 0
+        windows = []
+
+        def fold(key, low, total, high, count):
+            if windows and windows[-1][0] == key:
+                window = windows[-1]
+                window[1] = min(window[1], low)
+                window[2] += total
+                window[3] = max(window[3], high)
+                window[4] += count
+            else:
+                windows.append([key, low, total, high, count])
+
+        for bucket in self._buckets(sensor, start, end):
+            times = bucket.times
+            if whole and times and start <= times[0] and times[-1] <= end:
+                fold(times[0] - times[0] % width, *bucket.summary())
+                continue
+            low, high = bisect_left(times, start), bisect_right(times, end)
+            for when, value in zip(times[low:high], bucket.values[low:high]):
+                fold(when - when % width, value, value, value, 1)
+        return [
+            (key, low, total / count, high, count)
+            for key, low, total, high, count in windows
+        ]
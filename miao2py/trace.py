@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+import binascii
+import itertools
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+log = logging.getLogger(__name__)
+
+
+class Span:
+    """one frame's trip through the pipeline: attributes plus the time
+       spent in each stage, in microseconds
+    """
+
+    __slots__ = ("name", "attrs", "stages", "started")
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.stages = {}
+        self.started = time.perf_counter()
+
+    def add(self, stage, seconds):
+        self.stages[stage] = round(self.stages.get(stage, 0) + seconds * 1e6, 1)
+
+    def event(self):
+        event = {"span": self.name, "time": time.time()}
+        event.update(self.attrs)
+        event["total_us"] = round((time.perf_counter() - self.started) * 1e6, 1)
+        event["stages"] = self.stages
+        return event
+
+
+class Tracer:
+    """Sampled per-frame span events and a ring of the last raw frames
+
+       one frame in `sample` gets a Span, which is emitted to `sink` (a
+       callable taking an event dict; default: JSON on the miao2py.trace
+       logger) when the frame has been handled.  The last `frames` raw
+       frames are kept regardless of sampling, for dump() after a
+       failure; dumps are hex lines that m2p-decode --input reads back.
+
+       disabled (the default), hot paths test `enabled` and do nothing
+       else.
+
+       usage:
+
+       tracer = trace.use(trace.Tracer(sample=100, frames=256))
+       ...
+       tracer.dump("/tmp/last-frames.hex")
+    """
+
+    def __init__(self, sample=0, frames=0, sink=None):
+        self.sample = sample
+        self.frames = deque(maxlen=frames) if frames else None
+        self.sink = sink or self._log_event
+        self.enabled = bool(sample or frames)
+        self._counter = itertools.count()
+        self._local = threading.local()
+
+    def __repr__(self):
+        return "<{} sample=1/{} frames={}>".format(
+            type(self).__name__,
+            self.sample,
+            self.frames.maxlen if self.frames is not None else 0,
+        )
+
+    @staticmethod
+    def _log_event(event):
+        log.info("%s", json.dumps(event, sort_keys=True))
+
+    def start(self, name, **attrs):
+        """a new Span if this one is sampled, else None"""
+        if self.sample and next(self._counter) % self.sample == 0:
+            return Span(name, attrs)
+        return None
+
+    def finish(self, span):
+        if span is not None:
+            self.sink(span.event())
+
+    def activate(self, span):
+        """make span the one stages on this thread are recorded into"""
+        self._local.span = span
+
+    @property
+    def current(self):
+        return getattr(self._local, "span", None)
+
+    def record(self, device, data):
+        """keep a raw frame for post-mortem dumps"""
+        if self.frames is not None:
+            self.frames.append((time.time(), device, bytes(data)))
+
+    def dump(self, path):
+        """write the kept frames as commented hex lines, oldest first"""
+        with open(path, "w") as out:
+            for timestamp, device, data in list(self.frames or ()):
+                out.write("# {} {:0.3f}\n".format(device, timestamp))
+                out.write(binascii.hexlify(data).decode())
+                out.write("\n")
+        return path
+
+
+tracer = Tracer()
+
+
+def use(new_tracer):
+    """make new_tracer the one the package traces into"""
+    global tracer
+    tracer = new_tracer
+    return new_tracer
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+
+import importlib
+import json
+import logging
+import os
+from collections import deque
+
+from . import metrics
+
+log = logging.getLogger(__name__)
+
+
+# name -> "module:attribute" of a Transport; the module is only imported
+# when the transport is first created, so nothing loads bluepy (or any
+# other radio stack) unless it is actually used
+transports = {
+    "bluepy": "miao2py.transport:BluepyTransport",
+    "fake": "miao2py.transport:FakeTransport",
+    "replay": "miao2py.replay:ReplayTransport",
+}
+
+
+def register(name, target):
+    """make a "module:attribute" Transport available as name"""
+    transports[name] = target
+
+
+def load(name):
+    """the Transport class registered as name"""
+    try:
+        target = transports[name]
+    except KeyError:
+        raise ValueError("unknown transport: {}".format(name)) from None
+    module, _, attr = target.partition(":")
+    return getattr(importlib.import_module(module), attr)
+
+
+def create(name="bluepy", *args, **kwargs):
+    return load(name)(*args, **kwargs)
+
+
+class TransportError(Exception):
+    """raised by transports that do not have their own exception type"""
+
+
+class Transport:
+    """The peripheral operations a MiaoMiaoDevice needs
+
+       connect() finds the nrf UART service, its receive characteristic
+       and the notification descriptor of its transmit characteristic;
+       write() sends a command to the receive characteristic; wait()
+       delivers pending notifications to the delegate set by
+       enable_notify().
+    """
+
+    # exceptions that mean the link to the device is broken
+    errors = (TransportError,)
+
+    def connect(self, btaddr):
+        raise NotImplementedError
+
+    def disconnect(self):
+        raise NotImplementedError
+
+    def enable_notify(self, delegate):
+        raise NotImplementedError
+
+    def write(self, data):
+        raise NotImplementedError
+
+    def wait(self, timeout):
+        """deliver at most one notification, True if one arrived"""
+        raise NotImplementedError
+
+
+class HandleCache:
+    """GATT handles discovered per device address, persisted as JSON
+
+       the miaomiao's receive characteristic and notification descriptor
+       sit at fixed handles for a given firmware, so once discovered they
+       can be written directly on later connections
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.handles = {}
+        if path:
+            try:
+                with open(path) as cache:
+                    self.handles = json.load(cache)
+            except FileNotFoundError:
+                pass
+            except ValueError:
+                log.warning("ignoring corrupt handle cache %s", path)
+
+    @staticmethod
+    def default_path():
+        cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+        return os.path.join(cache_home, "miao2py", "handles.json")
+
+    def get(self, btaddr):
+        return self.handles.get(btaddr.lower())
+
+    def put(self, btaddr, handles):
+        self.handles[btaddr.lower()] = handles
+        self.save()
+
+    def forget(self, btaddr):
+        if self.handles.pop(btaddr.lower(), None) is not None:
+            self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        partial = self.path + ".tmp"
+        with open(partial, "w") as cache:
+            json.dump(self.handles, cache, indent=1, sort_keys=True)
+        os.replace(partial, self.path)
+
+
+class BluepyTransport(Transport):
+    """Transport over a bluepy Peripheral
+
+       with a HandleCache, service discovery only happens the first time
+       a device is seen (or after cached handles stop working)
+    """
+
+    client_chars = "00002902-0000-1000-8000-00805f9b34fb"
+    nrf_data = "6E400001-B5A3-F393-E0A9-E50E24DCCA9E"
+    nrf_recv = "6E400002-B5A3-F393-E0A9-E50E24DCCA9E"
+    nrf_xmit = "6E400003-B5A3-F393-E0A9-E50E24DCCA9E"
+
+    def __init__(self, addrtype="random", iface=None, handle_cache=None):
+        from bluepy import btle
+
+        self.btle = btle
+        self.errors = (btle.BTLEException,)
+        self.addrtype = addrtype
+        self.iface = iface
+        self.handle_cache = handle_cache
+        self.peripheral = None
+        self.btaddr = None
+        self.recv_handle = None
+        self.desc_handle = None
+        self.cached = False
+
+    def connect(self, btaddr):
+        self.btaddr = btaddr
+        self.peripheral = self.btle.Peripheral(btaddr, self.addrtype, self.iface)
+        handles = self.handle_cache.get(btaddr) if self.handle_cache else None
+        if handles:
+            log.debug("using cached handles for %s: %s", btaddr, handles)
+            self.recv_handle, self.desc_handle = handles["recv"], handles["xmit_desc"]
+            self.cached = True
+        else:
+            self.discover()
+
+    def discover(self):
+        """find the nrf UART characteristic and descriptor handles"""
+        btle = self.btle
+        with metrics.stage("discovery"):
+            gatt = self.peripheral.getServiceByUUID(btle.UUID(self.nrf_data))
+            xmit = gatt.getCharacteristics(btle.UUID(self.nrf_xmit))[0]
+            recv = gatt.getCharacteristics(btle.UUID(self.nrf_recv))[0]
+            xmit_desc = xmit.getDescriptors(btle.UUID(self.client_chars))[0]
+        self.recv_handle, self.desc_handle = recv.getHandle(), xmit_desc.handle
+        self.cached = False
+        if self.handle_cache:
+            self.handle_cache.put(
+                self.btaddr, {"recv": self.recv_handle, "xmit_desc": self.desc_handle}
+            )
+
+    def disconnect(self):
+        if self.peripheral:
+            self.peripheral.disconnect()
+
+    def enable_notify(self, delegate):
+        try:
+            self.peripheral.writeCharacteristic(self.desc_handle, bytes([0x01, 0x00]), False)
+        except self.errors:
+            if not self.cached:
+                raise
+            # stale cache (e.g. new firmware): rediscover once
+            log.info("cached handles for %s failed, rediscovering", self.btaddr)
+            self.handle_cache.forget(self.btaddr)
+            self.discover()
+            self.peripheral.writeCharacteristic(self.desc_handle, bytes([0x01, 0x00]), False)
+        self.peripheral.setDelegate(delegate)
+
+    def write(self, data):
+        self.peripheral.writeCharacteristic(self.recv_handle, data, False)
+
+    def wait(self, timeout):
+        return self.peripheral.waitForNotifications(timeout)
+
+
+class FakeTransport(Transport):
+    """In-process stand-in for a reader
+
+       reads is a list of responses, each a list of the notifications
+       the reader sends after a read request (0xf0) is written.  Writes
+       are recorded in `writes`.
+    """
+
+    read_request = bytes([0xF0])
+
+    def __init__(self, reads=(), *, connect_error=None):
+        self.reads = deque(reads)
+        self.connect_error = connect_error
+        self.pending = deque()
+        self.writes = []
+        self.delegate = None
+        self.connected = False
+        self.connects = 0
+
+    def connect(self, btaddr):
+        self.connects += 1
+        if self.connect_error:
+            raise self.connect_error
+        self.connected = True
+
+    def disconnect(self):
+        self.connected = False
+        self.pending.clear()
+
+    def enable_notify(self, delegate):
+        self.delegate = delegate
+
+    def write(self, data):
+        if not self.connected:
+            raise TransportError("not connected")
+        self.writes.append(bytes(data))
+        if bytes(data) == self.read_request and self.reads:
+            self.pending.extend(self.reads.popleft())
+
+    def wait(self, timeout):
+        if not self.connected:
+            raise TransportError("not connected")
+        if not self.pending:
+            return False
+        self.delegate.handleNotification(0, self.pending.popleft())
+        return True
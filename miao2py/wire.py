@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+import logging
+import struct
+
+from .packet import LibrePacket, MiaoMiaoPacket
+
+log = logging.getLogger(__name__)
+
+# first byte of a compact record; a raw envelope starts with 0x28
+COMPACT_V1 = 0xC1
+# topic suffix compact records are published under, next to the raw topic
+COMPACT_SUFFIX = "/c1"
+
+# the record holds only readings new since the previous record
+FLAG_DELTA = 0x01
+
+_header = struct.Struct("<BBBhhh10s")
+
+
+def write_varint(out, value):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data, pos):
+    value = shift = 0
+    while True:
+        octet = data[pos]
+        pos += 1
+        value |= (octet & 0x7F) << shift
+        if octet < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _write_section(out, raws):
+    write_varint(out, len(raws))
+    previous = 0
+    for raw in raws:
+        delta = raw - previous
+        # zigzag, so small negative steps stay one byte
+        write_varint(out, (delta << 1) ^ (delta >> 63))
+        previous = raw
+
+
+def _read_section(data, pos):
+    count, pos = read_varint(data, pos)
+    raws = []
+    previous = 0
+    for _ in range(count):
+        zigzag, pos = read_varint(data, pos)
+        previous += (zigzag >> 1) ^ -(zigzag & 1)
+        raws.append(previous)
+    return raws, pos
+
+
+def encode(packet, readings=None):
+    """compact record of a MiaoMiaoPacket (or view)
+
+       the header is followed by the trend then history glucose words,
+       newest first, each as a zigzag varint delta from the one before.
+       Given the readings a delta.DeltaTracker found new, only those are
+       included and FLAG_DELTA is set.
+    """
+    librepacket = packet.librepacket
+    # the raw words, whatever converter decoded the packet's values
+    data = librepacket.data
+    trends = LibrePacket.ring_words(data, LibrePacket.trend_ring, librepacket.index_trend)
+    history = LibrePacket.ring_words(
+        data, LibrePacket.history_ring, librepacket.index_history
+    )
+    flags = 0
+    if readings is not None:
+        flags |= FLAG_DELTA
+        trends = trends[: sum(1 for reading in readings if reading.kind == "trend")]
+        history = history[: sum(1 for reading in readings if reading.kind == "history")]
+    out = bytearray(
+        _header.pack(
+            COMPACT_V1,
+            flags,
+            packet.battery,
+            packet.fw_version,
+            packet.hw_version,
+            librepacket.minutes,
+            packet.sensor_id,
+        )
+    )
+    _write_section(out, [entry[0] for entry in trends])
+    _write_section(out, [entry[0] for entry in history])
+    return bytes(out)
+
+
+class CompactRecord:
+    """A decoded compact record; trends and history are glucose values,
+       newest first, as LibrePacket computes them
+    """
+
+    __slots__ = (
+        "flags",
+        "battery",
+        "fw_version",
+        "hw_version",
+        "minutes",
+        "sensor_id",
+        "trends",
+        "history",
+    )
+
+    @classmethod
+    def from_bytes(cls, data):
+        if not data or data[0] != COMPACT_V1:
+            raise ValueError("not a compact v1 record")
+        record = cls()
+        (
+            _,
+            record.flags,
+            record.battery,
+            record.fw_version,
+            record.hw_version,
+            record.minutes,
+            record.sensor_id,
+        ) = _header.unpack_from(data)
+        divisor = LibrePacket.glucose_divisor
+        trends, pos = _read_section(data, _header.size)
+        history, pos = _read_section(data, pos)
+        record.trends = [raw / divisor for raw in trends]
+        record.history = [raw / divisor for raw in history]
+        return record
+
+    @property
+    def delta(self):
+        return bool(self.flags & FLAG_DELTA)
+
+    def __repr__(self):
+        return "<%s battery=%d fw=%x hw=%x minutes=%d trends=%d history=%d%s>" % (
+            type(self).__name__,
+            self.battery,
+            self.fw_version,
+            self.hw_version,
+            self.minutes,
+            len(self.trends),
+            len(self.history),
+            " delta" if self.delta else "",
+        )
+
+
+def compact_topic(topic):
+    return topic + COMPACT_SUFFIX
+
+
+def decode(topic, data):
+    """decode a message published raw or compact, by topic suffix"""
+    if topic.endswith(COMPACT_SUFFIX):
+        return CompactRecord.from_bytes(data)
+    return MiaoMiaoPacket.from_bytes(bytes(data))
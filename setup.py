@@ -20,11 +20,14 @@ setup(
         "Programming Language :: Python :: 3.6",
     ],
     scripts=[
+        "scripts/m2p-bench",
         "scripts/m2p-decode",
+        "scripts/m2p-export",
         "scripts/m2p-mqp",
         "scripts/m2p-mqs",
         "scripts/m2p-scan",
     ],
     packages=find_packages(),
     install_requires=["bluepy", "hbmqtt", "click"],
+    extras_require={"numpy": ["numpy"], "arrow": ["pyarrow"]},
 )
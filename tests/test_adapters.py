@@ -0,0 +1,159 @@
+import asyncio
+import sys
+
+import pytest
+
+from miao2py.adapters import Adapter, AdapterScheduler, enumerate_adapters
+from miao2py.device import MiaoMiaoScanner
+from miao2py.gateway import MiaoMiaoGateway
+from miao2py.replay import ReplayTransport, synthetic_frame
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Device:
+    def __init__(self, btaddr):
+        self.btaddr = btaddr
+        self.transport = None
+
+
+def scheduler(names=("hci0", "hci1"), **kwargs):
+    kwargs.setdefault("transport_factory", lambda adapter: ("transport", adapter.name))
+    return AdapterScheduler(list(names), **kwargs)
+
+
+def test_enumerate_adapters(tmp_path):
+    for name in ("hci10", "hci2", "hci0", "lo"):
+        (tmp_path / name).mkdir()
+    assert enumerate_adapters(str(tmp_path)) == ["hci0", "hci2", "hci10"]
+    assert enumerate_adapters(str(tmp_path / "missing")) == []
+
+
+def test_bad_adapter_name():
+    with pytest.raises(ValueError):
+        Adapter("eth0")
+
+
+def test_spreads_by_load():
+    adapters = scheduler()
+    names = [adapters.assign("aa:00:00:00:00:0{}".format(i)).name for i in range(4)]
+    assert sorted(names) == ["hci0", "hci0", "hci1", "hci1"]
+
+
+def test_prefers_stronger_rssi():
+    adapters = scheduler()
+    adapters.observe("aa:00:00:00:00:01", "hci1", -45)
+    adapters.observe("aa:00:00:00:00:01", "hci0", -95)
+    assert adapters.assign("aa:00:00:00:00:01").name == "hci1"
+
+
+def test_bind_sets_adapter_transport():
+    adapters = scheduler(["hci3"])
+    device = Device("aa:00:00:00:00:01")
+    assert adapters.bind(device).name == "hci3"
+    assert device.transport == ("transport", "hci3")
+
+
+def test_failed_reader_moves_elsewhere():
+    adapters = scheduler()
+    first = adapters.assign("aa:00:00:00:00:01")
+    adapters.failed("aa:00:00:00:00:01")
+    assert adapters.assign("aa:00:00:00:00:01") is not first
+
+
+def test_one_failing_reader_does_not_quarantine():
+    clock = Clock()
+    adapters = scheduler(["hci0"], max_failures=2, clock=clock)
+    for _ in range(5):
+        adapters.assign("aa:00:00:00:00:01")
+        adapters.failed("aa:00:00:00:00:01")
+    assert [adapter.name for adapter in adapters.healthy()] == ["hci0"]
+
+
+def test_distinct_failing_readers_quarantine():
+    clock = Clock()
+    adapters = scheduler(max_failures=2, quarantine=60, clock=clock)
+    hci0 = adapters.adapter("hci0")
+    for btaddr in ("aa:00:00:00:00:01", "aa:00:00:00:00:02"):
+        adapters._move(btaddr, hci0)
+        adapters.failed(btaddr)
+    assert adapters.healthy() == [adapters.adapter("hci1")]
+    assert adapters.assign("aa:00:00:00:00:03").name == "hci1"
+    clock.now = 61
+    assert len(adapters.healthy()) == 2
+
+
+def test_success_clears_failures():
+    adapters = scheduler(["hci0"], max_failures=2)
+    adapters.assign("aa:00:00:00:00:01")
+    adapters.failed("aa:00:00:00:00:01")
+    adapters.assign("aa:00:00:00:00:02")
+    adapters.succeeded("aa:00:00:00:00:02")
+    adapters.assign("aa:00:00:00:00:03")
+    adapters.failed("aa:00:00:00:00:03")
+    assert adapters.healthy()
+
+
+def test_read_all():
+    adapters = scheduler()
+    devices = [Device("aa:00:00:00:00:0{}".format(i)) for i in range(4)]
+
+    def read(device):
+        if device.btaddr.endswith("3"):
+            raise RuntimeError("no luck")
+        return device.transport[1]
+
+    results = adapters.read_all(devices, read)
+    assert isinstance(results["aa:00:00:00:00:03"], RuntimeError)
+    assert {results[device.btaddr] for device in devices[:3]} == {"hci0", "hci1"}
+
+
+def test_scanner_reports_adapter_rssi():
+    adapters = scheduler()
+
+    class ScanEntry:
+        addr = "aa:00:00:00:00:01"
+        rssi = -42
+
+        def getValueText(self, adtype):
+            return "miaomiao"
+
+    MiaoMiaoScanner(adapters=adapters, iface=1, quiet=True).handleDiscovery(ScanEntry(), True, True)
+    assert adapters.rssi == {("aa:00:00:00:00:01", "hci1"): -42}
+
+
+def run_for(gateway, seconds):
+    loop = asyncio.new_event_loop()
+    try:
+        loop.call_later(seconds, gateway.stop)
+        loop.run_until_complete(gateway.run())
+    finally:
+        loop.close()
+
+
+def frames(count, minutes=1000):
+    return [synthetic_frame(seed=i, minutes=minutes + i) for i in range(count)]
+
+
+def test_fake_adapters_without_bluepy():
+    scheduler = AdapterScheduler(
+        ["hci0", "hci1"], transport_factory=lambda adapter: ReplayTransport(frames(1))
+    )
+    scheduler.observe("aa:00:00:00:00:01", "hci1", -40)
+    got = []
+    gateway = MiaoMiaoGateway(
+        lambda device, packet: got.append(device.btaddr), adapters=scheduler, interval=10
+    )
+    gateway.add_device("aa:00:00:00:00:01")
+    gateway.add_device("aa:00:00:00:00:02")
+    run_for(gateway, 0.2)
+    assert sorted(got) == ["aa:00:00:00:00:01", "aa:00:00:00:00:02"]
+    assert scheduler.assignments["aa:00:00:00:00:01"].name == "hci1"
+    assert scheduler.assignments["aa:00:00:00:00:02"].name == "hci0"
+    assert "bluepy" not in sys.modules
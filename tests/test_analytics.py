@@ -0,0 +1,85 @@
+import datetime
+import json
+
+import pytest
+
+from miao2py import analytics
+from miao2py.analytics import Holt, RollingRegression, StreamAnalytics
+from miao2py.packet import MiaoMiaoPacket
+from miao2py.replay import synthetic_frame
+
+SENSOR = b"\x00" * 10
+
+
+@pytest.mark.parametrize(
+    "slope, name",
+    [
+        (None, "NotComputable"),
+        (3.5, "DoubleUp"),
+        (0.0, "Flat"),
+        (-1.5, "FortyFiveDown"),
+        (-9, "DoubleDown"),
+    ],
+)
+def test_arrow(slope, name):
+    assert analytics.arrow(slope) == name
+
+
+def test_regression_window_slides():
+    regression = RollingRegression(window=5)
+    for minute in range(10):
+        regression.add(minute, 100 + 2 * minute)
+    assert regression.n == 5
+    assert regression.slope == pytest.approx(2.0)
+    assert regression.fitted(12) == pytest.approx(124.0)
+    # a change of direction only counts once the old points leave
+    for minute in range(10, 15):
+        regression.add(minute, 118 - 3 * (minute - 9))
+    assert regression.slope == pytest.approx(-3.0)
+
+
+def test_regression_needs_two_minutes():
+    regression = RollingRegression()
+    regression.add(10, 100)
+    assert regression.slope is None
+    assert regression.fitted(20) == 100
+
+
+def test_holt_follows_a_line():
+    holt = Holt(alpha=0.8, beta=0.8)
+    for minute in range(60):
+        holt.add(minute, 100 + minute)
+    assert holt.forecast(10) == pytest.approx(169.0, abs=0.5)
+
+
+def test_result_per_sensor():
+    stream = StreamAnalytics(windows=(5, 15), horizons=(10,))
+    assert stream.result("a") is None
+    for minute in range(20):
+        stream.add("a", minute, 100 + 2.5 * minute)
+    stream.add("a", 5, 0.0)
+    result = stream.result("a")
+    assert result["minute"] == 19
+    assert result["slope"] == {5: 2.5, 15: 2.5}
+    assert result["arrow"] == "SingleUp"
+    assert result["forecast"]["linear"][10] == pytest.approx(172.5)
+    assert json.loads(analytics.encode(result))["slope"]["15"] == 2.5
+
+
+def test_update_packet_sets_analytics():
+    stream = StreamAnalytics()
+    received = datetime.datetime(2026, 1, 1)
+    for minutes, lazy in ((1000, False), (1001, True)):
+        frame = synthetic_frame(seed=minutes, minutes=minutes)
+        packet = MiaoMiaoPacket.from_bytes(frame, lazy=lazy)
+        result = stream.update_packet(packet, received + datetime.timedelta(minutes=minutes))
+        assert packet.analytics is result
+    assert result["minute"] == 1001
+    assert result["value"] == round(packet.librepacket.trends[0][0], 1)
+
+
+def test_forget():
+    stream = StreamAnalytics()
+    stream.update_packet(MiaoMiaoPacket.from_bytes(synthetic_frame()))
+    stream.forget(SENSOR)
+    assert stream.result(SENSOR) is None
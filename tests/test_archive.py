@@ -0,0 +1,81 @@
+import pytest
+
+from miao2py.archive import ArchiveReader, FrameArchive
+from miao2py.packet import MiaoMiaoPacket
+from miao2py.replay import synthetic_frame
+
+DEVICE = "aa:bb:cc:dd:ee:ff"
+OTHER = "aa:bb:cc:dd:ee:00"
+
+
+def scan(path, *args):
+    with ArchiveReader(path) as reader:
+        found = []
+        for archived in reader.scan(*args):
+            found.append((archived.timestamp, archived.device, bytes(archived.frame)))
+            archived.frame.release()
+        return found
+
+
+def test_append_and_scan(tmp_path):
+    path = str(tmp_path / "frames.m2pa")
+    frames = [synthetic_frame(seed=i) for i in range(4)]
+    with FrameArchive(path) as archive:
+        for i, frame in enumerate(frames):
+            archive.append(DEVICE if i % 2 else OTHER, frame, timestamp=100.0 + i)
+    assert [frame for _, _, frame in scan(path)] == frames
+    assert [timestamp for timestamp, _, _ in scan(path, DEVICE)] == [101.0, 103.0]
+    assert [timestamp for timestamp, _, _ in scan(path, None, 101.0, 102.0)] == [101.0, 102.0]
+
+
+def test_reopen_appends(tmp_path):
+    path = str(tmp_path / "frames.m2pa")
+    with FrameArchive(path) as archive:
+        archive.append(DEVICE, synthetic_frame(seed=1), timestamp=1.0)
+    with FrameArchive(path) as archive:
+        assert archive.count == 1
+        archive.append(DEVICE, synthetic_frame(seed=2), timestamp=2.0)
+    assert [timestamp for timestamp, _, _ in scan(path)] == [1.0, 2.0]
+
+
+def test_reopen_drops_torn_record(tmp_path):
+    path = str(tmp_path / "frames.m2pa")
+    with FrameArchive(path) as archive:
+        archive.append(DEVICE, synthetic_frame(seed=1), timestamp=1.0)
+    # a crash part way through the next record and its index entry
+    with open(path, "ab") as data:
+        data.write(b"\x01" * 50)
+    with open(path + ".idx", "ab") as index:
+        index.write(b"\x02" * 7)
+    after = synthetic_frame(seed=2)
+    with FrameArchive(path) as archive:
+        assert archive.count == 1
+        archive.append(DEVICE, after, timestamp=2.0)
+    found = scan(path)
+    assert [timestamp for timestamp, _, _ in found] == [1.0, 2.0]
+    assert MiaoMiaoPacket.from_bytes(found[1][2]).sensor_id == after[3:13]
+
+
+def test_reopen_rebuilds_missing_index(tmp_path):
+    path = str(tmp_path / "frames.m2pa")
+    with FrameArchive(path) as archive:
+        archive.append(DEVICE, synthetic_frame(seed=1), timestamp=1.0)
+        archive.append(OTHER, synthetic_frame(seed=2), timestamp=2.0)
+    (tmp_path / "frames.m2pa.idx").unlink()
+    with FrameArchive(path) as archive:
+        archive.append(DEVICE, synthetic_frame(seed=3), timestamp=3.0)
+    assert [timestamp for timestamp, _, _ in scan(path, DEVICE)] == [1.0, 3.0]
+    assert [timestamp for timestamp, _, _ in scan(path, OTHER)] == [2.0]
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "not-an-archive"
+    path.write_bytes(b"hello, this is not an archive at all")
+    with pytest.raises(ValueError):
+        FrameArchive(str(path))
+
+
+def test_frame_too_long(tmp_path):
+    with FrameArchive(str(tmp_path / "frames.m2pa")) as archive:
+        with pytest.raises(ValueError):
+            archive.append(DEVICE, bytes(400))
@@ -0,0 +1,56 @@
+import pytest
+
+from miao2py.packet import LibrePacket, MiaoMiaoPacket
+from miao2py.replay import synthetic_frame
+
+numpy = pytest.importorskip("numpy")
+
+
+def payloads(count):
+    return [synthetic_frame(seed=i, minutes=1000 + i)[18:362] for i in range(count)]
+
+
+def test_matches_per_packet_decode():
+    items = payloads(5)
+    batch = LibrePacket.decode_batch(items)
+    for i, payload in enumerate(items):
+        packet = LibrePacket.from_bytes(payload)
+        assert batch.minutes[i] == packet.minutes
+        assert batch.index_trend[i] == packet.index_trend
+        assert batch.index_history[i] == packet.index_history
+        numpy.testing.assert_allclose(batch.trends[i], packet.trends)
+        numpy.testing.assert_allclose(batch.history[i], packet.history)
+
+
+def test_contiguous_buffer_with_stride():
+    # whole envelopes back to back, payload 18 bytes into each
+    frames = [synthetic_frame(seed=i) for i in range(3)]
+    data = b"".join(frame[18:] + frame[:18] for frame in frames)
+    batch = LibrePacket.decode_batch(data, stride=363)
+    assert batch.trends.shape == (3, 16, 3)
+    assert batch.history.shape == (3, 32, 3)
+    assert list(batch.minutes) == [LibrePacket.from_bytes(frame[18:362]).minutes for frame in frames]
+
+
+def test_raw_words():
+    payload = payloads(1)[0]
+    batch = LibrePacket.decode_batch([payload], raw=True)
+    assert batch.trends.dtype == numpy.uint16
+    expected = LibrePacket.ring_words(payload, LibrePacket.trend_ring, payload[26])
+    assert [tuple(entry) for entry in batch.trends[0]] == expected
+
+
+def test_bad_geometry():
+    with pytest.raises(ValueError):
+        LibrePacket.decode_batch(bytes(100), stride=100)
+    with pytest.raises(ValueError):
+        LibrePacket.decode_batch(bytes(LibrePacket.length + 1))
+
+
+def test_envelope_decode():
+    frame = synthetic_frame(seed=1, battery=42)
+    packet = MiaoMiaoPacket.from_bytes(frame)
+    assert packet.battery == 42
+    assert packet.sensor_id == frame[3:13]
+    assert len(packet.librepacket.trends) == 16
+    assert len(packet.librepacket.history) == 32
@@ -0,0 +1,98 @@
+import pytest
+
+from miao2py.calibration import (
+    CalibratedConverter,
+    ConversionEngine,
+    LinearConverter,
+    TemperatureConverter,
+    read_bits,
+)
+from miao2py.packet import LibrePacket, MiaoMiaoPacket
+from miao2py.replay import synthetic_frame
+
+
+def test_default_matches_divisor():
+    assert LinearConverter().convert(170) == pytest.approx(20.0)
+
+
+def test_read_bits():
+    assert read_bits(bytes([0b10110100, 0b00000001]), 0, 2, 7) == 0b1101101
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_packet_uses_converter(lazy):
+    frame = synthetic_frame(seed=1)
+    converter = LinearConverter(slope=1.0)
+    packet = MiaoMiaoPacket.from_bytes(frame, lazy=lazy, converter=converter)
+    librepacket = packet.librepacket
+    words = LibrePacket.ring_words(
+        librepacket.data, LibrePacket.trend_ring, librepacket.index_trend
+    )
+    assert librepacket.trends[0] == [float(words[0][0]), words[0][1], words[0][2]]
+
+
+def test_lazy_and_eager_agree_under_a_converter():
+    frame = synthetic_frame(seed=2)
+    for converter in (LinearConverter(slope=1.0), TemperatureConverter(temp_slope=0.1)):
+        eager = MiaoMiaoPacket.from_bytes(frame, converter=converter)
+        lazy = MiaoMiaoPacket.from_bytes(frame, lazy=True, converter=converter)
+        eager, lazy = eager.librepacket, lazy.librepacket
+        assert lazy.trends == eager.trends
+        assert lazy.history == eager.history
+        assert lazy.trend(5) == eager.trends[5]
+
+
+def test_temperature_word():
+    converter = TemperatureConverter(
+        slope=1.0, temp_slope=2.0, temp_reference=10, temp_word=1
+    )
+    assert converter.convert(100, 15, 0) == 110.0
+    with pytest.raises(ValueError):
+        TemperatureConverter(temp_word=0)
+
+
+def test_calibration_points():
+    base = LinearConverter(slope=1.0)
+    one = CalibratedConverter(base, [((100, 0, 0), 110.0)])
+    assert one.convert(50) == 60.0
+    two = CalibratedConverter(base, [((100, 0, 0), 200.0), ((200, 0, 0), 400.0)])
+    assert (two.gain, two.shift) == pytest.approx((2.0, 0.0))
+    assert two.convert(150) == pytest.approx(300.0)
+
+
+def test_engine_caches_per_sensor():
+    built = []
+    def factory(parameters):
+        built.append(parameters)
+        return LinearConverter()
+
+    engine = ConversionEngine(factory=factory, max_sensors=2)
+    frames = [synthetic_frame(seed=i, serial=bytes([i]) * 10) for i in range(3)]
+    for frame in frames + frames[2:]:
+        engine.decode(frame)
+    assert len(built) == 3
+    assert list(engine.sensors) == [bytes([1]) * 10, bytes([2]) * 10]
+    with pytest.raises(ValueError):
+        engine.converter(bytes([0]) * 10)
+
+
+def test_engine_calibrates_newest_trend():
+    frame = synthetic_frame(seed=3)
+    engine = ConversionEngine()
+    packet = engine.decode(frame)
+    newest = packet.librepacket.trends[0][0]
+    engine.calibrate(packet.sensor_id, packet.payload, newest + 5)
+    assert engine.decode(frame).librepacket.trends[0][0] == pytest.approx(newest + 5)
+
+
+def test_convert_batch_per_sensor():
+    pytest.importorskip("numpy")
+    frames = [synthetic_frame(seed=i, serial=bytes([i % 2]) * 10) for i in range(4)]
+    engine = ConversionEngine(factory=lambda parameters: LinearConverter(slope=1.0))
+    engine.converter(bytes([1]) * 10, frames[1][18:362])
+    engine.sensors[bytes([1]) * 10][1] = LinearConverter(slope=2.0)
+    serials = [frame[3:13] for frame in frames]
+    batch = engine.convert_batch(serials, [frame[18:362] for frame in frames])
+    for row, frame in enumerate(frames):
+        expected = engine.decode(frame).librepacket.trends
+        assert batch.trends[row, :, 0].tolist() == [entry[0] for entry in expected]
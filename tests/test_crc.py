@@ -0,0 +1,81 @@
+import random
+import struct
+
+import pytest
+
+from miao2py.packet import crc16
+from miao2py.replay import synthetic_frame
+
+
+def mcrf4xx(data):
+    """bitwise CRC-16/MCRF4XX (reflected 0x1021, init 0xffff)"""
+    crc = 0xFFFF
+    for octet in data:
+        crc ^= octet
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0x8408 if crc & 1 else crc >> 1
+    return crc
+
+
+def reverse16(value):
+    return int("{:016b}".format(value)[::-1], 2)
+
+
+def test_catalogue_check_value():
+    # the published check value of CRC-16/MCRF4XX
+    assert mcrf4xx(b"123456789") == 0x6F91
+    # the Libre stores it bit-reversed
+    assert crc16.of(b"123456789") == reverse16(0x6F91) == 0x89F6
+
+
+@pytest.mark.parametrize("length", list(range(0, 20)) + [22, 294, 342])
+def test_slicing_matches_bitwise(length):
+    block = bytes(random.Random(length).getrandbits(8) for _ in range(length))
+    assert crc16.of(block) == reverse16(mcrf4xx(block))
+
+
+def test_libre_regions_verify():
+    payload = synthetic_frame(seed=1)[18:362]
+    for start, end in crc16.libre_regions:
+        block = payload[start:end]
+        assert crc16.check(block)
+        assert crc16.at(block) == (struct.unpack("<H", block[:2])[0], crc16.of(block[2:]))
+
+
+def blocks(count):
+    payloads = [bytearray(synthetic_frame(seed=i)[18:362]) for i in range(count)]
+    payloads[1][5] ^= 0x01
+    payloads[2][200] ^= 0x80
+    payloads[3][340] ^= 0x10
+    return [bytes(payload) for payload in payloads]
+
+
+EXPECTED = [(True, True, True), (False, True, True), (True, False, True), (True, True, False), (True, True, True)]
+
+
+def test_check_many_lists():
+    assert crc16.check_many(blocks(5)) == EXPECTED
+
+
+def test_check_many_numpy_agrees_with_scalar(monkeypatch):
+    pytest.importorskip("numpy")
+    items = blocks(5)
+    vectorized = crc16.check_many(items)
+    import builtins
+
+    real_import = builtins.__import__
+
+    def no_numpy(name, *args, **kwargs):
+        if name == "numpy":
+            raise ImportError(name)
+        return real_import(name, *args, **kwargs)
+
+    monkeypatch.setattr(builtins, "__import__", no_numpy)
+    assert crc16.check_many(items) == vectorized == EXPECTED
+
+
+def test_check_many_contiguous_stride():
+    frames = [synthetic_frame(seed=i) for i in range(3)]
+    assert crc16.check_many(b"".join(frames), stride=363, offset=18) == [(True, True, True)] * 3
+    with pytest.raises(ValueError):
+        crc16.check_many(b"".join(frames))
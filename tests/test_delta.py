@@ -0,0 +1,101 @@
+import datetime
+
+from miao2py.delta import DeltaTracker
+from miao2py.packet import MiaoMiaoPacket
+from miao2py.replay import synthetic_frame
+
+BASE = datetime.datetime(2026, 1, 1)
+
+
+def packet(minutes, lazy=False, serial=bytes(10)):
+    return MiaoMiaoPacket.from_bytes(
+        synthetic_frame(seed=minutes, minutes=minutes, serial=serial), lazy=lazy
+    )
+
+
+def received(minutes, jitter=0):
+    return BASE + datetime.timedelta(minutes=minutes, seconds=jitter)
+
+
+def kinds(readings, kind):
+    return [reading.minute for reading in readings if reading.kind == kind]
+
+
+def test_first_read_emits_both_rings():
+    readings = DeltaTracker().update(packet(1000), received(1000))
+    assert kinds(readings, DeltaTracker.TREND) == list(range(985, 1001))
+    history = kinds(readings, DeltaTracker.HISTORY)
+    # the newest history entry is the last quarter hour 3 minutes old
+    assert history[-1] == 990
+    assert history == list(range(990 - 31 * 15, 991, 15))
+    assert readings == sorted(readings, key=lambda reading: reading.minute)
+
+
+def test_next_minute_emits_one_trend():
+    tracker = DeltaTracker()
+    tracker.update(packet(1000), received(1000))
+    readings = tracker.update(packet(1001), received(1001))
+    assert [(reading.kind, reading.minute) for reading in readings] == [("trend", 1001)]
+
+
+def test_same_packet_emits_nothing():
+    tracker = DeltaTracker()
+    tracker.update(packet(1000), received(1000))
+    assert tracker.update(packet(1000), received(1000, 20)) == []
+
+
+def test_history_follows_index_history():
+    tracker = DeltaTracker()
+    tracker.update(packet(1002), received(1002))
+    # the ring advances 3 minutes after the quarter hour, within one window
+    assert kinds(tracker.update(packet(1004), received(1004)), DeltaTracker.HISTORY) == []
+    assert kinds(tracker.update(packet(1008), received(1008)), DeltaTracker.HISTORY) == [1005]
+
+
+def test_timestamps_stable_across_jitter():
+    tracker = DeltaTracker()
+    seen = {}
+    for minutes in range(1000, 1060):
+        for reading in tracker.update(packet(minutes), received(minutes, minutes * 7 % 50)):
+            assert seen.setdefault((reading.kind, reading.minute), reading.timestamp) == reading.timestamp
+    # trend minutes 985-1059, 32 history entries then 1005 to 1050
+    assert len(seen) == 75 + 32 + 4
+
+
+def test_values_match_ring_index():
+    tracker = DeltaTracker()
+    tracker.update(packet(1000), received(1000))
+    current = packet(1017)
+    for reading in tracker.update(current, received(1017)):
+        ring = current.librepacket.trends if reading.kind == "trend" else current.librepacket.history
+        assert reading.values == ring[reading.index]
+
+
+def test_gap_longer_than_ring_refreshes_all():
+    tracker = DeltaTracker()
+    tracker.update(packet(1000), received(1000))
+    readings = tracker.update(packet(2000), received(2000))
+    assert len(kinds(readings, DeltaTracker.TREND)) == 16
+    assert len(kinds(readings, DeltaTracker.HISTORY)) == 32
+
+
+def test_restart_starts_over():
+    tracker = DeltaTracker()
+    tracker.update(packet(1000), received(1000))
+    readings = tracker.update(packet(20), received(2000))
+    assert kinds(readings, DeltaTracker.TREND) == list(range(5, 21))
+    assert kinds(readings, DeltaTracker.HISTORY) == [0, 15]
+
+
+def test_lazy_packets():
+    tracker = DeltaTracker()
+    tracker.update(packet(1000, lazy=True), received(1000))
+    readings = tracker.update(packet(1001, lazy=True), received(1001))
+    assert kinds(readings, DeltaTracker.TREND) == [1001]
+
+
+def test_sensors_tracked_apart():
+    tracker = DeltaTracker()
+    tracker.update(packet(1000), received(1000))
+    other = packet(1000, serial=b"\x01" * 10)
+    assert len(tracker.update(other, received(1000))) == 48
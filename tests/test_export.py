@@ -0,0 +1,58 @@
+import csv
+
+import pytest
+from click.testing import CliRunner
+
+from miao2py import export
+from miao2py.archive import FrameArchive
+from miao2py.cli.exporter import export as export_command
+from miao2py.replay import synthetic_frame
+
+DEVICE = "aa:00:00:00:00:01"
+# 2026-01-01 00:00 UTC
+EPOCH = 1767225600.0
+
+
+def archive(path, minutes):
+    with FrameArchive(str(path)) as frames:
+        for minute in minutes:
+            frame = synthetic_frame(seed=minute, minutes=minute)
+            frames.append(DEVICE, frame, timestamp=EPOCH + minute * 60)
+    return str(path)
+
+
+def test_first_sight_then_new_entries(tmp_path):
+    path = archive(tmp_path / "frames.m2pa", [1000, 1001, 1017])
+    rows = list(export.rows_from_archive(path))
+    # 48 on first sight, one trend, then 16 trends and a history entry
+    assert len(rows) == 48 + 1 + 17
+    kinds = [row[3] for row in rows[48:]]
+    assert (kinds.count("trend"), kinds.count("history")) == (17, 1)
+    assert all(row[:2] == (DEVICE, "00000000000") for row in rows)
+    assert len(list(export.rows_from_archive(path, dedupe=False))) == 3 * 48
+
+
+def test_rotated_archives_dedupe_together(tmp_path):
+    older = archive(tmp_path / "frames.1.m2pa", [1000, 1001])
+    newer = archive(tmp_path / "frames.2.m2pa", [1001, 1002])
+    output = tmp_path / "readings.csv"
+    result = CliRunner().invoke(export_command, [older, newer, "-o", str(output)])
+    assert result.exit_code == 0, result.output
+    with open(str(output), newline="") as rows:
+        rows = list(csv.reader(rows))
+    assert tuple(rows[0]) == export.COLUMNS
+    assert len(rows) - 1 == 48 + 1 + 1
+    assert len({(row[2], row[3]) for row in rows[1:]}) == 50
+
+
+def test_npz_chunks(tmp_path):
+    numpy = pytest.importorskip("numpy")
+    path = archive(tmp_path / "frames.m2pa", [1000, 1001])
+    writer = export.NumpyWriter(str(tmp_path / "readings.npz"))
+    assert export.export(export.rows_from_archive(path), writer, chunk_rows=40) == 49
+    first = numpy.load(str(tmp_path / "readings.00000.npz"))
+    second = numpy.load(str(tmp_path / "readings.00001.npz"))
+    assert len(first["value"]) == 40
+    assert len(second["value"]) == 9
+    assert second["kind"][-1] == "trend"
+    assert second["timestamp"][-1] == pytest.approx(EPOCH + 1001 * 60)
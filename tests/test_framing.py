@@ -0,0 +1,62 @@
+from miao2py.framing import FrameReassembler
+from miao2py.replay import fragment, synthetic_frame
+
+
+def feed_all(reassembler, pieces):
+    frames = []
+    for piece in pieces:
+        frames.extend(reassembler.feed(piece))
+    return frames
+
+
+def test_reassembles_fragments():
+    frame = synthetic_frame(seed=1)
+    reassembler = FrameReassembler()
+    assert feed_all(reassembler, fragment(frame, 20)) == [frame]
+    assert reassembler.frames == 1
+    assert reassembler.fragments == len(fragment(frame, 20))
+    assert not reassembler.in_frame
+
+
+def test_skips_garbage_before_start():
+    frame = synthetic_frame(seed=2)
+    reassembler = FrameReassembler()
+    assert feed_all(reassembler, [b"\x00\x01\x02"] + fragment(frame, 20)) == [frame]
+    assert reassembler.dropped_bytes == 3
+    assert reassembler.dropped_frames == 0
+
+
+def test_resyncs_after_implausible_length():
+    frame = synthetic_frame(seed=3)
+    reassembler = FrameReassembler()
+    # a start byte followed by a length far beyond max_length
+    frames = feed_all(reassembler, [b"\x28\xff\xff"] + fragment(frame, 20))
+    assert frames == [frame]
+    assert reassembler.dropped_frames == 1
+
+
+def test_resyncs_on_missing_end_byte():
+    good = synthetic_frame(seed=4)
+    bad = good[:-1] + b"\x00"
+    reassembler = FrameReassembler()
+    frames = feed_all(reassembler, fragment(bad + good, 20))
+    assert frames == [good]
+    assert reassembler.dropped_frames >= 1
+
+
+def test_two_frames_in_one_notification():
+    first, second = synthetic_frame(seed=5), synthetic_frame(seed=6)
+    reassembler = FrameReassembler()
+    assert reassembler.feed(first + second) == [first, second]
+    assert reassembler.frames == 2
+
+
+def test_reset_counts_partial_frame():
+    frame = synthetic_frame(seed=7)
+    reassembler = FrameReassembler()
+    reassembler.feed(frame[:100])
+    assert reassembler.in_frame
+    reassembler.reset()
+    assert reassembler.partial_frames == 1
+    assert not reassembler.in_frame
+    assert feed_all(reassembler, fragment(frame, 20)) == [frame]
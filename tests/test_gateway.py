@@ -0,0 +1,50 @@
+import asyncio
+
+from miao2py.gateway import MiaoMiaoGateway
+from miao2py.replay import ReplayTransport, fragment, synthetic_frame
+from miao2py.transport import FakeTransport, TransportError
+
+
+def run_for(gateway, seconds):
+    loop = asyncio.new_event_loop()
+    try:
+        loop.call_later(seconds, gateway.stop)
+        loop.run_until_complete(gateway.run())
+    finally:
+        loop.close()
+
+
+def frames(count, minutes=1000):
+    return [synthetic_frame(seed=i, minutes=minutes + i) for i in range(count)]
+
+
+def test_replay_transport_feeds_sink():
+    got = []
+    gateway = MiaoMiaoGateway(lambda device, packet: got.append(packet), interval=0.01)
+    gateway.add_device("aa:00:00:00:00:01", transport=ReplayTransport(frames(3)))
+    run_for(gateway, 0.3)
+    assert [packet.librepacket.minutes for packet in got] == [1000, 1001, 1002]
+    assert got[0].serial == "00000000000"
+    assert got[1].session is got[0].session
+
+
+def test_fake_transport_read():
+    frame = synthetic_frame(seed=1)
+    transport = FakeTransport([fragment(frame)])
+    got = []
+    gateway = MiaoMiaoGateway(lambda device, packet: got.append(device), interval=10)
+    device = gateway.add_device("aa:00:00:00:00:02", transport=transport)
+    run_for(gateway, 0.2)
+    assert got == [device]
+    assert device.reads == 1
+    assert transport.writes[0] == bytes([0xF0])
+
+
+def test_connect_errors_back_off():
+    transport = FakeTransport(connect_error=TransportError("unreachable"))
+    gateway = MiaoMiaoGateway(lambda device, packet: None)
+    device = gateway.add_device("aa:00:00:00:00:03", transport=transport)
+    run_for(gateway, 0.2)
+    # the first retry waits a whole second
+    assert transport.connects == 1
+    assert device.errors == 1
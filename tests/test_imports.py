@@ -0,0 +1,45 @@
+import json
+import subprocess
+import sys
+
+import pytest
+
+from miao2py import bench, transport as transports
+from miao2py.replay import ReplayTransport
+
+
+def loaded_by(statement):
+    probe = "import json, sys\n{}\nprint(json.dumps(sorted(sys.modules)))".format(statement)
+    return set(json.loads(subprocess.check_output([sys.executable, "-c", probe]).decode()))
+
+
+def test_offline_path_stays_light():
+    loaded = loaded_by("import miao2py.offline, miao2py.packet")
+    assert not loaded & set(bench.heavy_modules)
+
+
+def test_device_does_not_need_bluepy():
+    loaded = loaded_by("import miao2py.device, miao2py.gateway")
+    assert "bluepy" not in loaded
+    assert "hbmqtt" not in loaded
+
+
+def test_transport_registry():
+    assert transports.load("replay") is ReplayTransport
+    assert isinstance(transports.create("fake"), transports.FakeTransport)
+    with pytest.raises(ValueError):
+        transports.load("carrier-pigeon")
+
+
+def test_register_transport():
+    transports.register("replay-again", "miao2py.replay:ReplayTransport")
+    try:
+        assert transports.load("replay-again") is ReplayTransport
+    finally:
+        del transports.transports["replay-again"]
+
+
+def test_bench_import_stage():
+    result = bench.bench_import([None] * 2)
+    assert result.stage == "import"
+    assert result.frames == 2
@@ -0,0 +1,75 @@
+import json
+
+import pytest
+
+from miao2py.cli.decoder import keep_alive
+from miao2py.replay import ReplayTransport, synthetic_frame
+from miao2py.transport import HandleCache, TransportError
+
+BTADDR = "AA:00:00:00:00:01"
+
+
+class Dropping(ReplayTransport):
+    """replays frames, dropping the link on the given read requests and
+       giving up on the given connect
+    """
+
+    def __init__(self, frames, drop=(), give_up=None):
+        super().__init__(frames)
+        self.drop = set(drop)
+        self.give_up = give_up
+        self.requests = 0
+
+    def connect(self, btaddr):
+        if self.connects + 1 == self.give_up:
+            raise RuntimeError("giving up")
+        super().connect(btaddr)
+
+    def write(self, data):
+        if bytes(data) == self.read_request:
+            self.requests += 1
+            if self.requests in self.drop:
+                raise TransportError("link lost")
+        super().write(data)
+
+
+def frames(count):
+    return [synthetic_frame(seed=i, minutes=1000 + i) for i in range(count)]
+
+
+def test_handle_cache_persists(tmp_path):
+    path = str(tmp_path / "cache" / "handles.json")
+    cache = HandleCache(path)
+    cache.put(BTADDR, {"recv": 14, "xmit_desc": 17})
+    assert HandleCache(path).get(BTADDR.lower()) == {"recv": 14, "xmit_desc": 17}
+    cache.forget(BTADDR)
+    assert HandleCache(path).get(BTADDR) is None
+
+
+def test_corrupt_handle_cache_is_ignored(tmp_path):
+    path = tmp_path / "handles.json"
+    path.write_text("{not json")
+    cache = HandleCache(str(path))
+    assert cache.get(BTADDR) is None
+    cache.put(BTADDR, {"recv": 1, "xmit_desc": 2})
+    assert json.loads(path.read_text()) == {BTADDR.lower(): {"recv": 1, "xmit_desc": 2}}
+
+
+def test_reads_over_one_connection(capsys):
+    transport = Dropping(frames(3), drop=[4])
+    with pytest.raises(TransportError):
+        keep_alive(BTADDR, transport, 0, btfatal=False)
+    assert transport.connects == 1
+    assert capsys.readouterr().out.count("sensor was read") == 3
+
+
+def test_reconnects_after_a_dropped_link(capsys):
+    transport = Dropping(frames(2), drop=[2, 4], give_up=3)
+    transport.handle_cache = HandleCache()
+    transport.handle_cache.put(BTADDR, {"recv": 14, "xmit_desc": 17})
+    with pytest.raises(RuntimeError):
+        keep_alive(BTADDR, transport, 0, btfatal=True)
+    assert transport.connects == 2
+    assert capsys.readouterr().out.count("sensor was read") == 2
+    # a dropped link is no reason to rediscover the handles
+    assert transport.handle_cache.get(BTADDR) == {"recv": 14, "xmit_desc": 17}
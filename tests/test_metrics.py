@@ -0,0 +1,76 @@
+import urllib.request
+
+import pytest
+
+from miao2py import metrics
+from miao2py.packet import MiaoMiaoPacket
+from miao2py.replay import synthetic_frame
+
+
+@pytest.fixture
+def registry():
+    previous = metrics.registry
+    yield metrics.use(metrics.Registry())
+    metrics.use(previous)
+
+
+def test_counter_and_gauge_text(registry):
+    registry.counter("frames_total", "frames received").inc(device="aa")
+    registry.counter("frames_total").inc(2, device="aa")
+    registry.gauge("depth", "queue depth").set(3, broker='mqtt://"b"')
+    assert registry.render() == (
+        "# HELP depth queue depth\n"
+        "# TYPE depth gauge\n"
+        'depth{broker="mqtt://\\"b\\""} 3\n'
+        "# HELP frames_total frames received\n"
+        "# TYPE frames_total counter\n"
+        'frames_total{device="aa"} 3\n'
+    )
+
+
+def test_histogram_buckets_are_cumulative(registry):
+    histogram = registry.histogram("took_seconds", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        histogram.observe(value, stage="decode")
+    lines = registry.render().splitlines()[2:]
+    assert lines == [
+        'took_seconds_bucket{stage="decode",le="0.1"} 1',
+        'took_seconds_bucket{stage="decode",le="1.0"} 3',
+        'took_seconds_bucket{stage="decode",le="+Inf"} 4',
+        'took_seconds_sum{stage="decode"} 6.05',
+        'took_seconds_count{stage="decode"} 4',
+    ]
+
+
+def test_name_reused_as_another_kind(registry):
+    registry.counter("things")
+    with pytest.raises(ValueError):
+        registry.gauge("things")
+
+
+def test_decode_is_timed(registry):
+    MiaoMiaoPacket.from_bytes(synthetic_frame(), verify=True)
+    text = registry.render()
+    assert 'miao2py_stage_seconds_count{stage="decode"} 1' in text
+    assert 'miao2py_stage_seconds_count{stage="crc"} 1' in text
+
+
+def test_null_registry_records_nothing():
+    null = metrics.NullRegistry()
+    assert not null.enabled
+    null.counter("frames_total").inc(device="aa")
+    with null.histogram("took_seconds").time(stage="decode"):
+        pass
+    assert null.render() == ""
+
+
+def test_server_exposes_registry(registry):
+    registry.counter("frames_total").inc()
+    server = metrics.MetricsServer(registry, port=0)
+    server.start()
+    try:
+        url = "http://127.0.0.1:{}/metrics".format(server.port)
+        with urllib.request.urlopen(url, timeout=5) as response:
+            assert response.read().decode() == registry.render()
+    finally:
+        server.stop()
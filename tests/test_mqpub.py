@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+from miao2py.mqpub import PublishQueue
+
+
+class Client:
+    """stands in for hbmqtt; fail maps a payload to the exception its
+       first publish raises
+    """
+
+    def __init__(self, fail=None):
+        self.fail = dict(fail or {})
+        self.connects = 0
+        self.published = []
+
+    async def connect(self, url):
+        self.connects += 1
+
+    async def disconnect(self):
+        pass
+
+    async def publish(self, topic, payload, qos=0):
+        if payload in self.fail:
+            raise self.fail.pop(payload)
+        self.published.append((topic, payload))
+
+
+def queue(client, **kwargs):
+    kwargs.setdefault("backoff_initial", 0.01)
+    return PublishQueue("mqtt://broker", client_factory=lambda: client, **kwargs)
+
+
+def test_publishes_in_order():
+    client = Client()
+    pub = queue(client, batch_size=4, batch_ms=20)
+    pub.start()
+    for i in range(10):
+        pub.submit("miaomiao/aa", bytes([i]))
+    pub.stop()
+    assert client.published == [("miaomiao/aa", bytes([i])) for i in range(10)]
+    assert pub.published == 10
+    assert pub.failures == 0
+
+
+def test_retries_only_failed_messages():
+    client = Client(fail={b"\x01": OSError("broker went away")})
+    pub = queue(client, batch_size=3, batch_ms=50)
+    pub.start()
+    for i in range(3):
+        pub.submit("miaomiao/aa", bytes([i]))
+    pub.stop()
+    assert sorted(payload for _, payload in client.published) == [b"\x00", b"\x01", b"\x02"]
+    assert pub.failures == 1
+    assert client.connects == 2
+
+
+def test_cancelled_publish_is_not_retried():
+    client = Client(fail={b"\x01": asyncio.CancelledError()})
+    pub = queue(client)
+    pub.start()
+    pub.submit("miaomiao/aa", b"\x01")
+    pub.stop(timeout=1.0)
+    assert not pub.running
+    assert pub.failures == 0
+    assert client.published == []
+    assert client.connects == 1
+
+
+def test_drop_oldest():
+    pub = queue(Client(), maxsize=2)
+    pub.queue = asyncio.Queue(2)
+    for i in range(3):
+        pub._put_drop_oldest(("miaomiao/aa", bytes([i]), 0.0))
+    assert pub.dropped == 1
+    assert pub.queue.get_nowait()[1] == b"\x01"
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        queue(Client(), policy="drop-newest")
@@ -0,0 +1,100 @@
+import asyncio
+import json
+
+from miao2py import wire
+from miao2py.mqsub import MiaoMiaoMQSubscriber, decode_frame
+from miao2py.packet import MiaoMiaoPacket
+from miao2py.replay import synthetic_frame
+
+
+class Message:
+    def __init__(self, topic, data):
+        self.topic = topic
+        self.data = data
+
+
+class Client:
+    """stands in for hbmqtt, delivering messages then waiting forever"""
+
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.subscribed = None
+        self.disconnected = False
+
+    async def connect(self, url):
+        pass
+
+    async def subscribe(self, topics):
+        self.subscribed = topics
+
+    async def deliver_message(self):
+        if not self.messages:
+            await asyncio.Event().wait()
+        return self.messages.pop(0)
+
+    async def disconnect(self):
+        self.disconnected = True
+
+
+class Subscriber(MiaoMiaoMQSubscriber):
+    def __init__(self, messages, expect, **kwargs):
+        self.client = Client(messages)
+        super().__init__(
+            "mqtt://broker", "miaomiao/#", client_factory=lambda: self.client, **kwargs
+        )
+        self.expect = expect
+        self.handled = []
+        self.done = asyncio.Event()
+
+    def handleMessage(self, topic, packet):
+        self.handled.append((topic, packet))
+        if len(self.handled) + self.errors >= self.expect:
+            self.done.set()
+
+
+def consume(subscriber):
+    async def main():
+        task = asyncio.ensure_future(subscriber.run())
+        await asyncio.wait_for(subscriber.done.wait(), 5)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(main())
+
+
+def test_decode_frame_by_topic():
+    frame = synthetic_frame(seed=1)
+    packet = MiaoMiaoPacket.from_bytes(frame)
+    assert decode_frame("miaomiao/aa", frame).sensor_id == packet.sensor_id
+    compact = decode_frame(wire.compact_topic("miaomiao/aa"), wire.encode(packet))
+    assert compact.minutes == packet.librepacket.minutes
+    assert decode_frame("miaomiao/aa/analytics", json.dumps({"rate": 1.0}).encode()) == {"rate": 1.0}
+
+
+def test_frames_stay_in_order_per_topic():
+    messages = []
+    for i in range(20):
+        for topic in ("miaomiao/aa", "miaomiao/bb"):
+            messages.append(Message(topic, synthetic_frame(seed=i, minutes=1000 + i)))
+    subscriber = Subscriber(messages, len(messages), workers=4)
+    consume(subscriber)
+    assert subscriber.decoded == 40
+    assert subscriber.client.subscribed == [("miaomiao/#", 0)]
+    assert subscriber.client.disconnected
+    for topic in ("miaomiao/aa", "miaomiao/bb"):
+        minutes = [packet.librepacket.minutes for got, packet in subscriber.handled if got == topic]
+        assert minutes == list(range(1000, 1020))
+
+
+def test_undecodable_frames_are_counted():
+    messages = [
+        Message("miaomiao/aa", b"\x28garbage"),
+        Message("miaomiao/aa", synthetic_frame(seed=2)),
+    ]
+    subscriber = Subscriber(messages, 2, workers=1)
+    consume(subscriber)
+    assert subscriber.errors == 1
+    assert subscriber.decoded == 1
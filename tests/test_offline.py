@@ -0,0 +1,68 @@
+import binascii
+import json
+
+from miao2py import offline
+from miao2py.archive import FrameArchive
+from miao2py.replay import synthetic_frame
+
+
+def hexfile(path, frames):
+    path.write_bytes(b"".join(binascii.hexlify(frame) + b"\n" for frame in frames))
+    return str(path)
+
+
+def test_iter_frames_by_format(tmp_path):
+    frames = [synthetic_frame(seed=i) for i in range(3)]
+    (tmp_path / "capture.bin").write_bytes(b"".join(frames))
+    hexfile(tmp_path / "capture.hex", frames[:2])
+    with FrameArchive(str(tmp_path / "frames.m2pa")) as archive:
+        archive.append("aa:00:00:00:00:01", frames[2], timestamp=1.0)
+    found = list(offline.iter_frames([str(tmp_path)]))
+    # the archive's .idx is not read as a capture of its own
+    assert [(source.rsplit("/", 1)[1], index) for source, index, _ in found] == [
+        ("capture.bin", 0),
+        ("capture.bin", 1),
+        ("capture.bin", 2),
+        ("capture.hex", 0),
+        ("capture.hex", 1),
+        ("frames.m2pa", 0),
+    ]
+    assert [frame for _, _, frame in found] == frames + frames[:2] + frames[2:]
+
+
+def test_decode_record():
+    record = offline.decode_record("capture", 0, synthetic_frame(seed=1, minutes=1000))
+    assert record["minutes"] == 1000
+    assert record["serial"] == "00000000000"
+    assert len(record["trends"]) == 16
+    assert len(record["history"]) == 32
+
+
+def test_short_frame_is_an_error_record():
+    record = offline.decode_record("capture", 3, bytes.fromhex("28"))
+    assert record["index"] == 3
+    assert "error" in record
+
+
+def test_decode_all_skips_short_lines(tmp_path):
+    path = tmp_path / "capture.hex"
+    frames = [binascii.hexlify(synthetic_frame(seed=seed)) for seed in (1, 2)]
+    path.write_bytes(frames[0] + b"\n28\n" + frames[1])
+    frames = offline.iter_frames([str(path)])
+    records = list(offline.decode_all(frames, jobs=2, chunk_size=1))
+    assert [record["index"] for record in records] == [0, 1, 2]
+    assert ["error" in record for record in records] == [False, True, False]
+
+
+def test_main_csv(tmp_path, capsys):
+    path = hexfile(tmp_path / "capture.hex", [synthetic_frame(seed=1), b"\x28"])
+    offline.main([path, "--output", "csv", "--jobs", "1"])
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].startswith("source,index,sensor_id")
+    assert len(lines) == 2
+
+
+def test_main_ndjson(tmp_path, capsys):
+    path = hexfile(tmp_path / "capture.hex", [synthetic_frame(seed=1, minutes=1234)])
+    offline.main([path, "--jobs", "1"])
+    assert json.loads(capsys.readouterr().out)["minutes"] == 1234
@@ -0,0 +1,79 @@
+from miao2py import bench
+from miao2py.framing import FrameReassembler
+from miao2py.packet import MiaoMiaoPacket
+from miao2py.replay import ReplayTransport, fragment, synthetic_frame
+
+
+class Delegate:
+    def __init__(self):
+        self.pieces = []
+
+    def handleNotification(self, handle, data):
+        self.pieces.append(bytes(data))
+
+
+def replay(transport):
+    delegate = Delegate()
+    transport.connect("aa:00:00:00:00:01")
+    transport.enable_notify(delegate)
+    transport.write(transport.read_request)
+    while transport.wait(0.01):
+        pass
+    return delegate.pieces
+
+
+def test_synthetic_frame_decodes():
+    frame = synthetic_frame(seed=5, minutes=2000, battery=42, serial=b"\x01" * 10)
+    packet = MiaoMiaoPacket.from_bytes(frame, verify=True)
+    assert len(frame) == 363
+    assert packet.battery == 42
+    assert packet.librepacket.minutes == 2000
+    assert packet.sensor_id == b"\x01" * 10
+
+
+def test_fragment_sizes():
+    pieces = fragment(synthetic_frame(), mtu=20)
+    assert [len(piece) for piece in pieces] == [20] * 18 + [3]
+
+
+def test_replays_fragmented_frames():
+    frames = [synthetic_frame(seed=i) for i in range(2)]
+    transport = ReplayTransport(frames, mtu=50)
+    pieces = replay(transport)
+    assert b"".join(pieces) == frames[0]
+    assert max(len(piece) for piece in pieces) == 50
+    assert b"".join(replay(transport)) == frames[1]
+    assert transport.sent == len(fragment(frames[0], 50)) + len(fragment(frames[1], 50))
+
+
+def test_no_sensor_when_frames_run_out():
+    transport = ReplayTransport([synthetic_frame()])
+    replay(transport)
+    assert replay(transport) == [ReplayTransport.no_sensor]
+
+
+def test_loss_is_seeded():
+    frame = synthetic_frame()
+    lost = []
+    for _ in range(2):
+        transport = ReplayTransport([frame], loss=0.5, seed=7)
+        pieces = replay(transport)
+        assert len(pieces) + transport.lost == len(fragment(frame))
+        lost.append(transport.lost)
+    assert lost[0] == lost[1] > 0
+
+
+def test_reassembles_replayed_frames():
+    frames = []
+    reassembler = FrameReassembler()
+    for piece in replay(ReplayTransport([synthetic_frame(seed=9)], mtu=17)):
+        frames.extend(bytes(frame) for frame in reassembler.feed(piece))
+    assert frames == [synthetic_frame(seed=9)]
+
+
+def test_bench_run():
+    results = bench.run(["reassembly", "decode", "crc", "device"], nframes=20)
+    assert [result.stage for result in results] == ["reassembly", "decode", "crc", "device"]
+    for result in results:
+        assert result.frames == 20
+        assert result.p50 <= result.p99
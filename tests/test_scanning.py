@@ -0,0 +1,111 @@
+import asyncio
+
+from miao2py.device import MiaoMiaoScanner
+from miao2py.gateway import MiaoMiaoGateway
+from miao2py.replay import ReplayTransport, synthetic_frame
+from miao2py.scanning import DeviceRegistry
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class ScanEntry:
+    def __init__(self, addr, rssi, name="miaomiao"):
+        self.addr = addr
+        self.rssi = rssi
+        self.name = name
+
+    def getValueText(self, adtype):
+        return self.name
+
+
+def run_for(gateway, seconds):
+    loop = asyncio.new_event_loop()
+    try:
+        loop.call_later(seconds, gateway.stop)
+        loop.run_until_complete(gateway.run())
+    finally:
+        loop.close()
+
+
+def frames(count, minutes=1000):
+    return [synthetic_frame(seed=i, minutes=minutes + i) for i in range(count)]
+
+
+def test_rssi_is_smoothed():
+    registry = DeviceRegistry(alpha=0.5, clock=Clock())
+    registry.seen("aa:00:00:00:00:01", -80)
+    registry.seen("aa:00:00:00:00:01", -60)
+    assert registry.get("aa:00:00:00:00:01").rssi == -70
+
+
+def test_in_range_and_expiry():
+    clock = Clock()
+    registry = DeviceRegistry(in_range=30, expiry=300, clock=clock)
+    registry.seen("aa:00:00:00:00:01", -70)
+    assert registry.in_range("aa:00:00:00:00:01")
+    clock.now = 31
+    assert not registry.in_range("aa:00:00:00:00:01")
+    assert registry.expire() == []
+    clock.now = 301
+    assert registry.expire() == ["aa:00:00:00:00:01"]
+    assert "aa:00:00:00:00:01" not in registry
+
+
+def test_min_rssi():
+    registry = DeviceRegistry(min_rssi=-80, clock=Clock())
+    registry.seen("aa:00:00:00:00:01", -90)
+    assert not registry.in_range("aa:00:00:00:00:01")
+    assert registry.pop() is None
+
+
+def test_pop_prefers_strong_then_reschedules():
+    clock = Clock()
+    registry = DeviceRegistry(read_interval=60, retry_interval=15, clock=clock)
+    registry.seen("aa:00:00:00:00:01", -90)
+    registry.seen("aa:00:00:00:00:02", -50)
+    assert registry.pop() == "aa:00:00:00:00:02"
+    assert registry.pop() == "aa:00:00:00:00:01"
+    assert registry.pop() is None
+    registry.read_done("aa:00:00:00:00:02")
+    registry.read_done("aa:00:00:00:00:01", ok=False)
+    clock.now = 16
+    assert registry.pop() == "aa:00:00:00:00:01"
+    clock.now = 61
+    registry.seen("aa:00:00:00:00:01", -90)
+    registry.seen("aa:00:00:00:00:02", -50)
+    # 01 popped at 16 without read_done is due again from 31; stronger first
+    assert registry.due() == ["aa:00:00:00:00:02", "aa:00:00:00:00:01"]
+
+
+def test_scanner_feeds_registry():
+    registry = DeviceRegistry(clock=Clock())
+    scanner = MiaoMiaoScanner(registry=registry, quiet=True)
+    scanner.handleDiscovery(ScanEntry("aa:00:00:00:00:01", -60), True, True)
+    scanner.handleDiscovery(ScanEntry("aa:00:00:00:00:02", -60, name="other"), True, True)
+    assert [entry[0] for entry in registry.snapshot()] == ["aa:00:00:00:00:01"]
+
+
+def test_registry_reads_only_heard_devices_strongest_first():
+    registry = DeviceRegistry(read_interval=10, retry_interval=10)
+    got = []
+    gateway = MiaoMiaoGateway(
+        lambda device, packet: got.append(device.btaddr),
+        registry=registry,
+        out_of_range_interval=0.01,
+        max_reads=1,
+    )
+    for btaddr in ("aa:00:00:00:00:01", "aa:00:00:00:00:02", "aa:00:00:00:00:03"):
+        gateway.add_device(btaddr, transport=ReplayTransport(frames(2)))
+    registry.seen("aa:00:00:00:00:01", -90)
+    registry.seen("aa:00:00:00:00:02", -50)
+    # heard, but not one of the gateway's
+    registry.seen("ff:00:00:00:00:09", -30)
+    run_for(gateway, 0.3)
+    assert got == ["aa:00:00:00:00:02", "aa:00:00:00:00:01"]
+
@@ -0,0 +1,66 @@
+import pytest
+
+from miao2py.schedule import ReadScheduler
+
+# epoch time sensor minute 0 began
+START = 1000000.0
+
+
+def test_fallback_before_any_read():
+    assert ReadScheduler(fallback=42.0).next_read(START) == 42.0
+
+
+def test_reads_narrow_the_boundary():
+    scheduler = ReadScheduler()
+    scheduler.observe(100, START + 100 * 60 + 30)
+    assert scheduler.high - scheduler.low == 60
+    scheduler.observe(100, START + 100 * 60 + 50)
+    scheduler.observe(101, START + 101 * 60 + 10)
+    assert (scheduler.low, scheduler.high) == (START - 10, START + 10)
+
+
+def test_wide_window_aims_at_its_middle():
+    scheduler = ReadScheduler(guard=2.0)
+    now = START + 100 * 60 + 30
+    scheduler.observe(100, now)
+    # minute 0 began between START - 30 and START + 30
+    assert scheduler.next_read(now) == pytest.approx(START + 101 * 60 + 2 - now)
+
+
+def test_narrow_window_reads_after_the_boundary():
+    scheduler = ReadScheduler(guard=2.0, every=5)
+    scheduler.observe(100, START + 100 * 60 + 59)
+    now = START + 101 * 60 + 1
+    scheduler.observe(101, now)
+    assert scheduler.high - scheduler.low == 2
+    assert scheduler.next_read(now) == pytest.approx(START + 1 + 106 * 60 + 2 - now)
+
+
+def test_missed_reads_move_to_the_next_period():
+    scheduler = ReadScheduler(guard=2.0)
+    scheduler.observe(100, START + 100 * 60)
+    later = START + 150 * 60 + 30
+    delay = scheduler.next_read(later)
+    assert 0 < delay <= 60
+
+
+def test_idle_reads_back_off():
+    scheduler = ReadScheduler(backoff_initial=60.0, backoff_max=200.0)
+    delays = []
+    for _ in range(4):
+        scheduler.observe_idle()
+        delays.append(scheduler.next_read(START))
+    assert delays == [60.0, 120.0, 200.0, 200.0]
+    scheduler.observe(10, START)
+    assert scheduler.backoff == 0.0
+
+
+def test_notification_delay_tracks_completion():
+    scheduler = ReadScheduler(min_wait=0.5, max_wait=10.0)
+    assert scheduler.notification_delay == 10.0
+    for _ in range(20):
+        scheduler.observe(100, START + 100 * 60, completion=1.0)
+    assert scheduler.notification_delay == pytest.approx(1.0)
+    # an outlier widens the wait by four times the deviation it adds
+    scheduler.observe(100, START + 100 * 60, completion=0.0)
+    assert scheduler.notification_delay == pytest.approx(0.875 + 4 * 0.25)
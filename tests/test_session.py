@@ -0,0 +1,97 @@
+import datetime
+
+from miao2py.calibration import ConversionEngine
+from miao2py.delta import DeltaTracker
+from miao2py.packet import MiaoMiaoPacket
+from miao2py.replay import synthetic_frame
+from miao2py.session import SessionCache, decode_serial
+
+BASE = datetime.datetime(2026, 1, 1)
+# E3-12 of sensor 0M00031VE4H
+SENSOR_ID = bytes.fromhex("000000246d870100a007")
+
+
+def packet(minutes, serial=bytes(10), lazy=False):
+    frame = synthetic_frame(seed=minutes, minutes=minutes, serial=serial)
+    return MiaoMiaoPacket.from_bytes(frame, lazy=lazy)
+
+
+def received(minutes, seconds=0):
+    return BASE + datetime.timedelta(minutes=minutes, seconds=seconds)
+
+
+def sensor(i):
+    return bytes([i]) * 10
+
+
+def test_decode_serial():
+    assert decode_serial(SENSOR_ID) == "0M00031VE4H"
+    assert decode_serial(bytes(10)) == "00000000000"
+
+
+def test_session_enriches_packet():
+    sessions = SessionCache()
+    current = packet(1000, serial=SENSOR_ID, lazy=True)
+    session = sessions.update(current, received(1000), device="aa")
+    assert current.serial == "0M00031VE4H"
+    assert current.session is session
+    assert not current.sensor_swapped
+    assert current.librepacket.sensor_start == BASE
+    assert (session.reads, session.minutes, session.device) == (1, 1000, "aa")
+
+
+def test_start_is_stable_within_drift():
+    sessions = SessionCache()
+    sessions.update(packet(1000), received(1000))
+    later = packet(1001)
+    sessions.update(later, received(1001, 50))
+    assert later.librepacket.sensor_start == BASE
+    sessions.update(later, received(1010))
+    assert later.librepacket.sensor_start == BASE + datetime.timedelta(minutes=9)
+
+
+def test_restart_re_anchors():
+    sessions = SessionCache()
+    sessions.update(packet(1000), received(1000))
+    restarted = packet(10)
+    sessions.update(restarted, received(1001))
+    assert restarted.librepacket.sensor_start == BASE + datetime.timedelta(minutes=991)
+
+
+def test_sensor_swap():
+    sessions = SessionCache()
+    sessions.update(packet(1000, sensor(1)), received(1000), device="aa")
+    swapped = packet(20, sensor(2))
+    sessions.update(swapped, received(1001), device="aa")
+    assert swapped.sensor_swapped
+    again = packet(21, sensor(2))
+    sessions.update(again, received(1002), device="aa")
+    assert not again.sensor_swapped
+
+
+def test_evicted_sessions_release_their_devices():
+    sessions = SessionCache(max_sessions=2)
+    for i in range(5):
+        device = "reader{}".format(i)
+        sessions.update(packet(1000, sensor(i)), received(1000), device=device)
+    assert list(sessions.sessions) == [sensor(3), sensor(4)]
+    assert sessions.devices == {"reader3": sensor(3), "reader4": sensor(4)}
+    sessions.forget(sensor(4))
+    assert sessions.devices == {"reader3": sensor(3)}
+    assert sessions.get(sensor(4)) is None
+
+
+def test_engine_converter_kept_per_session():
+    sessions = SessionCache(engine=ConversionEngine())
+    session = sessions.update(packet(1000), received(1000))
+    assert session.calibration is not None
+    assert sessions.update(packet(1001), received(1001)).calibration is session.calibration
+
+
+def test_dated_from_session_start():
+    sessions = SessionCache()
+    tracker = DeltaTracker(sessions=sessions)
+    current = packet(1000)
+    session = sessions.update(current, received(1000))
+    readings = tracker.update(current)
+    assert readings[-1].timestamp == session.start + datetime.timedelta(minutes=1000)
@@ -0,0 +1,110 @@
+import subprocess
+import sys
+
+import pytest
+
+from miao2py.packet import MiaoMiaoPacket
+from miao2py.replay import synthetic_frame
+from miao2py.shmring import FrameRing, RingOverrun
+
+DEVICE = "aa:bb:cc:dd:ee:ff"
+
+
+@pytest.fixture
+def ring():
+    with FrameRing.create(slots=4) as ring:
+        yield ring
+
+
+def frames(count):
+    return [synthetic_frame(seed=i) for i in range(count)]
+
+
+def test_write_and_read(ring):
+    consumer = ring.consumer()
+    assert consumer.read() is None
+    for frame in frames(3):
+        ring.write(frame, DEVICE)
+    items = []
+    while consumer.pending:
+        item = consumer.read()
+        items.append((item.seq, item.device, bytes(item.frame)))
+        assert consumer.valid(item)
+        item.frame.release()
+    assert items == [(i, DEVICE, frame) for i, frame in enumerate(frames(3))]
+    assert consumer.read() is None
+
+
+def test_view_is_zero_copy_until_lapped(ring):
+    consumer = ring.consumer()
+    ring.write(b"\x28first")
+    item = consumer.read()
+    assert isinstance(item.frame, memoryview)
+    assert item.device is None
+    for frame in frames(4):
+        ring.write(frame)
+    assert not consumer.valid(item)
+    item.frame.release()
+
+
+def test_copy(ring):
+    consumer = ring.consumer(copy=True)
+    ring.write(frames(1)[0], DEVICE)
+    item = consumer.read()
+    assert isinstance(item.frame, bytes)
+    assert MiaoMiaoPacket.from_bytes(item.frame).sensor_id == bytes(10)
+
+
+def test_overrun_skips_to_oldest(ring):
+    consumer = ring.consumer(copy=True)
+    for frame in frames(7):
+        ring.write(frame)
+    assert [consumer.read().seq for _ in range(4)] == [3, 4, 5, 6]
+    assert consumer.lost == 3
+
+
+def test_strict_overrun_raises(ring):
+    consumer = ring.consumer(strict=True)
+    for frame in frames(6):
+        ring.write(frame)
+    with pytest.raises(RingOverrun) as raised:
+        consumer.read()
+    assert raised.value.lost == 2
+
+
+def test_start_positions(ring):
+    for frame in frames(6):
+        ring.write(frame)
+    assert ring.consumer(start="oldest").cursor == 2
+    assert ring.consumer(start="latest").pending == 0
+    assert ring.consumer(start=5).pending == 1
+
+
+def test_rejects_oversized_frames(ring):
+    with pytest.raises(ValueError):
+        ring.write(bytes(400))
+    with pytest.raises(ValueError):
+        FrameRing.create(slots=0)
+
+
+_consumer = """
+import sys
+from miao2py.shmring import RingConsumer
+consumer = RingConsumer(sys.argv[1], start="oldest", copy=True)
+for item in consumer.follow(timeout=0.5):
+    print(item.seq, item.device, len(item.frame))
+consumer.ring.close()
+"""
+
+
+def test_consumer_in_another_process(ring):
+    for frame in frames(2):
+        ring.write(frame, DEVICE)
+    output = subprocess.check_output(
+        [sys.executable, "-c", _consumer, ring.name], stderr=subprocess.STDOUT, timeout=30
+    )
+    expected = ["{} {} 363".format(seq, DEVICE) for seq in range(2)]
+    assert output.decode().splitlines() == expected
+    # the consumer leaving must not take the segment with it
+    with FrameRing.attach(ring.name) as attached:
+        assert attached.written == 2
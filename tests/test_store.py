@@ -0,0 +1,72 @@
+import datetime
+
+from miao2py.packet import MiaoMiaoPacket
+from miao2py.replay import synthetic_frame
+from miao2py.store import GlucoseStore
+
+SENSOR = "sensor"
+
+
+def filled(minutes=180, **kwargs):
+    store = GlucoseStore(**kwargs)
+    for minute in range(minutes):
+        store.add(SENSOR, minute * 60, float(minute))
+    return store
+
+
+def test_duplicates_stored_once():
+    store = GlucoseStore()
+    assert store.add(SENSOR, 60, 100.0)
+    assert not store.add(SENSOR, 60, 100.0)
+    assert store.add(SENSOR, 0, 90.0)
+    assert len(store) == 2
+    assert list(store.range(SENSOR)[0]) == [0.0, 60.0]
+
+
+def test_range_is_inclusive_across_buckets():
+    store = filled()
+    times, values = store.range(SENSOR, 59 * 60, 61 * 60)
+    assert list(times) == [3540.0, 3600.0, 3660.0]
+    assert list(values) == [59.0, 60.0, 61.0]
+    assert len(store.range(SENSOR)[0]) == 180
+    assert store.range("other") == store.range("other", 0, 10)
+
+
+def test_datetime_timestamps():
+    store = GlucoseStore()
+    when = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+    store.add(SENSOR, when, 5.5)
+    assert list(store.range(SENSOR, when, when)[0]) == [when.timestamp()]
+
+
+def test_latest():
+    times, values = filled().latest(SENSOR, 3)
+    assert list(values) == [177.0, 178.0, 179.0]
+    assert len(filled().latest(SENSOR, 500)[0]) == 180
+
+
+def test_downsample():
+    windows = filled().downsample(SENSOR, 0, 180 * 60, 3600)
+    assert [window[0] for window in windows] == [0.0, 3600.0, 7200.0]
+    assert windows[0] == (0.0, 0.0, 29.5, 59.0, 60)
+    partial = filled().downsample(SENSOR, 30 * 60, 89 * 60, 3600)
+    assert partial[0][1:] == (30.0, 44.5, 59.0, 30)
+
+
+def test_evicts_oldest_buckets():
+    # three full buckets take 2928 bytes
+    store = filled(memory_budget=2000)
+    assert store.nbytes <= 2000
+    times = store.range(SENSOR)[0]
+    assert times[-1] == 179 * 60
+    assert times[0] >= 3600
+
+
+def test_add_packet_dedupes_rings():
+    store = GlucoseStore()
+    frame = synthetic_frame(seed=1, minutes=1000)
+    received = datetime.datetime(2026, 1, 1)
+    # the newest history entry shares its minute with a trend entry
+    assert store.add_packet(MiaoMiaoPacket.from_bytes(frame), received) == 47
+    assert store.add_packet(MiaoMiaoPacket.from_bytes(frame), received) == 0
+    assert len(store) == 47
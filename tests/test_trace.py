@@ -0,0 +1,68 @@
+import pytest
+
+from miao2py import offline, trace
+from miao2py.device import MiaoMiaoDevice
+from miao2py.packet import MiaoMiaoPacket
+from miao2py.replay import ReplayTransport, synthetic_frame
+
+BTADDR = "aa:00:00:00:00:01"
+
+
+@pytest.fixture
+def events():
+    got = []
+    previous = trace.tracer
+    yield got, lambda **kwargs: trace.use(trace.Tracer(sink=got.append, **kwargs))
+    trace.use(previous)
+
+
+class Decoder(MiaoMiaoDevice):
+    def handlePacket(self, data):
+        self.packet = MiaoMiaoPacket.from_bytes(data)
+        super().handlePacket(data)
+
+
+def read(frames):
+    device = Decoder(BTADDR, transport=ReplayTransport(frames))
+    device.connect()
+    device.start_notify()
+    for _ in frames:
+        while device.notify_wait(0.01):
+            pass
+        device.start_data_notify()
+    return device
+
+
+def test_disabled_by_default():
+    tracer = trace.Tracer()
+    assert not tracer.enabled
+    assert tracer.start("frame") is None
+
+
+def test_samples_one_in_n():
+    tracer = trace.Tracer(sample=3)
+    spans = [tracer.start("frame") for _ in range(7)]
+    assert [span is not None for span in spans] == [True, False, False] * 2 + [True]
+
+
+def test_span_event_per_sampled_frame(events):
+    got, use = events
+    use(sample=2)
+    read([synthetic_frame(seed=i) for i in range(4)])
+    assert len(got) == 2
+    event = got[0]
+    assert event["span"] == "frame"
+    assert event["device"] == BTADDR
+    assert event["sensor"] == "00" * 10
+    assert set(event["stages"]) == {"reassembly", "decode", "handle"}
+    assert event["total_us"] >= event["stages"]["handle"]
+
+
+def test_dump_reads_back(events, tmp_path):
+    got, use = events
+    tracer = use(frames=2)
+    frames = [synthetic_frame(seed=i) for i in range(3)]
+    read(frames)
+    assert got == []
+    path = tracer.dump(str(tmp_path / "frames.hex"))
+    assert [frame for _, _, frame in offline.iter_frames([path])] == frames[1:]
@@ -0,0 +1,46 @@
+import pytest
+
+from miao2py.packet import MiaoMiaoPacket, MiaoMiaoPacketView
+from miao2py.replay import synthetic_frame
+
+
+def test_view_matches_eager():
+    frame = synthetic_frame(seed=3, minutes=2000, battery=55)
+    eager = MiaoMiaoPacket.from_bytes(frame)
+    lazy = MiaoMiaoPacket.from_bytes(frame, lazy=True)
+    assert isinstance(lazy, MiaoMiaoPacketView)
+    for name in ("sensor_id", "battery", "fw_version", "hw_version"):
+        assert getattr(lazy, name) == getattr(eager, name)
+    for name in ("minutes", "index_trend", "index_history", "trends", "history"):
+        assert getattr(lazy.librepacket, name) == getattr(eager.librepacket, name)
+    assert lazy.librepacket.trend(3) == eager.librepacket.trends[3]
+
+
+def test_view_is_zero_copy():
+    frame = bytearray(synthetic_frame(seed=4))
+    lazy = MiaoMiaoPacket.from_bytes(frame, lazy=True)
+    assert isinstance(lazy.payload, memoryview)
+    assert lazy.payload.obj is frame
+
+
+def test_views_have_no_dict():
+    lazy = MiaoMiaoPacket.from_bytes(synthetic_frame(), lazy=True)
+    with pytest.raises(AttributeError):
+        lazy.whatever = 1
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_rejects_bad_envelopes(lazy):
+    frame = synthetic_frame()
+    for bad in (b"\x00" + frame[1:], frame[:-1] + b"\x00", frame + b"\x29"):
+        with pytest.raises(ValueError):
+            MiaoMiaoPacket.from_bytes(bad, lazy=lazy)
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_verify_rejects_bad_crc(lazy):
+    frame = bytearray(synthetic_frame())
+    MiaoMiaoPacket.from_bytes(bytes(frame), lazy=lazy, verify=True)
+    frame[100] ^= 0xFF
+    with pytest.raises(ValueError):
+        MiaoMiaoPacket.from_bytes(bytes(frame), lazy=lazy, verify=True)
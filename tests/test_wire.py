@@ -0,0 +1,62 @@
+import pytest
+
+from miao2py import wire
+from miao2py.calibration import LinearConverter
+from miao2py.delta import DeltaTracker
+from miao2py.packet import MiaoMiaoPacket
+from miao2py.replay import synthetic_frame
+
+
+@pytest.mark.parametrize("value", [0, 1, 127, 128, 300, 2 ** 32, 2 ** 63])
+def test_varint_round_trip(value):
+    out = bytearray()
+    wire.write_varint(out, value)
+    assert wire.read_varint(bytes(out) + b"\xff", 0) == (value, len(out))
+
+
+def test_full_record_round_trip():
+    packet = MiaoMiaoPacket.from_bytes(synthetic_frame(seed=1, battery=77))
+    record = wire.CompactRecord.from_bytes(wire.encode(packet))
+    assert not record.delta
+    assert record.battery == 77
+    assert record.minutes == packet.librepacket.minutes
+    assert record.sensor_id == packet.sensor_id
+    assert record.trends == [entry[0] for entry in packet.librepacket.trends]
+    assert record.history == [entry[0] for entry in packet.librepacket.history]
+
+
+def test_delta_record_holds_new_readings():
+    tracker = DeltaTracker()
+    tracker.update(MiaoMiaoPacket.from_bytes(synthetic_frame(seed=1, minutes=1000)))
+    packet = MiaoMiaoPacket.from_bytes(synthetic_frame(seed=2, minutes=1002))
+    record = wire.CompactRecord.from_bytes(wire.encode(packet, tracker.update(packet)))
+    assert record.delta
+    assert record.trends == [entry[0] for entry in packet.librepacket.trends[:2]]
+    assert record.history == []
+
+
+def test_lazy_view_encodes_the_same():
+    frame = synthetic_frame(seed=3)
+    eager = wire.encode(MiaoMiaoPacket.from_bytes(frame))
+    assert wire.encode(MiaoMiaoPacket.from_bytes(frame, lazy=True)) == eager
+
+
+def test_decode_by_topic():
+    frame = synthetic_frame(seed=4)
+    packet = MiaoMiaoPacket.from_bytes(frame)
+    topic = "miaomiao/aa"
+    compact = wire.decode(wire.compact_topic(topic), wire.encode(packet))
+    assert isinstance(compact, wire.CompactRecord)
+    assert wire.decode(topic, frame).sensor_id == packet.sensor_id
+
+
+def test_rejects_non_compact():
+    with pytest.raises(ValueError):
+        wire.CompactRecord.from_bytes(synthetic_frame())
+
+
+def test_converter_does_not_change_raw_words():
+    frame = synthetic_frame(seed=5)
+    converter = LinearConverter(slope=1 / 9.0, offset=-4.0)
+    packet = MiaoMiaoPacket.from_bytes(frame, converter=converter)
+    assert wire.encode(packet) == wire.encode(MiaoMiaoPacket.from_bytes(frame))